@@ -0,0 +1,124 @@
+"""Compact JSON for Warbler's feed API.
+
+`/api/timeline` and `/api/users/<id>/messages` send the same pages as the
+homepage and the profile, as flat items:
+
+    {"items": [{"id": 7, "text": "...", "timestamp": "2023-01-01T12:00:00",
+                "user_id": 3, "username": "ann", "image_url": "...",
+                "liked": false}, ...],
+     "next_cursor": "..."}
+
+`fields=id,text` sends only those fields of each item, `limit=` (at most
+PAGE_SIZE) shortens the page, and `before=` takes the `next_cursor` of
+the page before, as on the HTML pages.
+
+`/api/users?ids=3,5,8` sends the public profiles of up to MAX_USERS users
+at once, in the order asked for, to fill in the authors of feed items.
+Ids with no user are left out. `fields=` works there too.
+
+Responses are encoded with orjson when it is installed, and otherwise
+with the standard library's json, without whitespace either way.
+"""
+
+import json
+from operator import attrgetter
+
+from flask import current_app
+
+from pagination import PAGE_SIZE
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FEED_FIELDS = {
+    'id': attrgetter('id'),
+    'text': attrgetter('text'),
+    'timestamp': attrgetter('timestamp'),
+    'user_id': attrgetter('user.id'),
+    'username': attrgetter('user.username'),
+    'image_url': attrgetter('user.image_url'),
+    'liked': attrgetter('liked'),
+}
+
+USER_FIELDS = {name: attrgetter(name) for name in (
+    'id', 'username', 'image_url', 'header_image_url', 'bio', 'location',
+    'messages_count', 'following_count', 'followers_count', 'likes_count')}
+
+# most users one /api/users request may ask for
+MAX_USERS = 100
+
+
+def dumps(obj):
+    """`obj` as compact JSON bytes; datetimes become ISO 8601 strings."""
+
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False,
+                      default=lambda value: value.isoformat()).encode()
+
+
+def feed_args(args):
+    """The `(fields, limit)` asked for in the query string `args`.
+
+    Raises ValueError, with a message for the client, on an unknown field
+    or a limit that isn't a positive number.
+    """
+
+    try:
+        limit = int(args.get('limit', PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        raise ValueError("limit must be a positive number.")
+    return _fields(args, FEED_FIELDS), min(limit, PAGE_SIZE)
+
+
+def users_args(args):
+    """The `(user_ids, fields)` asked for in the query string `args`.
+
+    Raises ValueError, with a message for the client, on a malformed id
+    list, more than MAX_USERS ids or an unknown field.
+    """
+
+    try:
+        user_ids = list(dict.fromkeys(
+            int(user_id) for user_id in args.get('ids', '').split(',') if user_id))
+    except ValueError:
+        raise ValueError("ids must be comma separated numbers.") from None
+    if len(user_ids) > MAX_USERS:
+        raise ValueError(f"At most {MAX_USERS} ids at a time.")
+    return user_ids, _fields(args, USER_FIELDS)
+
+
+def _fields(args, allowed):
+    if not args.get('fields'):
+        return list(allowed)
+
+    fields = [name.strip() for name in args['fields'].split(',')]
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}.")
+    return fields
+
+
+def _response(body):
+    return current_app.response_class(dumps(body), mimetype='application/json')
+
+
+def feed_response(page, fields):
+    """A JSON response for a Page of FeedItems, with only `fields` of each."""
+
+    getters = [(name, FEED_FIELDS[name]) for name in fields]
+    return _response({'items': [{name: get(item) for name, get in getters}
+                                for item in page.items],
+                      'next_cursor': page.next_cursor})
+
+
+def users_response(users, fields):
+    """A JSON response for a list of Users, with only `fields` of each."""
+
+    getters = [(name, USER_FIELDS[name]) for name in fields]
+    return _response({'users': [{name: get(user) for name, get in getters}
+                                for user in users]})
@@ -1,43 +1,64 @@
+"""Warbler, a Flask Twitter clone.
+
+`create_app(profile)` builds the app from one of the profiles in
+`config.py`. The routes below are registered on it as the `warbler`
+blueprint. Production servers load `wsgi.py`, which builds the
+production app and, under a prefork server, preloads it in the master,
+so workers start warm and share its memory:
+
+    gunicorn --preload --workers 4 wsgi:app
+
+`from app import app` still works, for the tests and `flask run`: it
+builds an app from the WARBLER_PROFILE profile (default: development) on
+first use.
+"""
+
+import gc
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+import click
+from flask import (Blueprint, Flask, render_template, request, flash, redirect,
+                   session, g, jsonify, abort, current_app)
 from sqlalchemy.exc import IntegrityError
 # from csv import DictReader
+from config import PROFILES
 from forms import UserAddForm, LoginForm, MessageForm, EditUserForm
-from models import db, connect_db, User, Message, Likes
+from models import db, connect_db, Follows, User, Message
+from pagination import PAGE_SIZE
 from utils import array_to_set
-# seed db, use in command line using ipython
-from seed import init_db
+import api
+import conditional
+import counters
+import feed
+import fragments
+import graph
+import identity
+import likes
+import metrics
+import passwords
+import reads
+import routing
+import search
+import suggestions
+import timeline
+import writebehind
 
 CURR_USER_KEY = "curr_user"
+BUSY_MESSAGE = "Warbler is very busy right now, please try again in a moment."
 
-app = Flask(__name__)
-
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
-
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-# app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-toolbar = DebugToolbarExtension(app)
-
-connect_db(app)
+# maintenance commands are `flask purge` etc., not `flask warbler purge`
+bp = Blueprint('warbler', __name__, cli_group=None)
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.filter(User.id==session[CURR_USER_KEY]).first()
+        g.user = identity.load_user(session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -56,7 +77,7 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
-@app.route('/signup', methods=["GET", "POST"])
+@bp.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -78,6 +99,7 @@ def signup():
                 image_url=form.image_url.data or User.image_url.default.arg
             )
             db.session.commit()
+            search.index_user(user)
 
         except IntegrityError as err:
             # check if username or email is already in database
@@ -93,6 +115,11 @@ def signup():
             flash(f"{field_err} already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
+        except passwords.HashingBusy:
+            db.session.rollback()
+            flash(BUSY_MESSAGE, 'danger')
+            return render_template('users/signup.html', form=form), 503
+
         do_login(user)
 
         return redirect("/")
@@ -101,16 +128,23 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
     form = LoginForm()
 
     if form.validate_on_submit():
-        user = User.authenticate(form.username.data,
-                                 form.password.data)
+        try:
+            user = User.authenticate(form.username.data,
+                                     form.password.data)
+        except passwords.HashingBusy:
+            flash(BUSY_MESSAGE, 'danger')
+            return render_template('users/login.html', form=form), 503
 
         if user:
+            # save the password hash if it was upgraded to more rounds
+            db.session.commit()
+            identity.forget(user.id)
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -120,7 +154,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     """Handle logout of user."""
     if not g.user:
@@ -135,81 +169,121 @@ def logout():
 ##############################################################################
 # General user routes:
 
-@app.route('/users')
+@bp.route('/users')
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username,
+    and a 'page' param for the page of results.
     """
 
-    search = request.args.get('q')
-
-    if not search:
-        users = User.query.all()
+    query = request.args.get('q', '').strip()
+    if reads.enabled():
+        page = reads.search_users(query, request.args.get('page', 1, type=int))
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        page = search.search_users(query, request.args.get('page', 1, type=int))
+    if g.user:
+        g.user.load_following(page.users)
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html',
+                           users=page.users,
+                           query=query,
+                           page=page.page,
+                           has_next=page.has_next)
 
 
-@app.route('/users/<int:user_id>')
+@bp.route('/users/<int:user_id>')
+@conditional.etag(conditional.profile_stamp)
 def users_show(user_id):
     """Show user profile."""
-    
+
+    if reads.enabled():
+        user, page = reads.user_page(user_id,
+                                     viewer_id=g.user and g.user.id,
+                                     cursor=request.args.get('before'))
+        if user is None:
+            abort(404)
+        return render_template('users/show.html',
+                               user=user,
+                               messages=page.items,
+                               next_cursor=page.next_cursor)
+
     user = User.query.filter(User.id==user_id).first()
+    if user is None:
+        abort(404)
 
-    # snagging messages in order from the database;
+    # snagging messages in order from the database, a page at a time;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
-
-@app.route("/users/likes/<int:user_id>")
+    page = feed.user_messages(user_id,
+                              viewer_id=g.user and g.user.id,
+                              cursor=request.args.get('before'))
+    return render_template('users/show.html',
+                           user=user,
+                           messages=page.items,
+                           next_cursor=page.next_cursor)
+
+@bp.route("/users/likes/<int:user_id>")
 def display_likes(user_id):
     """Show users likes page"""
     
     user = User.query.filter(User.id==user_id).first()
-
-    return render_template('users/likes.html', user=user, messages=user.likes)
-
-# **************************************
-# **************** ATTN!!! *************
-# ************* AJAX call needs ********
-# ************ to be implemented *******
-# **************************************
-@app.route('/users/add_like/<int:message_id>', methods=["POST"])
+    if user is None:
+        abort(404)
+
+    # most recently liked first, a page at a time
+    page = feed.liked_messages(user_id,
+                               viewer_id=g.user and g.user.id,
+                               cursor=request.args.get('before'))
+    return render_template('users/likes.html',
+                           user=user,
+                           messages=page.items,
+                           next_cursor=page.next_cursor)
+
+@bp.route('/users/add_like/<int:message_id>', methods=["POST"])
 def messages_liked(message_id):
-    """Liked message"""
+    """Like or unlike a message (form fallback for the like API)."""
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-    
+
+    if current_app.config['WRITE_BEHIND']:
+        writebehind.toggle_like(g.user.id, message_id)
+        return redirect(request.referrer or "/")
+
     try:
-        if (liked:=Likes.query.filter(Likes.user_id==g.user.id)
-            .filter(Likes.message_id==message_id)
-            .first()):
-            db.session.delete(liked)
-            db.session.commit()
-            return redirect("/")
-        like = Likes(user_id=g.user.id, message_id=message_id)
-        db.session.add(like)
+        likes.toggle(g.user.id, message_id)
         db.session.commit()
-    except IntegrityError as err:
+        identity.forget(g.user.id)
+    except IntegrityError:
+        # the message doesn't exist (any more)
         db.session.rollback()
-    except:
-        print('did not go through')
-    return redirect("/")
-# ***************** UBOVE **************
-# **************** ATTN!!! *************
-# ************* AJAX call needs ********
-# ************ to be implemented *******
-# **************************************
-
-@app.route('/users/<int:user_id>/following')
+    return redirect(request.referrer or "/")
+
+def follows_page(user_id, followers=False):
+    """A page of the users `user_id` follows (or, with `followers`, who
+    follow them), by id, after the `after` id in the query string.
+
+    Returns the users and the `after` id of the next page, or None.
+    """
+
+    if followers:
+        user_col, by_col = Follows.user_following_id, Follows.user_being_followed_id
+    else:
+        user_col, by_col = Follows.user_being_followed_id, Follows.user_following_id
+
+    # walks the follows index for `user_id` from `after` on
+    users = (User.query.join(Follows, user_col == User.id)
+             .filter(by_col == user_id)
+             .filter(user_col > request.args.get('after', 0, type=int))
+             .order_by(user_col)
+             .limit(PAGE_SIZE + 1)
+             .all())
+    if len(users) <= PAGE_SIZE:
+        return users, None
+    return users[:PAGE_SIZE], users[PAGE_SIZE - 1].id
+
+
+@bp.route('/users/<int:user_id>/following')
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -218,10 +292,15 @@ def show_following(user_id):
         return redirect("/")
 
     user = User.query.filter(User.id==user_id).first()
-    return render_template('users/following.html', user=user)
+    if user is None:
+        abort(404)
+    following, next_after = follows_page(user_id)
+    g.user.load_following(following)
+    return render_template('users/following.html', user=user, following=following,
+                           next_after=next_after)
 
 
-@app.route('/users/<int:user_id>/followers')
+@bp.route('/users/<int:user_id>/followers')
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -230,10 +309,15 @@ def users_followers(user_id):
         return redirect("/")
 
     user = User.query.filter(User.id==user_id).first()
-    return render_template('users/followers.html', user=user)
+    if user is None:
+        abort(404)
+    followers, next_after = follows_page(user_id, followers=True)
+    g.user.load_following(followers)
+    return render_template('users/followers.html', user=user, followers=followers,
+                           next_after=next_after)
 
 
-@app.route('/users/follow/<int:follow_id>', methods=['POST'])
+@bp.route('/users/follow/<int:follow_id>', methods=['POST'])
 def add_follow(follow_id):
     """Add a follow for the currently-logged-in user."""
 
@@ -241,14 +325,24 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    if current_app.config['WRITE_BEHIND']:
+        writebehind.set_follow(g.user.id, follow_id, True)
+        return redirect(f"/users/{g.user.id}/following")
+
     followed_user = User.query.filter(User.id==follow_id).first()
-    g.user.following.append(followed_user)
+    if followed_user is None:
+        abort(404)
+    # following someone already followed changes nothing
+    if graph.follow(g.user.id, followed_user.id):
+        timeline.add_follow(g.user.id, followed_user.id)
+        counters.follow(g.user.id, followed_user.id)
     db.session.commit()
+    identity.forget(g.user.id, follow_id)
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
+@bp.route('/users/stop-following/<int:follow_id>', methods=['POST'])
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user."""
 
@@ -256,14 +350,23 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    if current_app.config['WRITE_BEHIND']:
+        writebehind.set_follow(g.user.id, follow_id, False)
+        return redirect(f"/users/{g.user.id}/following")
+
     followed_user = User.query.filter(User.id==follow_id).first()
-    g.user.following.remove(followed_user)
+    if followed_user is None:
+        abort(404)
+    if graph.unfollow(g.user.id, followed_user.id):
+        timeline.remove_follow(g.user.id, followed_user.id)
+        counters.follow(g.user.id, followed_user.id, delta=-1)
     db.session.commit()
+    identity.forget(g.user.id, follow_id)
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@bp.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Update profile for current user."""
     if not g.user:
@@ -281,7 +384,14 @@ def profile():
                 user.image_url        = form.image_url.data or "/static/images/default-pic.png"
                 user.header_image_url = form.header_image_url.data or "/static/images/warbler-hero.jpg"
                 user.bio              = form.bio.data
+                user.version          = User.version + 1
+                user.profile_version  = User.profile_version + 1
+                # followers' homepages show the name and picture
+                counters.bump_many(db.select(Follows.user_following_id)
+                                   .where(Follows.user_being_followed_id == user.id))
                 db.session.commit()
+                identity.forget(user.id)
+                search.index_user(user)
                 flash('Updated successful', 'success')
                 return redirect(f'/users/{user.id}')
             else:
@@ -298,9 +408,12 @@ def profile():
             db.session.rollback()
             flash(f"{field_err} already taken", 'danger')
             return render_template('users/edit.html', form=form)
+        except passwords.HashingBusy:
+            flash(BUSY_MESSAGE, 'danger')
+            return render_template('users/edit.html', form=form), 503
     return render_template('users/edit.html', form=form)
 
-@app.route('/users/delete', methods=["POST"])
+@bp.route('/users/delete', methods=["POST"])
 def delete_user():
     """Delete user."""
 
@@ -310,8 +423,15 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    # deleting and purging are rare; only loaded when they happen
+    import deletion
+
+    user_id = g.user.id
+    # the rows go later, in `flask purge`
+    deletion.delete_user(user_id)
     db.session.commit()
+    identity.forget(user_id)
+    search.unindex_user(user_id)
 
     return redirect("/signup")
 
@@ -319,7 +439,7 @@ def delete_user():
 ##############################################################################
 # Messages routes:
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@bp.route('/messages/new', methods=["GET", "POST"])
 def messages_add():
     """Add a message:
 
@@ -335,22 +455,32 @@ def messages_add():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        db.session.flush()
+        timeline.push_message(msg)
+        counters.bump(g.user.id, messages_count=1)
         db.session.commit()
+        identity.forget(g.user.id)
 
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/new.html', form=form)
 
 
-@app.route('/messages/<int:message_id>', methods=["GET"])
+@bp.route('/messages/<int:message_id>', methods=["GET"])
+@conditional.etag(conditional.message_stamp)
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.filter(Message.id==message_id).first()
+    if reads.enabled():
+        msg = reads.message(message_id, viewer_id=g.user and g.user.id)
+    else:
+        msg = feed.message(message_id, viewer_id=g.user and g.user.id)
+    if msg is None:
+        abort(404)
     return render_template('messages/show.html', message=msg)
 
 
-@app.route('/messages/<int:message_id>/delete', methods=["POST"])
+@bp.route('/messages/<int:message_id>/delete', methods=["POST"])
 def messages_destroy(message_id):
     """Delete a message."""
 
@@ -358,55 +488,290 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    import deletion
+
     msg = Message.query.filter(Message.id==message_id).first()
-    db.session.delete(msg)
+    deletion.delete_message(msg)
     db.session.commit()
+    identity.forget(msg.user_id)
 
     return redirect(f"/users/{g.user.id}")
 
+##############################################################################
+# API routes (JSON)
+
+@bp.route('/api/messages/<int:message_id>/like', methods=["POST", "DELETE"])
+def api_like(message_id):
+    """Like (POST) or unlike (DELETE) a message.
+
+    Returns the new like state and the message's like count as JSON.
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    if current_app.config['WRITE_BEHIND']:
+        liked = request.method == "POST"
+        if writebehind.set_like(g.user.id, message_id, liked) is None:
+            return jsonify(error="Message not found."), 404
+        return jsonify(message_id=message_id,
+                       liked=liked,
+                       likes=likes.count(message_id)
+                       + writebehind.likes_delta(message_id))
+
+    try:
+        if request.method == "POST":
+            changed = likes.like(g.user.id, message_id)
+        else:
+            changed = likes.unlike(g.user.id, message_id)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify(error="Message not found."), 404
+
+    if changed:
+        identity.forget(g.user.id)
+
+    return jsonify(message_id=message_id,
+                   liked=request.method == "POST",
+                   likes=likes.count(message_id))
+
+
+@bp.route('/api/timeline')
+@conditional.etag(conditional.home_stamp)
+def api_timeline():
+    """The logged in user's homepage messages as JSON, a page at a time.
+
+    Takes `before`, `limit` and `fields` (see `api`).
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    try:
+        fields, limit = api.feed_args(request.args)
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+
+    page = timeline.home_page(g.user.id, cursor=request.args.get('before'),
+                              limit=limit)
+    return api.feed_response(page, fields)
+
+
+@bp.route('/api/users')
+def api_users():
+    """Public profiles and counters of the users in `ids`, as JSON.
+
+    Takes `ids` (at most `api.MAX_USERS`) and `fields` (see `api`).
+    """
+
+    try:
+        user_ids, fields = api.users_args(request.args)
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+
+    found = identity.users_by_ids(user_ids)
+    return api.users_response([found[user_id] for user_id in user_ids
+                               if user_id in found], fields)
+
+
+@bp.route('/api/users/<int:user_id>/messages')
+@conditional.etag(conditional.profile_stamp)
+def api_user_messages(user_id):
+    """A user's messages as JSON, newest first, a page at a time.
+
+    Takes `before`, `limit` and `fields` (see `api`).
+    """
+
+    if db.session.get(User, user_id) is None:
+        return jsonify(error="User not found."), 404
+
+    try:
+        fields, limit = api.feed_args(request.args)
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+
+    page = feed.user_messages(user_id,
+                              viewer_id=g.user and g.user.id,
+                              cursor=request.args.get('before'),
+                              limit=limit)
+    return api.feed_response(page, fields)
+
+
 ##############################################################################
 # Homepage and error pages
 
 
-@app.route('/')
+@bp.route('/')
+@conditional.etag(conditional.home_stamp)
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: 100 most recent messages of followed_users,
+      read from the user's precomputed timeline; older pages
+      are reached through the `before` cursor
     """
 
-    if g.user:
-        following_ids = [g.user.id] + [following.id for following in g.user.following]
-        like_ids = [like.id for like in g.user.likes]
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-        return render_template('home.html', messages=messages, like_ids=like_ids)
+    if g.user and reads.enabled():
+        page, suggested = reads.home_page(g.user.id,
+                                          cursor=request.args.get('before'))
+        return render_template('home.html',
+                               messages=page.items,
+                               next_cursor=page.next_cursor,
+                               suggested=suggested)
+
+    elif g.user:
+        page = timeline.home_page(g.user.id, cursor=request.args.get('before'))
+        return render_template('home.html',
+                               messages=page.items,
+                               next_cursor=page.next_cursor,
+                               suggested=suggestions.for_user(g.user.id))
 
     else:
         return render_template('home-anon.html')
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
+# Maintenance commands
+
+
+@bp.cli.command('reconcile-counters')
+def reconcile_counters():
+    """Recompute every user's stats counters, repairing any drift."""
+
+    repaired = counters.reconcile()
+    print(f"Reconciled counters, {repaired} users repaired")
+
+
+@bp.cli.command('migrate')
+def migrate():
+    """Apply pending schema migrations to an existing database."""
+
+    # only needed by this command
+    import migrations
+
+    applied = migrations.upgrade()
+    for migration in applied:
+        print(f"Applied {migration.version}: {migration.description}")
+    if not applied:
+        print("Schema is up to date")
+
+
+@bp.cli.command('purge')
+@click.option('--watch', is_flag=True,
+              help='keep purging, every PURGE_INTERVAL seconds')
+@click.option('--batch-size', type=int, default=None,
+              help='rows removed per transaction (default PURGE_BATCH)')
+def purge(watch, batch_size):
+    """Remove deleted accounts and messages, in batches."""
+
+    import deletion
+
+    batch_size = batch_size or deletion.PURGE_BATCH
+    if watch:
+        deletion.watch(batch_size)
+    messages, users = deletion.purge(batch_size)
+    print(f"Purged {messages} messages and {users} users")
+
+
+@bp.cli.command('suggest')
+@click.option('--shard', default='0/1',
+              help='i/n: compute the i-th of n equal shares of the users')
+@click.option('--users', default=None,
+              help='comma separated ids of the only users to compute')
+def suggest(shard, users):
+    """Recompute the "who to follow" suggestions."""
+
+    # numpy and scipy are only needed by the batch job
+    import recommend
+
+    shard, shards = (int(part) for part in shard.split('/'))
+    user_ids = [int(user_id) for user_id in users.split(',')] if users else None
+    recommend.compute(user_ids, shard=shard, shards=shards)
+
+
+##############################################################################
+# Turn off caching in Flask for responses that can't be revalidated
+#   (pages tagged by `conditional` and static files carry an ETag, and
+#   are cached and revalidated by the browser)
 #
 # https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
 
-@app.after_request
+@bp.after_app_request
 def add_header(req):
-    """Add non-caching headers on every request."""
+    """Add non-caching headers to responses without a validator."""
 
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
+    if req.get_etag() == (None, None):
+        req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+        req.headers["Pragma"] = "no-cache"
+        req.headers["Expires"] = "0"
     return req
 
+
+
+##############################################################################
+# The app
+
+
+def create_app(profile=None):
+    """A Warbler app configured from `profile`, a name in `config.PROFILES`
+    (default: the WARBLER_PROFILE environment variable, else development)."""
+
+    profile = profile or os.environ.get('WARBLER_PROFILE', 'development')
+    app = Flask(__name__)
+    app.config.from_object(PROFILES[profile])
+
+    if app.config['DEV_TOOLS']:
+        # kept out of the other profiles' imports
+        from flask_debugtoolbar import DebugToolbarExtension
+        from seed import init_db
+
+        DebugToolbarExtension(app)
+        # seed db from `flask shell`
+        app.shell_context_processor(lambda: {'init_db': init_db})
+
+    connect_db(app)
+    routing.init_routing(app)
+    metrics.init_metrics(app)
+    fragments.init_fragments(app)
+    writebehind.init_writebehind(app)
+    app.register_blueprint(bp)
+    return app
+
+
+def preload(app):
+    """Warm `app` in a prefork master, before the workers are forked.
+
+    Compiles every template and loads the follow graph, so workers start
+    with them already in (copy-on-write shared) memory. Then closes the
+    master's database connections, which mustn't be shared with the
+    workers, and freezes the garbage collector so collections in the
+    workers don't touch, and so copy, the preloaded objects' pages.
+    """
+
+    with app.app_context():
+        for name in app.jinja_env.list_templates():
+            app.jinja_env.get_template(name)
+        conditional.template_version()
+        graph.get()
+
+        for engine in db.engines.values():
+            engine.dispose()
+
+    gc.freeze()
+
+
+def __getattr__(name):
+    """The module's `app`, built on first use (see the module docstring)."""
+
+    global app
+
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    app = create_app()
+    return app
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
@@ -0,0 +1,143 @@
+"""Compare the JSON feed API with the HTML pages it mirrors.
+
+Requests the homepage and profiles of logged-in users as HTML, as full
+JSON (/api/timeline, /api/users/<id>/messages) and as sparse JSON
+(fields=id,text,timestamp), one request at a time. Reports, per route,
+the bytes and the CPU time of this process per feed item, and the p50
+latency:
+
+    DATABASE_URL=postgresql:///warbler-bench \\
+        python benchmarks/bench_api.py --skip-seed
+
+CPU time is the app's own (the database runs in another process), so it
+is what rendering or serializing a page costs a web worker.
+
+Seeds the database first (dropping its tables) unless --skip-seed is
+given; see bench_routes.py for the dataset options.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from statistics import median
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from bench_routes import prepare_users, seed_dataset  # noqa: E402
+from app import app, CURR_USER_KEY  # noqa: E402
+from models import db, User  # noqa: E402
+import api  # noqa: E402
+import graph  # noqa: E402
+
+SPARSE = 'fields=id,text,timestamp'
+
+# route: the URL of each variant, for a profile id
+ROUTES = {
+    'home': {'html': lambda user_id: '/',
+             'json': lambda user_id: '/api/timeline',
+             'sparse': lambda user_id: f'/api/timeline?{SPARSE}'},
+    'profile': {'html': lambda user_id: f'/users/{user_id}',
+                'json': lambda user_id: f'/api/users/{user_id}/messages',
+                'sparse': lambda user_id: f'/api/users/{user_id}/messages?{SPARSE}'},
+}
+
+
+def items_in(resp, variant):
+    """How many feed items `resp` carries."""
+
+    if variant == 'html':
+        return resp.get_data(as_text=True).count('<li class="list-group-item')
+    return len(resp.json['items'])
+
+
+def measure(users, rounds, user_count, rng):
+    """(bytes, cpu seconds, wall seconds, items) samples per (route, variant)."""
+
+    results = defaultdict(list)
+    client = app.test_client()
+    for _ in range(rounds):
+        for user in users:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user.id
+            profile_id = rng.randint(1, user_count)
+
+            for route, variants in ROUTES.items():
+                for variant, url in variants.items():
+                    cpu = time.process_time()
+                    wall = time.perf_counter()
+                    resp = client.get(url(profile_id))
+                    wall = time.perf_counter() - wall
+                    cpu = time.process_time() - cpu
+                    results[route, variant].append(
+                        (len(resp.get_data()), cpu, wall, items_in(resp, variant)))
+    return results
+
+
+def summarize(results):
+    summary = {}
+    for (route, variant), samples in sorted(results.items()):
+        items = sum(sample[3] for sample in samples) or 1
+        summary[f'{route} {variant}'] = {
+            'requests': len(samples),
+            'items_per_request': items / len(samples),
+            'bytes_per_item': sum(sample[0] for sample in samples) / items,
+            'cpu_us_per_item': sum(sample[1] for sample in samples) / items * 1e6,
+            'p50_ms': median(sample[2] for sample in samples) * 1000,
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--follows', type=int, default=20000)
+    parser.add_argument('--likes', type=int, default=20000)
+    parser.add_argument('--seed', default='bench')
+    parser.add_argument('--skip-seed', action='store_true',
+                        help='reuse the data from a previous run')
+    parser.add_argument('--sessions', type=int, default=20,
+                        help='logged-in users whose pages are requested')
+    parser.add_argument('--rounds', type=int, default=5,
+                        help='passes over the users')
+    parser.add_argument('--output', help='write the results as JSON here')
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['DEBUG_TB_ENABLED'] = False
+
+    if not args.skip_seed:
+        started = time.perf_counter()
+        seed_dataset(args)
+        print(f"seeded in {time.perf_counter() - started:.1f}s")
+
+    users = prepare_users(min(args.sessions, args.users))
+    with app.app_context():
+        user_count = db.session.execute(db.select(db.func.max(User.id))).scalar()
+        graph.get()
+
+    rng = random.Random(args.seed)
+    # one untimed pass, so templates are compiled and pools are warm
+    measure(users[:1], 1, user_count, rng)
+    summary = summarize(measure(users, args.rounds, user_count, rng))
+
+    print(f"encoder: {'orjson' if api.orjson else 'json'}")
+    print(f"  {'route':<16} {'items/req':>9} {'bytes/item':>10} "
+          f"{'cpu us/item':>11} {'p50 ms':>7}")
+    for name, stats in summary.items():
+        print(f"  {name:<16} {stats['items_per_request']:>9.1f} "
+              f"{stats['bytes_per_item']:>10.0f} {stats['cpu_us_per_item']:>11.0f} "
+              f"{stats['p50_ms']:>7.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'encoder': 'orjson' if api.orjson else 'json',
+                       'routes': summary}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
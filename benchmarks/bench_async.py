@@ -0,0 +1,153 @@
+"""Compare the sync and async read paths of the heavy GET routes.
+
+Runs the same read-only workload (homepage, profile, message and user
+search requests from logged-in users) once with ASYNC_READS off and once
+with it on, each in a fresh process with the same number of threads and
+the same connection budget: pools of 5 (+10 overflow) for both the sync
+and the async engine. Reports each
+mode's requests/sec, per-route p50/p95 latency and the process's peak
+RSS, so throughput is compared at equal memory:
+
+    DATABASE_URL=postgresql:///warbler-bench \\
+        python benchmarks/bench_async.py --skip-seed --concurrency 12
+
+Every request thread holds a connection from the sync pool (its session)
+in both modes, so keep --concurrency below the pool's 15 connections.
+
+Seeds the database first (dropping its tables) unless --skip-seed is
+given; see bench_routes.py for the dataset options.
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from bench_routes import prepare_users, seed_dataset, summarize  # noqa: E402
+from app import app, CURR_USER_KEY  # noqa: E402
+from models import db, Message, User  # noqa: E402
+import graph  # noqa: E402
+
+MODES = ('sync', 'async')
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+ROUTES = ('home', 'profile', 'message', 'users')
+
+
+def run_reads(results, user, rng, rounds, user_count, message_count):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = user.id
+
+    for _ in range(rounds):
+        for endpoint, url in (
+                ('home', '/'),
+                ('profile', f'/users/{rng.randint(1, user_count)}'),
+                ('message', f'/messages/{rng.randint(1, message_count)}'),
+                ('users', f'/users?q={user.username[:3]}')):
+            started = time.perf_counter()
+            resp = client.get(url)
+            results[endpoint].append((time.perf_counter() - started, 0,
+                                      resp.status_code))
+
+
+def measure(args):
+    """Run the workload in this process; print the summary as JSON."""
+
+    app.config['DEBUG_TB_ENABLED'] = False
+    users = prepare_users(args.concurrency)
+    with app.app_context():
+        user_count = db.session.execute(db.select(db.func.max(User.id))).scalar()
+        message_count = db.session.execute(db.select(db.func.max(Message.id))).scalar()
+        # loaded up front in both modes, not by whichever request comes first
+        graph.get()
+
+    results = defaultdict(list)
+    rng = random.Random(args.seed)
+    workers = [threading.Thread(target=run_reads,
+                                args=(results, user, random.Random(rng.random()),
+                                      args.rounds, user_count, message_count))
+               for user in users]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    summary = summarize(results, time.perf_counter() - started)
+    summary['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps(summary))
+
+
+def run_mode(mode, args):
+    env = dict(os.environ,
+               ASYNC_READS='1' if mode == 'async' else '0',
+               DB_POOL_SIZE=str(POOL_SIZE),
+               DB_MAX_OVERFLOW=str(MAX_OVERFLOW),
+               ASYNC_POOL_SIZE=str(POOL_SIZE),
+               ASYNC_MAX_OVERFLOW=str(MAX_OVERFLOW))
+    command = [sys.executable, __file__, '--measure', '--skip-seed',
+               '--concurrency', str(args.concurrency),
+               '--rounds', str(args.rounds), '--seed', args.seed]
+    output = subprocess.run(command, env=env, capture_output=True, text=True,
+                            check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--follows', type=int, default=20000)
+    parser.add_argument('--likes', type=int, default=20000)
+    parser.add_argument('--seed', default='bench')
+    parser.add_argument('--skip-seed', action='store_true',
+                        help='reuse the data from a previous run')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='threads (and logged-in users) per process')
+    parser.add_argument('--rounds', type=int, default=25,
+                        help='passes over the four routes per thread')
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='write the results as JSON here')
+    args = parser.parse_args()
+
+    if args.measure:
+        return measure(args)
+
+    if not args.skip_seed:
+        started = time.perf_counter()
+        seed_dataset(args)
+        print(f"seeded in {time.perf_counter() - started:.1f}s")
+
+    summaries = {mode: run_mode(mode, args) for mode in MODES}
+
+    print(f"concurrency={args.concurrency}, pool={POOL_SIZE}+{MAX_OVERFLOW}")
+    print(f"  {'mode':<6} {'req/s':>8} {'rss MB':>8}  "
+          + "  ".join(f"{route + ' p50/p95 ms':>22}" for route in ROUTES))
+    for mode, summary in summaries.items():
+        endpoints = summary['endpoints']
+        print(f"  {mode:<6} {summary['requests_per_sec']:>8.1f} "
+              f"{summary['peak_rss_mb']:>8.1f}  "
+              + "  ".join(f"{endpoints[route]['p50_ms']:>12.1f}/"
+                          f"{endpoints[route]['p95_ms']:<9.1f}"
+                          for route in ROUTES))
+        errors = sum(stats['errors'] for stats in endpoints.values())
+        if errors:
+            print(f"         {errors} errors")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(summaries, file, indent=2)
+        print(f"results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
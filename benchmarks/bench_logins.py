@@ -0,0 +1,80 @@
+"""Benchmark password verification (logins/sec) under concurrency.
+
+Simulates CONCURRENCY request threads all logging in at once and reports
+throughput, latency percentiles and how many logins were turned away
+because the hashing pool was saturated. Compare the inline mode (hashing
+on the request thread, as before the pool) with the pooled mode:
+
+    python benchmarks/bench_logins.py --workers 0
+    python benchmarks/bench_logins.py --workers 4 --queue-limit 16
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+
+from flask import Flask
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import passwords  # noqa: E402
+
+
+def login(app, hashed):
+    with app.app_context():
+        started = time.perf_counter()
+        try:
+            matches, _ = passwords.verify_password('password', hashed)
+            assert matches
+        except passwords.HashingBusy:
+            return None
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=32,
+                        help='simultaneous login requests')
+    parser.add_argument('--logins', type=int, default=200,
+                        help='total logins to attempt')
+    parser.add_argument('--rounds', type=int, default=12,
+                        help='bcrypt work factor')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='hashing processes (0 hashes inline)')
+    parser.add_argument('--queue-limit', type=int, default=None,
+                        help='waiting hashes allowed before rejecting')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['BCRYPT_LOG_ROUNDS'] = args.rounds
+    app.config['BCRYPT_WORKERS'] = args.workers
+    if args.queue_limit is not None:
+        app.config['BCRYPT_QUEUE_LIMIT'] = args.queue_limit
+
+    with app.app_context():
+        hashed = passwords.hash_password('password')
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as threads:
+        results = list(threads.map(lambda _: login(app, hashed),
+                                   range(args.logins)))
+    elapsed = time.perf_counter() - started
+    passwords.shutdown()
+
+    latencies = [result for result in results if result is not None]
+    rejected = len(results) - len(latencies)
+    p50, p95, p99 = (quantiles(latencies, n=100)[i] for i in (49, 94, 98))
+
+    print(f"workers={args.workers} rounds={args.rounds} "
+          f"concurrency={args.concurrency}")
+    print(f"  logins/sec: {len(latencies) / elapsed:.1f}")
+    print(f"  rejected:   {rejected}")
+    print(f"  latency ms: p50={p50 * 1000:.0f} p95={p95 * 1000:.0f} "
+          f"p99={p99 * 1000:.0f}")
+
+
+if __name__ == '__main__':
+    main()
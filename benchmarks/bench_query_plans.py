@@ -0,0 +1,174 @@
+"""Check that each route's queries use the intended indexes at scale.
+
+Seeds a large dataset, requests each page through the test client while
+recording the SQL it runs, then EXPLAINs every recorded query. A route
+fails if its main index doesn't show up in any plan, or if any plan
+sequentially scans one of the big tables. Exits non-zero on failure, so it
+can guard schema and query changes:
+
+    createdb warbler-bench
+    DATABASE_URL=postgresql:///warbler-bench python benchmarks/bench_query_plans.py
+
+The database's tables are dropped and recreated (PostgreSQL only).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import app, CURR_USER_KEY  # noqa: E402
+from models import db  # noqa: E402
+import counters  # noqa: E402
+import graph  # noqa: E402
+
+BIG_TABLES = {'messages', 'likes', 'follows', 'timeline_entries'}
+
+# route -> the index its main query should use
+ROUTES = {
+    '/': 'ix_timeline_entries_user_timestamp',
+    '/users/{user_id}': 'ix_messages_user_timestamp',
+    # follow lists come from the in-memory graph; only the users are read
+    '/users/{user_id}/following': 'users_pkey',
+    '/users/{user_id}/followers': 'users_pkey',
+    '/users/likes/{user_id}': 'ix_likes_user_timestamp',
+}
+
+SEED = [
+    """INSERT INTO users (username, email, password)
+       SELECT 'user' || i, 'user' || i || '@example.com', 'not-a-hash'
+       FROM generate_series(1, %(users)s) AS i""",
+    """INSERT INTO messages (text, timestamp, user_id)
+       SELECT 'warble ' || i, now() - i * interval '1 minute',
+              1 + floor(random() * %(users)s)
+       FROM generate_series(1, %(messages)s) AS i""",
+    """INSERT INTO follows (user_being_followed_id, user_following_id)
+       SELECT 1 + floor(random() * %(users)s), 1 + floor(random() * %(users)s)
+       FROM generate_series(1, %(follows)s)
+       ON CONFLICT DO NOTHING""",
+    """INSERT INTO likes (user_id, message_id, timestamp)
+       SELECT 1 + floor(random() * %(users)s),
+              1 + floor(random() * %(messages)s),
+              now() - i * interval '1 minute'
+       FROM generate_series(1, %(likes)s) AS i
+       ON CONFLICT DO NOTHING""",
+    """INSERT INTO timeline_entries (user_id, message_id, author_id, timestamp)
+       SELECT follows.user_following_id, messages.id, messages.user_id,
+              messages.timestamp
+       FROM follows
+       JOIN messages ON messages.user_id = follows.user_being_followed_id""",
+]
+
+
+def seed(sizes):
+    db.drop_all()
+    db.create_all()
+    with db.engine.begin() as conn:
+        for statement in SEED:
+            conn.exec_driver_sql(statement, sizes)
+    counters.reconcile()
+    with db.engine.connect().execution_options(
+            isolation_level='AUTOCOMMIT') as conn:
+        conn.exec_driver_sql('VACUUM ANALYZE')
+
+
+def record_queries(engine, client, url):
+    """The SELECTs run while requesting `url`."""
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        resp = client.get(url)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    assert resp.status_code == 200, f"{url} returned {resp.status_code}"
+    return statements
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def explain(engine, statement, parameters):
+    with engine.connect() as conn:
+        [[result]] = conn.exec_driver_sql(
+            'EXPLAIN (FORMAT JSON) ' + statement, parameters).all()
+    return list(plan_nodes(result[0]['Plan']))
+
+
+def check_route(engine, client, url, index):
+    """Returns a list of problems with the plans for `url`."""
+
+    indexes = set()
+    problems = []
+    for statement, parameters in record_queries(engine, client, url):
+        for node in explain(engine, statement, parameters):
+            if 'Index Name' in node:
+                indexes.add(node['Index Name'])
+            if (node['Node Type'] == 'Seq Scan'
+                    and node.get('Relation Name') in BIG_TABLES):
+                problems.append(f"sequential scan on {node['Relation Name']}: "
+                                f"{' '.join(statement.split())[:100]}")
+    if index not in indexes:
+        problems.append(f"{index} not used (used: {', '.join(sorted(indexes))})")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--follows', type=int, default=100000)
+    parser.add_argument('--likes', type=int, default=200000)
+    parser.add_argument('--user-id', type=int, default=1,
+                        help='user to log in as and view')
+    parser.add_argument('--skip-seed', action='store_true',
+                        help='reuse the data from a previous run')
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['DEBUG_TB_ENABLED'] = False
+
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name != 'postgresql':
+            sys.exit("query plans are only checked on PostgreSQL")
+
+        if not args.skip_seed:
+            started = time.perf_counter()
+            seed({'users': args.users, 'messages': args.messages,
+                  'follows': args.follows, 'likes': args.likes})
+            print(f"seeded in {time.perf_counter() - started:.1f}s")
+
+        # load the follow graph now, so its full read isn't checked as a route's
+        graph.get()
+
+    failed = False
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = args.user_id
+
+        for route, index in ROUTES.items():
+            url = route.format(user_id=args.user_id)
+            problems = check_route(engine, client, url, index)
+            print(f"{'FAIL' if problems else 'ok  '} {url} ({index})")
+            for problem in problems:
+                print(f"       {problem}")
+            failed = failed or bool(problems)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""Load-test the routes with simulated user sessions.
+
+Seeds a generated dataset, then runs CONCURRENCY threads of user sessions
+against the WSGI app in-process. Each session logs in, reads the home
+feed, views profiles and messages, follows someone, likes a message,
+posts and logs out. Reports requests/sec overall and, per endpoint,
+requests/sec, p50/p95/p99 latency and SQL queries per request, and writes
+the same numbers as JSON so runs can be diffed between commits:
+
+    createdb warbler-bench
+    DATABASE_URL=postgresql:///warbler-bench \\
+        python benchmarks/bench_routes.py --users 10000 --output before.json
+
+The database's tables are dropped and recreated unless --skip-seed is given.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime
+from statistics import mean, quantiles
+
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'generator'))
+
+from app import app  # noqa: E402
+from models import db, User, Message  # noqa: E402
+import create_csvs  # noqa: E402
+import passwords  # noqa: E402
+import seed  # noqa: E402
+
+PASSWORD = 'password'
+BENCH_ROUNDS = 4
+
+SessionUser = namedtuple('SessionUser', ['id', 'username', 'following'])
+
+_local = threading.local()
+
+
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    _local.queries = getattr(_local, 'queries', 0) + 1
+
+
+class Session:
+    """One simulated user, timing every request they make."""
+
+    def __init__(self, results, user, rng, user_count, message_count):
+        self.client = app.test_client()
+        self.results = results
+        self.user = user
+        self.rng = rng
+        self.user_count = user_count
+        self.message_count = message_count
+
+    def request(self, endpoint, method, url, **kwargs):
+        _local.queries = 0
+        started = time.perf_counter()
+        resp = self.client.open(url, method=method, **kwargs)
+        elapsed = time.perf_counter() - started
+        self.results[endpoint].append((elapsed, _local.queries, resp.status_code))
+        return resp
+
+    def run(self):
+        # someone to follow (and unfollow again) that we don't follow yet
+        other = self.user.id
+        while other == self.user.id or other in self.user.following:
+            other = self.rng.randint(1, self.user_count)
+        message = self.rng.randint(1, self.message_count)
+
+        self.request('login', 'POST', '/login',
+                     data={'username': self.user.username, 'password': PASSWORD})
+        self.request('home', 'GET', '/')
+        self.request('profile', 'GET', f'/users/{other}')
+        self.request('message', 'GET', f'/messages/{message}')
+        self.request('follow', 'POST', f'/users/follow/{other}')
+        self.request('like', 'POST', f'/api/messages/{message}/like')
+        self.request('post', 'POST', '/messages/new',
+                     data={'text': f'benchmark warble {self.rng.random()}'})
+        self.request('home', 'GET', '/')
+        self.request('unfollow', 'POST', f'/users/stop-following/{other}')
+        self.request('logout', 'GET', '/logout')
+
+
+def run_sessions(sessions):
+    for session in sessions:
+        session.run()
+
+
+def seed_dataset(args):
+    options = create_csvs.Options(
+        users=args.users, messages=args.messages, follows=args.follows,
+        likes=args.likes, seed=args.seed, start=datetime(2021, 1, 1),
+        end=datetime(2023, 1, 1), popularity_alpha=1.1, activity_alpha=1.1,
+        like_alpha=1.2, degree_alpha=2.0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        create_csvs.generate(options, directory)
+        with app.app_context():
+            seed.init_db(directory)
+
+
+def prepare_users(count):
+    """Give the first `count` users a known, cheap password.
+
+    Returns them as SessionUsers, with the ids they follow.
+    """
+
+    with app.app_context():
+        hashed = passwords.hash_password(PASSWORD)
+        db.session.execute(
+            db.update(User).where(User.id <= count).values(password=hashed))
+        db.session.commit()
+        users = User.query.filter(User.id <= count).order_by(User.id).all()
+        return [SessionUser(user.id, user.username,
+                            {followed.id for followed in user.following})
+                for user in users]
+
+
+def summarize(results, elapsed):
+    endpoints = {}
+    for endpoint, samples in sorted(results.items()):
+        latencies = [latency for latency, _, _ in samples]
+        cuts = quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        endpoints[endpoint] = {
+            'requests': len(samples),
+            'requests_per_sec': len(samples) / elapsed,
+            'p50_ms': cuts[49] * 1000,
+            'p95_ms': cuts[94] * 1000,
+            'p99_ms': cuts[98] * 1000,
+            'queries_per_request': mean(queries for _, queries, _ in samples),
+            'errors': sum(1 for _, _, status in samples if status >= 500),
+        }
+    total = sum(endpoint['requests'] for endpoint in endpoints.values())
+    return {'requests': total,
+            'requests_per_sec': total / elapsed,
+            'elapsed_sec': elapsed,
+            'endpoints': endpoints}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--follows', type=int, default=20000)
+    parser.add_argument('--likes', type=int, default=20000)
+    parser.add_argument('--seed', default='bench')
+    parser.add_argument('--skip-seed', action='store_true',
+                        help='reuse the data from a previous run')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='simultaneous user sessions')
+    parser.add_argument('--sessions', type=int, default=200,
+                        help='total user sessions to run')
+    parser.add_argument('--output', help='write the results as JSON here')
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['DEBUG_TB_ENABLED'] = False
+    app.config['BCRYPT_LOG_ROUNDS'] = BENCH_ROUNDS
+
+    if not args.skip_seed:
+        started = time.perf_counter()
+        seed_dataset(args)
+        print(f"seeded in {time.perf_counter() - started:.1f}s")
+
+    users = prepare_users(min(args.concurrency * 4, args.users))
+    with app.app_context():
+        engine = db.engine
+        user_count = db.session.execute(db.select(db.func.max(User.id))).scalar()
+        message_count = db.session.execute(db.select(db.func.max(Message.id))).scalar()
+
+    results = defaultdict(list)
+    rng = random.Random(args.seed)
+    # session i runs on thread i % concurrency; no two threads share a user
+    sessions = [Session(results, users[i % len(users)], random.Random(rng.random()),
+                        user_count, message_count)
+                for i in range(args.sessions)]
+
+    event.listen(engine, 'before_cursor_execute', count_query)
+    started = time.perf_counter()
+    try:
+        workers = [threading.Thread(target=run_sessions,
+                                    args=(sessions[n::args.concurrency],))
+                   for n in range(args.concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_query)
+    elapsed = time.perf_counter() - started
+    passwords.shutdown()
+
+    summary = summarize(results, elapsed)
+    print(f"{summary['requests']} requests in {elapsed:.1f}s: "
+          f"{summary['requests_per_sec']:.1f} requests/sec "
+          f"(concurrency={args.concurrency})")
+    print(f"  {'endpoint':<10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'queries':>8} {'errors':>7}")
+    for endpoint, stats in summary['endpoints'].items():
+        print(f"  {endpoint:<10} {stats['requests_per_sec']:>8.1f} "
+              f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} "
+              f"{stats['p99_ms']:>8.1f} {stats['queries_per_request']:>8.1f} "
+              f"{stats['errors']:>7}")
+
+    if args.output:
+        summary.update(commit=git_commit(), config=vars(args),
+                       timestamp=datetime.utcnow().isoformat())
+        with open(args.output, 'w') as file:
+            json.dump(summary, file, indent=2)
+        print(f"results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Measure import time and cold start of the app in each profile.
+
+Each run is a fresh interpreter that imports `app`, builds the app with
+`create_app(profile)` and, for `production+preload`, runs `preload`.
+Then it forks a worker, as a prefork server would, which serves one
+logged-in homepage. Reports the median of --runs runs of each step, the
+number of modules imported, whether the debug toolbar or the seeding
+code was loaded, and the worker's peak RSS (pages it shares with the
+parent included):
+
+    DATABASE_URL=postgresql:///warbler-bench \\
+        python benchmarks/bench_startup.py --runs 5
+
+The homepage is user 1's, so the database needs data; seed it with
+bench_routes.py first.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from statistics import median
+
+RUNS = ('development', 'production', 'production+preload')
+STEPS = ('import_ms', 'create_ms', 'preload_ms', 'first_request_ms')
+
+
+def measure(run):
+    """One cold start of `run`, as a dict printed for the parent to read."""
+
+    started = time.perf_counter()
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    import app as module
+    imported = time.perf_counter()
+
+    profile = run.split('+')[0]
+    app = module.create_app(profile)
+    app.config['DEBUG_TB_ENABLED'] = False
+    created = time.perf_counter()
+    if run.endswith('+preload'):
+        module.preload(app)
+    preloaded = time.perf_counter()
+
+    results = dict(import_ms=(imported - started) * 1000,
+                   create_ms=(created - imported) * 1000,
+                   preload_ms=(preloaded - created) * 1000,
+                   modules=len(sys.modules),
+                   dev_tools_loaded=any(name in sys.modules
+                                        for name in ('flask_debugtoolbar', 'seed')))
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[module.CURR_USER_KEY] = 1
+        started = time.perf_counter()
+        status = client.get('/').status_code
+        worker = dict(first_request_ms=(time.perf_counter() - started) * 1000,
+                      status=status,
+                      worker_rss_mb=resource.getrusage(
+                          resource.RUSAGE_SELF).ru_maxrss / 1024)
+        os.write(write, json.dumps(worker).encode())
+        os._exit(0)
+
+    os.close(write)
+    with os.fdopen(read) as pipe:
+        results.update(json.loads(pipe.read()))
+    os.waitpid(pid, 0)
+    print(json.dumps(results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5,
+                        help='cold starts of each profile')
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='write the results as JSON here')
+    args = parser.parse_args()
+
+    if args.measure:
+        return measure(args.measure)
+
+    summary = {}
+    for run in RUNS:
+        samples = []
+        for _ in range(args.runs):
+            out = subprocess.run([sys.executable, __file__, '--measure', run],
+                                 capture_output=True, text=True, check=True).stdout
+            samples.append(json.loads(out.splitlines()[-1]))
+        summary[run] = {key: median(sample[key] for sample in samples)
+                        for key in STEPS + ('modules', 'worker_rss_mb')}
+        summary[run]['dev_tools_loaded'] = samples[0]['dev_tools_loaded']
+        summary[run]['errors'] = sum(1 for sample in samples if sample['status'] != 200)
+
+    print(f"  {'profile':<20} {'import':>7} {'create':>7} {'preload':>8} "
+          f"{'1st req':>8} {'modules':>8} {'rss MB':>7}  dev tools")
+    for run, stats in summary.items():
+        print(f"  {run:<20} {stats['import_ms']:>7.0f} {stats['create_ms']:>7.0f} "
+              f"{stats['preload_ms']:>8.0f} {stats['first_request_ms']:>8.0f} "
+              f"{stats['modules']:>8.0f} {stats['worker_rss_mb']:>7.1f}  "
+              f"{'yes' if stats['dev_tools_loaded'] else 'no'}")
+        if stats['errors']:
+            print(f"         {stats['errors']} errors")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Small in-process caches for Warbler.
+
+LRUCache is a thread-safe mapping with a per-entry time-to-live and
+least-recently-used eviction once it holds `maxsize` entries (or, given
+`maxbytes`, once its values add up to more than that many bytes). It
+counts hits, misses and evictions, which /metrics exports for every cache
+created here.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+CACHES = []
+
+
+class LRUCache:
+    """A bounded, expiring, least-recently-used cache."""
+
+    def __init__(self, name, maxsize=1024, ttl=60, maxbytes=None, sizeof=len):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof if maxbytes else (lambda value: 0)
+        self.bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        CACHES.append(self)
+
+    def get(self, key, default=None):
+        """The value cached under `key`, or `default` if missing or expired."""
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def get_many(self, keys):
+        """{key: value} for those of `keys` that are cached and fresh."""
+
+        found = {}
+        now = time.monotonic()
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None or entry[0] < now:
+                    if entry is not None:
+                        self._remove(key)
+                    self.misses += 1
+                    continue
+                self.entries.move_to_end(key)
+                self.hits += 1
+                found[key] = entry[1]
+        return found
+
+    def set(self, key, value):
+        """Cache `value` under `key` for `ttl` seconds."""
+
+        size = self.sizeof(value)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic() + self.ttl, value, size)
+            self.bytes += size
+            while self.entries and (len(self.entries) > self.maxsize or
+                                    self.maxbytes and self.bytes > self.maxbytes):
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, _, size = self.entries.pop(key)
+        self.bytes -= size
+
+    def delete(self, *keys):
+        """Drop `keys` from the cache, if present."""
+
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return dict(hits=self.hits,
+                        misses=self.misses,
+                        evictions=self.evictions,
+                        size=len(self.entries))
+
+    def render(self):
+        """This cache's counters in Prometheus text format."""
+
+        stats = self.stats()
+        label = f'cache="{self.name}"'
+        return "\n".join([
+            f"warbler_cache_hits_total{{{label}}} {stats['hits']}",
+            f"warbler_cache_misses_total{{{label}}} {stats['misses']}",
+            f"warbler_cache_evictions_total{{{label}}} {stats['evictions']}",
+            f"warbler_cache_entries{{{label}}} {stats['size']}",
+            f"warbler_cache_bytes{{{label}}} {self.bytes}",
+        ])
+
+
+def render():
+    """Counters for every cache, in Prometheus text format."""
+
+    lines = ["# TYPE warbler_cache_hits_total counter",
+             "# TYPE warbler_cache_misses_total counter",
+             "# TYPE warbler_cache_evictions_total counter",
+             "# TYPE warbler_cache_entries gauge",
+             "# TYPE warbler_cache_bytes gauge"]
+    lines += [cache.render() for cache in CACHES]
+    return "\n".join(lines)
@@ -0,0 +1,125 @@
+"""Conditional GETs (ETag / If-None-Match) for Warbler's pages.
+
+A page's ETag is built from a cheap "stamp" read before the page itself:
+the versions of the users it shows (`User.version`, bumped by every
+profile edit, post, follow and like), the newest entries of a timeline,
+plus who is looking and which page of results. When the browser already
+has that version, the view answers 304 Not Modified without running its
+queries or rendering its template.
+
+Pages are personal, so they are marked `private` when someone is logged
+in, and must be revalidated on every use (`no-cache`). Requests with a
+flash message waiting are always rendered, as the message is part of the
+page. Changing any template changes every ETag.
+"""
+
+import hashlib
+import os
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+
+from models import db, Message, User
+import timeline
+
+_template_version = None
+
+
+def template_version():
+    """A fingerprint of the templates, so a deploy invalidates every ETag."""
+
+    global _template_version
+
+    if _template_version is None:
+        digest = hashlib.sha1()
+        for folder, _, files in sorted(os.walk(os.path.join(
+                current_app.root_path, current_app.template_folder))):
+            for name in sorted(files):
+                path = os.path.join(folder, name)
+                digest.update(f"{path}:{os.path.getmtime(path)}".encode())
+        _template_version = digest.hexdigest()[:12]
+    return _template_version
+
+
+def make_etag(*parts):
+    """An ETag for a page made of `parts`, as seen by the current user."""
+
+    viewer_id = g.user.id if g.user else None
+    key = repr((template_version(), request.endpoint, request.query_string,
+                viewer_id) + parts)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def etag(stamp):
+    """Decorate a GET view with conditional responses.
+
+    `stamp(**view_args)` returns a tuple that changes whenever the page
+    would, or None to render the page untagged (e.g. when it 404s).
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def conditional_view(**kwargs):
+            if request.method != 'GET' or '_flashes' in session:
+                return view(**kwargs)
+
+            parts = stamp(**kwargs)
+            if parts is None:
+                return view(**kwargs)
+
+            tag = make_etag(*parts)
+            if request.if_none_match.contains_weak(tag):
+                resp = current_app.response_class(status=304)
+            else:
+                resp = make_response(view(**kwargs))
+                if resp.status_code != 200:
+                    return resp
+
+            resp.set_etag(tag, weak=True)
+            resp.cache_control.no_cache = True
+            if g.user:
+                resp.cache_control.private = True
+            else:
+                resp.cache_control.public = True
+            resp.vary.add('Cookie')
+            return resp
+
+        return conditional_view
+    return decorator
+
+
+def _version(user_id):
+    return db.select(User.version).where(User.id == user_id).scalar_subquery()
+
+
+def viewer_version():
+    return _version(g.user.id) if g.user else db.null()
+
+
+def profile_stamp(user_id):
+    """The profile's and the viewer's versions."""
+
+    versions = db.session.execute(
+        db.select(_version(user_id), viewer_version())).one()
+    if versions[0] is None:
+        return None
+    return tuple(versions)
+
+
+def message_stamp(message_id):
+    """The author's and the viewer's versions (messages never change)."""
+
+    author = db.select(Message.user_id).where(Message.id == message_id)
+    versions = db.session.execute(
+        db.select(_version(author.scalar_subquery()), viewer_version())).one()
+    if versions[0] is None:
+        return None
+    return tuple(versions)
+
+
+def home_stamp():
+    """The viewer's timeline version; the logged out homepage isn't tagged."""
+
+    if not g.user:
+        return None
+    return timeline.home_version(g.user.id)
@@ -0,0 +1,80 @@
+"""Named configuration profiles for `app.create_app`.
+
+    development   the default: debug toolbar, `init_db` in `flask shell`
+    testing       TESTING on and CSRF off, for `create_app('testing')` in tests
+    production    only what serving needs; preloads in a prefork master
+
+The profile is picked by `create_app(profile)`, or else by the
+WARBLER_PROFILE environment variable. Every setting can still be
+overridden from the environment, as below.
+"""
+
+import os
+
+from routing import REPLICA
+
+
+class Config:
+    # Get DB_URI from environ variable (useful for production/testing) or,
+    # if not set there, use development local db.
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql:///warbler')
+
+    # pool options, for the primary and the replica alike
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', -1)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING') == '1',
+    }
+    # GET requests read from this replica when it's set (see routing.py)
+    if os.environ.get('REPLICA_DATABASE_URL'):
+        SQLALCHEMY_BINDS = {REPLICA: os.environ['REPLICA_DATABASE_URL']}
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.environ.get('SECRET_KEY', "it's a secret")
+    # bcrypt work factor and the size of the hashing process pool
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', os.cpu_count()))
+    BCRYPT_QUEUE_LIMIT = int(os.environ.get('BCRYPT_QUEUE_LIMIT', 4 * os.cpu_count()))
+    # seconds a request waits for its hash before giving up with a 503
+    BCRYPT_TIMEOUT = float(os.environ.get('BCRYPT_TIMEOUT', 10))
+    # serve the heavy GET pages through the async engine (see reads.py)
+    ASYNC_READS = os.environ.get('ASYNC_READS') == '1'
+    ASYNC_POOL_SIZE = int(os.environ.get('ASYNC_POOL_SIZE', 10))
+    ASYNC_MAX_OVERFLOW = int(os.environ.get('ASYNC_MAX_OVERFLOW', 10))
+    # buffer likes and follows in memory, writing them in batches (see writebehind.py)
+    WRITE_BEHIND = os.environ.get('WRITE_BEHIND') == '1'
+    WRITE_BEHIND_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL', 0.5))
+    WRITE_BEHIND_BATCH = int(os.environ.get('WRITE_BEHIND_BATCH', 1000))
+    WRITE_BEHIND_MAX_PENDING = int(os.environ.get('WRITE_BEHIND_MAX_PENDING', 10000))
+    WRITE_BEHIND_MAX_ATTEMPTS = int(os.environ.get('WRITE_BEHIND_MAX_ATTEMPTS', 5))
+
+    # install flask-debugtoolbar and the seeding helpers
+    DEV_TOOLS = False
+    # warm the app before workers fork from it (see `app.preload`)
+    PRELOAD = False
+
+
+class DevelopmentConfig(Config):
+    DEV_TOOLS = True
+    # DEBUG_TB_INTERCEPT_REDIRECTS = True
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+
+class TestingConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+
+
+class ProductionConfig(Config):
+    PRELOAD = os.environ.get('PRELOAD', '1') == '1'
+
+
+PROFILES = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
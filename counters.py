@@ -0,0 +1,147 @@
+"""Denormalized per-user counters for Warbler.
+
+`User.messages_count`, `following_count`, `followers_count` and
+`likes_count` are kept in step by the views that post, delete, follow and
+like, so stats can be shown without loading whole relationship collections.
+Every change is a single `UPDATE ... SET col = col + n`, so concurrent
+requests never overwrite each other's counts.
+
+Deleted messages and accounts stay counted until `deletion.purge` removes
+their rows.
+
+`reconcile` recomputes the counters from the underlying tables and repairs
+any drift (for example after a bulk load or a crashed request).
+
+Every change also bumps `User.version`, which the pages' ETags are made of.
+"""
+
+from models import db, Follows, Likes, Message, User
+
+# users per UPDATE when reconciling the whole table
+RECONCILE_BATCH = 1000
+
+
+def _bumped(deltas):
+    values = {name: getattr(User, name) + delta
+              for name, delta in deltas.items()}
+    values['version'] = User.version + 1
+    return values
+
+
+def bump(user_id, **deltas):
+    """Add `deltas` (e.g. `likes_count=1`) to the counters of `user_id`."""
+
+    values = _bumped(deltas)
+    db.session.execute(
+        db.update(User).where(User.id == user_id).values(**values))
+
+
+def bump_many(user_ids, **deltas):
+    """Add `deltas` to the counters of every user in `user_ids`.
+
+    `user_ids` may be a list or a subquery.
+    """
+
+    values = _bumped(deltas)
+    db.session.execute(
+        db.update(User).where(User.id.in_(user_ids)).values(**values))
+
+
+def bump_each(name, deltas):
+    """Add each user's delta in `deltas` ({user_id: n}) to counter `name`.
+
+    Users with the same delta share one UPDATE.
+    """
+
+    by_delta = {}
+    for user_id, delta in deltas.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(user_id)
+    for delta, user_ids in by_delta.items():
+        bump_many(user_ids, **{name: delta})
+
+
+def follow(follower_id, followed_id, delta=1):
+    """Count a new (or, with `delta=-1`, a removed) follow."""
+
+    bump(follower_id, following_count=delta)
+    bump(followed_id, followers_count=delta)
+
+
+def messages_purged(message_ids):
+    """Uncount messages about to be purged and the likes they take with them."""
+
+    authors = db.session.execute(
+        db.select(Message.user_id, db.func.count())
+        .where(Message.id.in_(message_ids))
+        .group_by(Message.user_id),
+        execution_options={'include_deleted': True}).all()
+    bump_each('messages_count', {user_id: -count for user_id, count in authors})
+
+    likers = db.session.execute(
+        db.select(Likes.user_id, db.func.count())
+        .where(Likes.message_id.in_(message_ids))
+        .group_by(Likes.user_id)).all()
+    bump_each('likes_count', {user_id: -count for user_id, count in likers})
+
+
+def _actual_counts():
+    """Correlated subqueries computing each counter from its source table."""
+
+    return dict(
+        messages_count=(db.select(db.func.count(Message.id))
+                        .where(Message.user_id == User.id)
+                        .scalar_subquery()),
+        following_count=(db.select(db.func.count())
+                         .select_from(Follows)
+                         .where(Follows.user_following_id == User.id)
+                         .scalar_subquery()),
+        followers_count=(db.select(db.func.count())
+                         .select_from(Follows)
+                         .where(Follows.user_being_followed_id == User.id)
+                         .scalar_subquery()),
+        likes_count=(db.select(db.func.count(Likes.id))
+                     .where(Likes.user_id == User.id)
+                     .scalar_subquery()),
+    )
+
+
+def reconcile(user_ids=None):
+    """Recompute counters from the source tables, fixing any that drifted.
+
+    Reconciles the users in `user_ids`, or everyone (in batches of
+    RECONCILE_BATCH, committing after each one) when no ids are given.
+    Returns how many users had at least one wrong counter.
+    """
+
+    if user_ids is not None:
+        return _reconcile_batch(list(user_ids))
+
+    repaired = 0
+    last_id = 0
+    while True:
+        batch = db.session.execute(
+            db.select(User.id)
+            .where(User.id > last_id)
+            .order_by(User.id)
+            .limit(RECONCILE_BATCH)).scalars().all()
+        if not batch:
+            return repaired
+
+        repaired += _reconcile_batch(batch)
+        db.session.commit()
+        last_id = batch[-1]
+
+
+def _reconcile_batch(user_ids):
+    actual = _actual_counts()
+    drifted = db.or_(*[getattr(User, name) != expr
+                       for name, expr in actual.items()])
+
+    result = db.session.execute(
+        db.update(User)
+        .where(User.id.in_(user_ids))
+        .where(drifted)
+        .values(version=User.version + 1, **actual)
+        .execution_options(synchronize_session=False))
+    return result.rowcount
@@ -0,0 +1,162 @@
+"""Deleting accounts and messages: tombstones now, the rows later.
+
+Deleting an account or a message only sets its `deleted_at`, which hides
+it from every ORM select (`models.hide_deleted`), and returns. Deleting
+everything that hangs off a prolific account could take seconds, so that
+is left to `purge`. The purge removes the rows in bounded batches, each
+in its own short transaction:
+
+    flask purge            # once
+    flask purge --watch    # keep purging, every PURGE_INTERVAL seconds
+
+Counters and the follow graph are updated as rows go; until then they
+still include the deleted rows, like the tables counters are reconciled
+against. ON DELETE CASCADE removes likes and timeline entries along with
+their messages, so followers' homepages change when the purge runs.
+"""
+
+import time
+from datetime import datetime
+
+from models import db, Follows, Likes, Message, Suggestion, TimelineEntry, User
+import counters
+import graph
+import timeline
+
+# rows removed per transaction
+PURGE_BATCH = 1000
+
+# seconds between passes of `flask purge --watch`
+PURGE_INTERVAL = 10
+
+# purge statements must see deleted rows
+INCLUDE_DELETED = {'include_deleted': True}
+
+
+def delete_user(user_id):
+    """Mark an account deleted. The caller commits.
+
+    Their messages stay in followers' timelines until the purge, hidden
+    when read; bumping the followers' versions changes their homepages'
+    ETags now.
+    """
+
+    db.session.execute(
+        db.update(User).where(User.id == user_id)
+        .values(deleted_at=datetime.utcnow(), version=User.version + 1))
+    counters.bump_many(db.select(Follows.user_following_id)
+                       .where(Follows.user_being_followed_id == user_id))
+
+
+def delete_message(msg):
+    """Mark a message deleted and take it out of timelines. The caller
+    commits."""
+
+    db.session.execute(
+        db.update(Message).where(Message.id == msg.id)
+        .values(deleted_at=datetime.utcnow()))
+    timeline.remove_message(msg.id)
+    counters.bump(msg.user_id)
+
+
+def purge(batch_size=PURGE_BATCH, out=print):
+    """Remove every deleted message and account, a batch at a time.
+
+    Returns how many (messages, users) were purged.
+    """
+
+    messages = 0
+    while True:
+        ids = _ids(db.select(Message.id)
+                   .where(Message.deleted_at.is_not(None))
+                   .order_by(Message.deleted_at), batch_size)
+        if not ids:
+            break
+        messages += _purge_messages(ids)
+        out(f"  purged {messages:,} deleted messages")
+
+    user_ids = _ids(db.select(User.id)
+                    .where(User.deleted_at.is_not(None))
+                    .order_by(User.deleted_at), None)
+    for user_id in user_ids:
+        _purge_user(user_id, batch_size, out)
+
+    return messages, len(user_ids)
+
+
+def watch(batch_size=PURGE_BATCH, out=print):
+    """Purge forever, PURGE_INTERVAL seconds apart."""
+
+    while True:
+        purge(batch_size, out)
+        time.sleep(PURGE_INTERVAL)
+
+
+def _ids(query, limit):
+    return db.session.execute(
+        query.limit(limit), execution_options=INCLUDE_DELETED).scalars().all()
+
+
+def _purge_messages(ids):
+    """Delete the messages `ids` and their likes; commits. Returns how many."""
+
+    counters.messages_purged(ids)
+    deleted = db.session.execute(
+        db.delete(Message).where(Message.id.in_(ids))
+        .execution_options(synchronize_session=False)).rowcount
+    db.session.commit()
+    return deleted
+
+
+def _purge_user(user_id, batch_size, out):
+    """Delete a deleted account and everything it owns, in batches."""
+
+    messages = follows = rows = 0
+
+    while True:
+        ids = _ids(db.select(Message.id).where(Message.user_id == user_id),
+                   batch_size)
+        if not ids:
+            break
+        messages += _purge_messages(ids)
+
+    for mine, theirs, their_counter in (
+            (Follows.user_following_id, Follows.user_being_followed_id,
+             'followers_count'),
+            (Follows.user_being_followed_id, Follows.user_following_id,
+             'following_count')):
+        while True:
+            others = db.session.execute(
+                db.select(theirs).where(mine == user_id).limit(batch_size)
+            ).scalars().all()
+            if not others:
+                break
+            if mine is Follows.user_following_id:
+                graph.unfollow_many((user_id, other) for other in others)
+            else:
+                graph.unfollow_many((other, user_id) for other in others)
+            counters.bump_many(others, **{their_counter: -1})
+            db.session.commit()
+            follows += len(others)
+
+    # what's left can be large too
+    for table, where in ((Likes, Likes.user_id == user_id),
+                         (TimelineEntry, TimelineEntry.user_id == user_id),
+                         (Suggestion, Suggestion.suggested_id == user_id)):
+        key = db.tuple_(*table.__table__.primary_key.columns)
+        while True:
+            batch = db.select(*table.__table__.primary_key.columns) \
+                .where(where).limit(batch_size)
+            deleted = db.session.execute(
+                db.delete(table).where(key.in_(batch))
+                .execution_options(synchronize_session=False)).rowcount
+            db.session.commit()
+            rows += deleted
+            if deleted < batch_size:
+                break
+
+    db.session.execute(db.delete(User).where(User.id == db.bindparam('id')),
+                       dict(id=user_id))
+    db.session.commit()
+    out(f"  purged user {user_id}: {messages:,} messages, {follows:,} follows, "
+        f"{rows:,} likes, suggestions and timeline entries")
@@ -0,0 +1,122 @@
+"""Read model for message lists (home, profile, likes and single messages).
+
+Each message comes back as a FeedItem carrying its author's display fields
+and whether the viewer likes it, all selected in the same query as the
+message itself. Templates never touch `Message.user` or `User.likes`, so a
+page costs the same number of queries however many messages it shows.
+"""
+
+from collections import namedtuple
+
+from models import db, Likes, Message, User
+from pagination import PAGE_SIZE, Page, keyset_page
+
+Author = namedtuple('Author', ['id', 'username', 'image_url', 'profile_version'])
+
+FeedItem = namedtuple('FeedItem', ['id', 'text', 'timestamp', 'user', 'liked'])
+
+
+def _query(viewer_id, *extra):
+    """Messages joined to their authors, plus the viewer's like state."""
+
+    if viewer_id:
+        # aliased so it doesn't correlate with a join to `likes` (likes page)
+        viewer_like = db.aliased(Likes)
+        liked = (db.select(viewer_like.id)
+                 .where(viewer_like.message_id == Message.id)
+                 .where(viewer_like.user_id == viewer_id)
+                 .exists())
+    else:
+        liked = db.false()
+
+    return (db.select(Message.id,
+                      Message.text,
+                      Message.timestamp,
+                      User.id.label('author_id'),
+                      User.username,
+                      User.image_url,
+                      User.profile_version,
+                      liked.label('liked'),
+                      *extra)
+            # through the relationship, so deleted authors are left out
+            .join(Message.user))
+
+
+def item(row):
+    """The FeedItem for a row selected by one of the queries below."""
+
+    return FeedItem(row.id,
+                    row.text,
+                    row.timestamp,
+                    Author(row.author_id, row.username, row.image_url, row.profile_version),
+                    row.liked)
+
+
+def items_page(page):
+    """`page` of rows as a Page of FeedItems."""
+
+    return Page([item(row) for row in page.items], page.next_cursor)
+
+
+def messages_by_ids_query(ids, viewer_id=None):
+    return _query(viewer_id).where(Message.id.in_(ids))
+
+
+def in_order(rows, ids):
+    """FeedItems for `rows`, in the order of `ids`."""
+
+    by_id = {row.id: item(row) for row in rows}
+    return [by_id[message_id] for message_id in ids if message_id in by_id]
+
+
+def messages_by_ids(ids, viewer_id=None):
+    """FeedItems for message `ids`, in the order given."""
+
+    if not ids:
+        return []
+
+    return in_order(db.session.execute(messages_by_ids_query(ids, viewer_id)),
+                    ids)
+
+
+def message_query(message_id, viewer_id=None):
+    return _query(viewer_id).where(Message.id == message_id)
+
+
+def message(message_id, viewer_id=None):
+    """The FeedItem for one message, or None if it doesn't exist."""
+
+    row = db.session.execute(message_query(message_id, viewer_id)).first()
+    if row is None:
+        return None
+    return item(row)
+
+
+def user_messages_query(user_id, viewer_id=None):
+    return _query(viewer_id).where(Message.user_id == user_id)
+
+
+def user_messages(user_id, viewer_id=None, cursor=None, limit=PAGE_SIZE):
+    """A Page of `user_id`'s messages, newest first."""
+
+    return items_page(keyset_page(user_messages_query(user_id, viewer_id),
+                                  Message.timestamp,
+                                  Message.id,
+                                  cursor=cursor,
+                                  limit=limit))
+
+
+def liked_messages(user_id, viewer_id=None, cursor=None):
+    """A Page of the messages `user_id` likes, most recently liked first."""
+
+    query = (_query(viewer_id,
+                    Likes.timestamp.label('liked_at'),
+                    Likes.id.label('like_id'))
+             .join(Likes, Likes.message_id == Message.id)
+             .where(Likes.user_id == user_id))
+
+    return items_page(keyset_page(query,
+                                  Likes.timestamp,
+                                  Likes.id,
+                                  cursor=cursor,
+                                  key=lambda row: (row.liked_at, row.like_id)))
@@ -0,0 +1,64 @@
+"""Cached template fragments for Warbler.
+
+Markup that is the same for everyone (a user card, a message row) is
+rendered once and reused, keyed by the entity's id and a version that
+changes whenever the markup would. For users and their messages that is
+`profile_version`, which only profile edits bump; `version` also moves
+with every like, follow and post. In a template:
+
+    {% call fragment('message-row', message.id, author.profile_version) %}
+      ...
+    {% endcall %}
+
+Viewer-specific bits (follow and like buttons) are kept out of the cached
+markup: pass them as `slot` and place them with the caller's argument,
+which marks where they go:
+
+    {% call(button) fragment('user-card', user.id, user.profile_version, slot=follow_button) %}
+      ... {{ button }} ...
+    {% endcall %}
+
+Fragments live in an LRUCache bounded both by count and by total size.
+"""
+
+from markupsafe import Markup, escape
+from sqlalchemy import event
+
+from cache import LRUCache
+from models import db
+
+FRAGMENT_MAXSIZE = 20000
+FRAGMENT_MAXBYTES = 32 * 1024 * 1024
+FRAGMENT_TTL = 3600
+
+# where the slot goes in a cached fragment; can't appear in escaped markup
+HOLE = '\x00slot\x00'
+
+fragments = LRUCache('fragments', maxsize=FRAGMENT_MAXSIZE, ttl=FRAGMENT_TTL,
+                     maxbytes=FRAGMENT_MAXBYTES,
+                     sizeof=lambda parts: sum(len(part) for part in parts))
+
+
+def fragment(name, *key, slot='', caller):
+    """The markup rendered by `caller`, cached under `(name, *key)`."""
+
+    key = (name,) + key
+    parts = fragments.get(key)
+    if parts is None:
+        html = caller(Markup(HOLE)) if caller.arguments else caller()
+        parts = tuple(str(html).split(HOLE))
+        fragments.set(key, parts)
+    return Markup(str(escape(slot)).join(parts))
+
+
+@event.listens_for(db.metadata, 'after_drop')
+def forget_fragments(*args, **kw):
+    """Ids start over when the tables are recreated."""
+
+    fragments.clear()
+
+
+def init_fragments(app):
+    """Make `fragment` available to `app`'s templates."""
+
+    app.jinja_env.globals['fragment'] = fragment
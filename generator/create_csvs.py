@@ -2,76 +2,234 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. a load-test dataset:
+
+    python generator/create_csvs.py --users 1000000 --messages 10000000 \\
+        --follows 50000000 --likes 20000000 --out /tmp/warbler-data
+
+and then `python loader.py --dir /tmp/warbler-data`.
+
+The output depends only on the options and --seed (not on --workers) and
+nothing is fetched over the network. Rows are generated in fixed-size
+shards, in parallel, and streamed to disk, so memory use doesn't grow with
+the dataset. Follower counts, posting activity and likes follow power laws:
+a few users are followed by, and a few messages liked by, a large share of
+everyone, and a few users post most of the messages.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
-from helpers import get_random_datetime
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import namedtuple
+from multiprocessing import Pool
+
+from helpers import (PORTRAITS, WORDS, heavy_tailed_count, parse_date,
+                     power_law_id, random_datetime_after, sentence,
+                     spread_datetime)
 
 MAX_WARBLER_LENGTH = 140
+MAX_BIO_LENGTH = 100
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+HEADER_IMAGE_URL = '/static/images/warbler-hero.jpg'
+TOWN_SUFFIXES = ['ton', 'ville', 'burgh', 'port', ' Falls', ' City']
 
 USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
-
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
-
-fake = Faker()
-
-# Generate random profile image URLs to use for users
-
-image_urls = [
-    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
-    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
-    for i in range(count)
-]
-
-# Generate random header image URLs to use for users
-
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
-
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+LIKES_CSV_HEADERS = ['user_id', 'message_id', 'timestamp']
+
+# users (or messages) per shard; fixed so the output doesn't depend on --workers
+SHARD_SIZE = 10_000
+
+Options = namedtuple('Options', [
+    'users', 'messages', 'follows', 'likes', 'seed', 'start', 'end',
+    'popularity_alpha', 'activity_alpha', 'like_alpha', 'degree_alpha'])
+
+Shard = namedtuple('Shard', ['table', 'index', 'lo', 'hi', 'path'])
+
+
+def message_timestamp(options, message_id):
+    """Messages are spread evenly over the time range, in id order."""
+
+    return spread_datetime((message_id - 0.5) / options.messages,
+                           options.start, options.end)
+
+
+def users(options, rng, lo, hi):
+    for i in range(lo, hi):
+        username = f"{rng.choice(WORDS)}{rng.choice(WORDS)}{i}"
+        yield [f"{username}@example.com",
+               username,
+               rng.choice(PORTRAITS),
+               PASSWORD,
+               sentence(rng, MAX_BIO_LENGTH),
+               HEADER_IMAGE_URL,
+               rng.choice(WORDS).capitalize() + rng.choice(TOWN_SUFFIXES)]
+
+
+def messages(options, rng, lo, hi):
+    for message_id in range(lo, hi):
+        yield [sentence(rng, MAX_WARBLER_LENGTH),
+               message_timestamp(options, message_id),
+               power_law_id(rng, options.users, options.activity_alpha)]
+
+
+def follows(options, rng, lo, hi):
+    """Each user in [lo, hi) follows a heavy-tailed number of others,
+    preferring popular ones. Users are never paired twice."""
+
+    mean = options.follows / options.users
+    for follower in range(lo, hi):
+        wanted = heavy_tailed_count(rng, mean, options.degree_alpha,
+                                    options.users - 1)
+        followed = {}
+        for _ in range(4 * wanted):
+            if len(followed) == wanted:
+                break
+            user_id = power_law_id(rng, options.users, options.popularity_alpha)
+            if user_id != follower:
+                followed[user_id] = None
+        for user_id in followed:
+            yield [user_id, follower]
+
+
+def likes(options, rng, lo, hi):
+    """Each user in [lo, hi) likes a heavy-tailed number of messages,
+    preferring popular ones, some time after they were posted."""
+
+    mean = options.likes / options.users
+    for user_id in range(lo, hi):
+        wanted = heavy_tailed_count(rng, mean, options.degree_alpha,
+                                    options.messages)
+        liked = {}
+        for _ in range(4 * wanted):
+            if len(liked) == wanted:
+                break
+            liked[power_law_id(rng, options.messages, options.like_alpha)] = None
+        for message_id in liked:
+            yield [user_id, message_id,
+                   random_datetime_after(rng,
+                                         message_timestamp(options, message_id),
+                                         options.end)]
+
+
+# table -> (headers, row generator, rows the shards are split over)
+TABLES = {
+    'users': (USERS_CSV_HEADERS, users, lambda options: options.users),
+    'messages': (MESSAGES_CSV_HEADERS, messages, lambda options: options.messages),
+    'follows': (FOLLOWS_CSV_HEADERS, follows, lambda options: options.users),
+    'likes': (LIKES_CSV_HEADERS, likes, lambda options: options.users),
+}
+
+
+def write_shard(options, shard):
+    """Write one shard's rows (no header) to its own file."""
+
+    _, generate, _ = TABLES[shard.table]
+    rng = random.Random(f"{options.seed}:{shard.table}:{shard.index}")
+    with open(shard.path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        rows = 0
+        for row in generate(options, rng, shard.lo, shard.hi):
+            writer.writerow(row)
+            rows += 1
+    return shard, rows
+
+
+def _write_shard(args):
+    return write_shard(*args)
+
+
+def shards(options, tables, directory):
+    for table in tables:
+        _, _, count = TABLES[table]
+        total = count(options)
+        for index, lo in enumerate(range(1, total + 1, SHARD_SIZE)):
+            yield Shard(table, index, lo, min(lo + SHARD_SIZE, total + 1),
+                        os.path.join(directory, f"{table}-{index:06}.csv"))
+
+
+def generate(options, out, workers=None, tables=None, report=print):
+    """Write `<table>.csv` into `out` for each of `tables` (default: all)."""
+
+    # nothing to like without messages
+    tables = [table for table in (tables or TABLES)
+              if getattr(options, table) > 0
+              and not (table == 'likes' and options.messages == 0)]
+    os.makedirs(out, exist_ok=True)
+    outputs = {}
+    rows = dict.fromkeys(tables, 0)
+    started = time.perf_counter()
+
+    with tempfile.TemporaryDirectory(dir=out) as scratch:
+        tasks = [(options, shard) for shard in shards(options, tables, scratch)]
+        pool = Pool(workers) if workers != 1 else None
+        try:
+            results = (pool.imap(_write_shard, tasks) if pool
+                       else map(_write_shard, tasks))
+
+            # shards come back in order: append each to its table's file
+            for shard, count in results:
+                if shard.table not in outputs:
+                    outputs[shard.table] = open(
+                        os.path.join(out, f"{shard.table}.csv"), 'w', newline='')
+                    csv.writer(outputs[shard.table]).writerow(TABLES[shard.table][0])
+                with open(shard.path, newline='') as part:
+                    shutil.copyfileobj(part, outputs[shard.table])
+                os.remove(shard.path)
+                rows[shard.table] += count
+        finally:
+            for output in outputs.values():
+                output.close()
+            if pool:
+                pool.close()
+                pool.join()
+
+    elapsed = time.perf_counter() - started
+    for table in tables:
+        report(f"  {table}.csv: {rows[table]:,} rows")
+    total = sum(rows.values())
+    report(f"Generated {total:,} rows in {elapsed:.1f}s "
+           f"({total / max(elapsed, 1e-9):,.0f} rows/sec)")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--follows', type=int, default=5000,
+                        help='about how many follows in total')
+    parser.add_argument('--likes', type=int, default=2000,
+                        help='about how many likes in total')
+    parser.add_argument('--seed', default='warbler')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='generating processes (1 runs inline)')
+    parser.add_argument('--out', default='generator',
+                        help='directory to write the CSV files to')
+    parser.add_argument('--start', type=parse_date, default='2021-01-01',
+                        help='earliest message date (YYYY-MM-DD)')
+    parser.add_argument('--end', type=parse_date, default='2023-01-01',
+                        help='latest message date (YYYY-MM-DD)')
+    parser.add_argument('--popularity-alpha', type=float, default=1.1,
+                        help='power-law exponent of follower counts')
+    parser.add_argument('--activity-alpha', type=float, default=1.1,
+                        help='power-law exponent of messages per user')
+    parser.add_argument('--like-alpha', type=float, default=1.2,
+                        help='power-law exponent of likes per message')
+    parser.add_argument('--degree-alpha', type=float, default=2.0,
+                        help='Pareto shape of follows and likes per user')
+    args = parser.parse_args()
+
+    options = Options(args.users, args.messages, args.follows, args.likes,
+                      args.seed, args.start, args.end, args.popularity_alpha,
+                      args.activity_alpha, args.like_alpha, args.degree_alpha)
+    generate(options, args.out, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
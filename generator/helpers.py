@@ -1,14 +1,106 @@
-"""Support functions for CSV generation."""
+"""Support functions for CSV generation.
 
-from datetime import datetime
-from random import uniform
+Everything here draws from a `random.Random` passed in, so the generated
+data depends only on the seed. None of it holds per-user or per-message
+state: power-law choices are made by inverse transform sampling and
+scattered over the ids with a bijection, in constant memory.
+"""
 
+from datetime import datetime, timedelta
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+# a prime larger than any table, so `rank * SCATTER_PRIME % n` is a bijection
+SCATTER_PRIME = 2_147_483_647
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+WORDS = """
+    able about above across after again against almost alone along already
+    also always among another answer anyone anything around away back became
+    because become before began behind being believe below best better
+    between beyond both bring brought build built call came care carry case
+    cause certain change city clear close cold come common could country
+    course cover cross dark day deep different does done door down draw
+    during each early earth east easy either else end enough even evening
+    ever every example face fact fall family far fast feel field find fine
+    fire first follow food form found free friend front full game gave
+    general give given going good great green ground group grow half hand
+    happen hard have head hear heard heart heavy help here high hold home
+    hope hour house however idea important inside instead island just keep
+    kind knew know land large last later laugh learn leave left less letter
+    life light line list little live long look made main make many mark
+    matter mean might mind minute miss money month more morning most mother
+    move much music must name near need never next night nothing notice now
+    number ocean often once only open order other over own page paper part
+    pass past people perhaps picture piece place plan plant play point
+    power present problem pull question quick quiet rain reach read ready
+    real reason remember rest right river road rock room round rule same
+    saw school science second seem sentence serve several shape short
+    should show side simple since small snow some song soon sound south
+    space stand start state still stood story street strong study such
+    summer sun sure surface table take talk tell than that then there these
+    thing think those though thought through time today together told took
+    toward town travel tree true try turn under until upon usual very voice
+    walk wall want warm watch water wave weather week well went west where
+    while white whole why wind window winter wish with without wonder wood
+    word work world would write year young
+""".split()
 
-    return datetime.fromtimestamp(random_timestamp)
+PORTRAITS = [
+    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
+    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
+    for i in range(count)
+]
+
+
+def power_law_rank(rng, n, alpha):
+    """A rank in [0, n), where rank r is chosen with weight ~ 1 / (r + 1)**alpha."""
+
+    u = rng.random()
+    if alpha == 1:
+        rank = n ** u
+    else:
+        # inverse CDF of the continuous power law on [1, n + 1)
+        rank = (1 + u * ((n + 1) ** (1 - alpha) - 1)) ** (1 / (1 - alpha))
+    return min(int(rank) - 1, n - 1)
+
+
+def scatter(rank, n):
+    """Map rank in [0, n) to an id in [1, n], spreading popular ranks out."""
+
+    return rank * SCATTER_PRIME % n + 1
+
+
+def power_law_id(rng, n, alpha):
+    """An id in [1, n], a few of them much more likely than the rest."""
+
+    return scatter(power_law_rank(rng, n, alpha), n)
+
+
+def heavy_tailed_count(rng, mean, alpha, cap):
+    """A Pareto-distributed count averaging about `mean`, at most `cap`."""
+
+    if mean <= 0:
+        return 0
+    scale = mean * (alpha - 1) / alpha
+    return min(int(scale * rng.paretovariate(alpha)), cap)
+
+
+def sentence(rng, max_length):
+    """Some random words, capitalized and at most `max_length` long."""
+
+    text = ' '.join(rng.choices(WORDS, k=rng.randint(3, 25)))
+    return (text[:max_length - 1].rstrip() + '.').capitalize()
+
+
+def spread_datetime(position, start, end):
+    """The datetime `position` (0..1) of the way from `start` to `end`."""
+
+    return start + (end - start) * position
+
+
+def random_datetime_after(rng, then, end, within=timedelta(days=30)):
+    """A datetime shortly after `then`, but not after `end`."""
+
+    return min(then + within * rng.random(), end)
+
+
+def parse_date(text):
+    return datetime.strptime(text, '%Y-%m-%d')
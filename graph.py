@@ -0,0 +1,456 @@
+"""In-memory follow graph for Warbler.
+
+Who follows whom is kept per process in compressed sparse row (CSR) form,
+once per direction: `offsets[u]:offsets[u + 1]` is the slice of a flat
+int32 array holding the sorted ids `u` follows (or is followed by). That
+is about 8 bytes per follow for both directions together, instead of an
+ORM object per edge, and a follow check is a binary search within one
+user's slice.
+
+The graph is loaded from the `follows` table on first use and kept up to
+date as follows are written: every statement that inserts or deletes a
+single (follower, followed) row is picked up, and applied when its
+transaction commits. New follows are kept in small per-user sets until
+there are enough of them to be worth folding into the arrays. Any other
+write to `follows` (or to `users`, which cascades) makes this process
+reload the graph on next use. Writes by other processes are picked up by
+reloading every GRAPH_TTL seconds, so pages showing the viewer's own
+follows ask the database instead (`User.is_following`).
+"""
+
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from itertools import repeat
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.expression import Delete, Insert, TextClause, Update
+
+from likes import INSERTS
+from models import db, Follows
+
+# how long a loaded graph is used before it's reloaded for other processes' writes
+GRAPH_TTL = 300
+
+# pending changes are folded into the arrays once there are more than
+# COMPACT_MIN of them and more than 1/COMPACT_RATIO of the edges
+COMPACT_MIN = 1024
+COMPACT_RATIO = 16
+
+# rows fetched at a time while loading
+LOAD_BATCH = 10000
+
+EDGE_KEYS = frozenset(['user_following_id', 'user_being_followed_id'])
+
+
+class Adjacency:
+    """One direction of the graph: a CSR snapshot plus changes since."""
+
+    def __init__(self, offsets=None, neighbors=None):
+        self.offsets = offsets if offsets is not None else array('q', [0])
+        self.neighbors = neighbors if neighbors is not None else array('i')
+        self.added = {}
+        self.removed = {}
+        self.changes = 0
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Build from (node, neighbor) pairs sorted by node, then neighbor."""
+
+        offsets = array('q')
+        neighbors = array('i')
+        for node, neighbor in pairs:
+            if node >= len(offsets):
+                offsets.extend(repeat(len(neighbors), node + 1 - len(offsets)))
+            neighbors.append(neighbor)
+        offsets.append(len(neighbors))
+        return cls(offsets, neighbors)
+
+    def transposed(self):
+        """The same edges in the other direction (the snapshot only)."""
+
+        size = max(len(self.offsets) - 1, max(self.neighbors, default=-1) + 1)
+        offsets = array('q', repeat(0, size + 1))
+        for neighbor in self.neighbors:
+            offsets[neighbor + 1] += 1
+        for node in range(size):
+            offsets[node + 1] += offsets[node]
+
+        # visiting nodes in order keeps every reversed slice sorted
+        neighbors = array('i', repeat(0, len(self.neighbors)))
+        fill = offsets[:-1]
+        for node in range(len(self.offsets) - 1):
+            for i in range(self.offsets[node], self.offsets[node + 1]):
+                neighbor = self.neighbors[i]
+                neighbors[fill[neighbor]] = node
+                fill[neighbor] += 1
+        return Adjacency(offsets, neighbors)
+
+    def _bounds(self, node):
+        if node + 1 >= len(self.offsets):
+            return 0, 0
+        return self.offsets[node], self.offsets[node + 1]
+
+    def _in_snapshot(self, node, neighbor):
+        lo, hi = self._bounds(node)
+        i = bisect_left(self.neighbors, neighbor, lo, hi)
+        return i < hi and self.neighbors[i] == neighbor
+
+    def contains(self, node, neighbor):
+        if neighbor in self.added.get(node, ()):
+            return True
+        if neighbor in self.removed.get(node, ()):
+            return False
+        return self._in_snapshot(node, neighbor)
+
+    def of(self, node):
+        """The sorted neighbors of `node`, as an int32 array."""
+
+        lo, hi = self._bounds(node)
+        found = self.neighbors[lo:hi]
+        added = self.added.get(node)
+        removed = self.removed.get(node)
+        if removed:
+            found = array('i', (n for n in found if n not in removed))
+        if added:
+            found = array('i', sorted(found + array('i', added)))
+        return found
+
+    def add(self, node, neighbor):
+        if self.contains(node, neighbor):
+            return
+        removed = self.removed.get(node)
+        if removed and neighbor in removed:
+            removed.discard(neighbor)
+        else:
+            self.added.setdefault(node, set()).add(neighbor)
+        self.changes += 1
+
+    def discard(self, node, neighbor):
+        if not self.contains(node, neighbor):
+            return
+        added = self.added.get(node)
+        if added and neighbor in added:
+            added.discard(neighbor)
+        else:
+            self.removed.setdefault(node, set()).add(neighbor)
+        self.changes += 1
+
+    def needs_compacting(self):
+        return (self.changes > COMPACT_MIN
+                and self.changes * COMPACT_RATIO > len(self.neighbors))
+
+    def compact(self):
+        """Fold the pending changes into a new snapshot."""
+
+        nodes = max([len(self.offsets) - 1] + [node + 1 for node in self.added])
+        offsets = array('q', [0])
+        neighbors = array('i')
+        for node in range(nodes):
+            neighbors.extend(self.of(node))
+            offsets.append(len(neighbors))
+        self.offsets, self.neighbors = offsets, neighbors
+        self.added, self.removed = {}, {}
+        self.changes = 0
+
+    @property
+    def nbytes(self):
+        return (self.offsets.itemsize * len(self.offsets)
+                + self.neighbors.itemsize * len(self.neighbors))
+
+
+class FollowGraph:
+    """Who follows whom, in both directions."""
+
+    def __init__(self, following=None):
+        self.following = following or Adjacency()
+        self.followers = self.following.transposed()
+        self.lock = threading.RLock()
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Build from (follower, followed) pairs, sorted."""
+
+        return cls(Adjacency.from_pairs(pairs))
+
+    def is_following(self, follower_id, followed_id):
+        with self.lock:
+            return self.following.contains(follower_id, followed_id)
+
+    def follow(self, follower_id, followed_id):
+        with self.lock:
+            self.following.add(follower_id, followed_id)
+            self.followers.add(followed_id, follower_id)
+            self._maybe_compact()
+
+    def unfollow(self, follower_id, followed_id):
+        with self.lock:
+            self.following.discard(follower_id, followed_id)
+            self.followers.discard(followed_id, follower_id)
+            self._maybe_compact()
+
+    def remove_user(self, user_id):
+        """Drop every follow to and from `user_id`."""
+
+        with self.lock:
+            for followed_id in self.following.of(user_id):
+                self.unfollow(user_id, followed_id)
+            for follower_id in self.followers.of(user_id):
+                self.unfollow(follower_id, user_id)
+
+    def _maybe_compact(self):
+        for adjacency in (self.following, self.followers):
+            if adjacency.needs_compacting():
+                adjacency.compact()
+
+    def apply(self, change):
+        kind, *args = change
+        getattr(self, kind)(*args)
+
+    def stats(self):
+        with self.lock:
+            return dict(edges=len(self.following.neighbors),
+                        pending=self.following.changes + self.followers.changes,
+                        bytes=self.following.nbytes + self.followers.nbytes)
+
+
+_graph = None
+_loaded_at = 0
+_stale = True
+# changes committed while a reload is reading the table, replayed onto it
+_replay = None
+_lock = threading.Lock()
+_loading = threading.Lock()
+
+
+def read_following(connection):
+    """Read who follows whom through `connection`, as one Adjacency."""
+
+    rows = connection.execution_options(yield_per=LOAD_BATCH).execute(
+        db.select(Follows.user_following_id, Follows.user_being_followed_id)
+        .order_by(Follows.user_following_id, Follows.user_being_followed_id))
+    return Adjacency.from_pairs(rows)
+
+
+def load(connection):
+    """Read the whole graph through `connection`."""
+
+    return FollowGraph(read_following(connection))
+
+
+def _reload():
+    global _graph, _loaded_at, _stale, _replay
+
+    with _lock:
+        _stale = False
+        _replay = []
+    try:
+        with db.engine.connect() as connection:
+            graph = load(connection)
+    except BaseException:
+        with _lock:
+            _stale = True
+            _replay = None
+        raise
+
+    with _lock:
+        for change in _replay:
+            graph.apply(change)
+        _graph, _loaded_at, _replay = graph, time.monotonic(), None
+        return graph
+
+
+def get():
+    """This process's FollowGraph, (re)loading it if needed.
+
+    When the graph has only expired, one thread reloads it while the others
+    carry on with the old one.
+    """
+
+    graph = _graph
+    if graph is not None and not _stale:
+        if time.monotonic() - _loaded_at < GRAPH_TTL:
+            return graph
+        if not _loading.acquire(blocking=False):
+            return graph
+    else:
+        _loading.acquire()
+
+    try:
+        if _graph is not None and not _stale \
+                and time.monotonic() - _loaded_at < GRAPH_TTL:
+            return _graph
+        return _reload()
+    finally:
+        _loading.release()
+
+
+def forget():
+    """Reload the graph on next use (e.g. after a bulk load)."""
+
+    global _stale
+    _stale = True
+
+
+def is_following(follower_id, followed_id):
+    return get().is_following(follower_id, followed_id)
+
+
+_unfollow_statement = db.delete(Follows).where(
+    Follows.user_following_id == db.bindparam('user_following_id'),
+    Follows.user_being_followed_id == db.bindparam('user_being_followed_id'))
+
+
+def follow(follower_id, followed_id):
+    """Insert a follow, without loading either user's collections.
+
+    Returns True if it wasn't there already.
+    """
+
+    statement = (INSERTS[db.engine.dialect.name](Follows)
+                 .on_conflict_do_nothing(
+                     index_elements=['user_being_followed_id', 'user_following_id'])
+                 .returning(Follows.user_following_id))
+    return _execute(statement, [(follower_id, followed_id)]).first() is not None
+
+
+def unfollow(follower_id, followed_id):
+    """Delete a follow, without loading either user's collections.
+
+    Returns True if it was there.
+    """
+
+    statement = _unfollow_statement.returning(Follows.user_following_id)
+    return _execute(statement, [(follower_id, followed_id)]).first() is not None
+
+
+def follow_many(pairs):
+    """Insert (follower, followed) `pairs` in one executemany."""
+
+    db.session.execute(db.insert(Follows),
+                       [dict(user_following_id=follower_id,
+                             user_being_followed_id=followed_id)
+                        for follower_id, followed_id in pairs])
+
+
+def unfollow_many(pairs):
+    """Delete (follower, followed) `pairs` in one executemany."""
+
+    _execute(_unfollow_statement, pairs)
+
+
+def _execute(statement, pairs):
+    """Run `statement` once per (follower, followed) pair, on the session's
+    connection but outside the ORM."""
+
+    # the ORM can't run a DELETE as an executemany, nor skip conflicting
+    # rows of an INSERT ... RETURNING; binding the connection to the
+    # statement keeps it on the primary
+    connection = db.session.connection(bind_arguments={'clause': statement})
+    return connection.execute(statement,
+                              [dict(user_following_id=follower_id,
+                                    user_being_followed_id=followed_id)
+                               for follower_id, followed_id in pairs])
+
+
+def _changes(statement, rows):
+    """How a write changes the graph: a list of changes, or None if unknown.
+
+    Follows are recognized by their parameters: one (follower, followed)
+    pair per row, as both the ORM and `follow` / `unfollow` send them.
+    """
+
+    table = statement.table.name
+    if table == 'follows':
+        if isinstance(statement, Update) or isinstance(statement, Insert) and (
+                statement._values or statement._multi_values
+                or statement.select is not None):
+            return None
+        if not all(set(row) == EDGE_KEYS for row in rows):
+            return None
+        kind = 'follow' if isinstance(statement, Insert) else 'unfollow'
+        return [(kind, row['user_following_id'], row['user_being_followed_id'])
+                for row in rows]
+
+    if isinstance(statement, Delete):
+        if not all(set(row) == {'id'} for row in rows):
+            return None
+        return [('remove_user', row['id']) for row in rows]
+    # new users and updates to them don't change who follows whom
+    return []
+
+
+@event.listens_for(Engine, 'after_execute')
+def track_writes(conn, clauseelement, multiparams, params, execution_options,
+                 result):
+    """Note the follows a statement adds or removes, to apply on commit."""
+
+    if isinstance(clauseelement, (Insert, Delete, Update)):
+        if clauseelement.table.name not in ('follows', 'users'):
+            return
+        changes = _changes(clauseelement, multiparams or [params])
+    elif isinstance(clauseelement, (str, TextClause)):
+        # hand-written SQL: reload if it might have touched follows
+        sql = str(clauseelement).lower()
+        if 'follows' not in sql and 'users' not in sql \
+                or sql.lstrip().startswith(('select', 'with', 'explain')):
+            return
+        changes = None
+    else:
+        return
+
+    if changes is None:
+        changes = [('forget',)]
+    if changes:
+        conn.info.setdefault('follow_graph', []).extend(changes)
+
+
+@event.listens_for(Engine, 'commit')
+def apply_writes(conn):
+    pending = conn.info.pop('follow_graph', None)
+    if not pending:
+        return
+
+    with _lock:
+        if _replay is not None:
+            _replay.extend(change for change in pending if change[0] != 'forget')
+        for change in pending:
+            if change[0] == 'forget':
+                forget()
+            elif _graph is not None:
+                _graph.apply(change)
+
+
+@event.listens_for(Engine, 'rollback')
+def discard_writes(conn):
+    conn.info.pop('follow_graph', None)
+
+
+@event.listens_for(Engine, 'rollback_savepoint')
+def forget_after_savepoint(conn, name, context):
+    # which of the pending changes were undone isn't known
+    if conn.info.get('follow_graph'):
+        conn.info['follow_graph'].append(('forget',))
+
+
+@event.listens_for(db.metadata, 'after_drop')
+@event.listens_for(db.metadata, 'after_create')
+def forget_on_schema_change(*args, **kw):
+    forget()
+
+
+def render():
+    """The graph's size, in Prometheus text format."""
+
+    graph = _graph
+    stats = graph.stats() if graph else dict(edges=0, pending=0, bytes=0)
+    return "\n".join([
+        "# TYPE warbler_follow_graph_edges gauge",
+        f"warbler_follow_graph_edges {stats['edges']}",
+        "# TYPE warbler_follow_graph_pending gauge",
+        f"warbler_follow_graph_pending {stats['pending']}",
+        "# TYPE warbler_follow_graph_bytes gauge",
+        f"warbler_follow_graph_bytes {stats['bytes']}",
+    ])
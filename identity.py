@@ -0,0 +1,65 @@
+"""Per-process cache of logged-in users, used to set `g.user`.
+
+Only the user's column values are cached, as a detached snapshot. Each
+request merges the snapshot into its own session without a query
+(`merge(load=False)`), so `g.user` still behaves like a normal persistent
+User: relationships lazy-load and changes are saved on commit.
+
+Views that change a user (profile edits, deletes, follows, likes, posts)
+call `forget`; other processes see the change once IDENTITY_TTL runs out.
+"""
+
+from sqlalchemy.orm import make_transient_to_detached
+
+from cache import LRUCache
+from models import db, User
+
+IDENTITY_TTL = 30
+IDENTITY_MAXSIZE = 10000
+
+users = LRUCache('identity', maxsize=IDENTITY_MAXSIZE, ttl=IDENTITY_TTL)
+
+
+def snapshot(user):
+    """A detached copy of `user`'s column values, safe to share between sessions."""
+
+    copy = User(**{attr.key: getattr(user, attr.key)
+                   for attr in User.__mapper__.column_attrs})
+    make_transient_to_detached(copy)
+    return copy
+
+
+def load_user(user_id):
+    """The User with `user_id` in the current session, from cache if possible."""
+
+    cached = users.get(user_id)
+    if cached is not None:
+        return db.session.merge(cached, load=False)
+
+    user = db.session.get(User, user_id)
+    if user is not None:
+        users.set(user_id, snapshot(user))
+    return user
+
+
+def users_by_ids(user_ids):
+    """{id: detached User} for `user_ids`, for reading only.
+
+    Cached users come from memory; the rest are read in one query and
+    cached. Ids with no (or a deleted) user are left out.
+    """
+
+    found = users.get_many(user_ids)
+    missing = [user_id for user_id in user_ids if user_id not in found]
+    if missing:
+        for user in db.session.execute(
+                db.select(User).where(User.id.in_(missing))).scalars():
+            found[user.id] = snapshot(user)
+            users.set(user.id, found[user.id])
+    return found
+
+
+def forget(*user_ids):
+    """Drop cached users whose rows have changed."""
+
+    users.delete(*user_ids)
@@ -0,0 +1,78 @@
+"""Liking and unliking messages.
+
+Each change is a single atomic statement against the unique
+`(user_id, message_id)` constraint: `INSERT ... ON CONFLICT DO NOTHING
+RETURNING` to like and `DELETE ... RETURNING` to unlike. The RETURNING row
+tells us whether anything changed, so double clicks and races between
+tabs never create duplicate likes or skew the user's likes counter.
+"""
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, Likes, Message
+import counters
+
+INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def like(user_id, message_id):
+    """Like a message. Returns True if it wasn't liked already."""
+
+    insert = INSERTS[db.engine.dialect.name]
+    created = db.session.execute(
+        insert(Likes)
+        .values(user_id=user_id, message_id=message_id)
+        .on_conflict_do_nothing(index_elements=['user_id', 'message_id'])
+        .returning(Likes.id)).scalar()
+
+    if created is None:
+        return False
+    counters.bump(user_id, likes_count=1)
+    return True
+
+
+def unlike(user_id, message_id):
+    """Unlike a message. Returns True if it was liked."""
+
+    deleted = db.session.execute(
+        db.delete(Likes)
+        .where(Likes.user_id == user_id)
+        .where(Likes.message_id == message_id)
+        .returning(Likes.id)).scalar()
+
+    if deleted is None:
+        return False
+    counters.bump(user_id, likes_count=-1)
+    return True
+
+
+def toggle(user_id, message_id):
+    """Unlike the message if it is liked, like it otherwise.
+
+    Returns whether the message is liked afterwards.
+    """
+
+    if unlike(user_id, message_id):
+        return False
+    like(user_id, message_id)
+    return True
+
+
+def state(user_id, message_id):
+    """Whether `user_id` likes the message, or None if there's no such message."""
+
+    liked = (db.select(Likes.id)
+             .where(Likes.user_id == user_id)
+             .where(Likes.message_id == Message.id)
+             .exists())
+    return db.session.execute(
+        db.select(liked).where(Message.id == message_id)).scalar()
+
+
+def count(message_id):
+    """How many users like the message."""
+
+    return db.session.execute(
+        db.select(db.func.count())
+        .select_from(Likes)
+        .where(Likes.message_id == message_id)).scalar()
@@ -0,0 +1,263 @@
+"""Bulk loading of the generator's CSV files into the database.
+
+Files are streamed straight into the tables in fixed-size chunks, so
+memory use doesn't grow with the file: PostgreSQL reads them with
+`COPY ... FROM STDIN`, other databases (SQLite) get batched executemany
+INSERTs. No ORM objects or dicts are built per row.
+
+On PostgreSQL, secondary indexes, unique and foreign key constraints are
+dropped before loading and recreated afterwards (building an index once is
+much cheaper than updating it row by row), which also makes the tables
+independent of each other so they are loaded in parallel. Recreating the
+constraints validates the loaded data. Id sequences are then moved past
+the loaded ids.
+
+    python loader.py --dir generator --workers 4
+"""
+
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from models import db
+import graph
+
+# table -> CSV file, in foreign key order
+FILES = {
+    'users': 'users.csv',
+    'messages': 'messages.csv',
+    'follows': 'follows.csv',
+    'likes': 'likes.csv',
+}
+
+CHUNK_SIZE = 64 * 1024      # bytes per COPY read
+BATCH_SIZE = 5000           # rows per executemany
+PROGRESS_EVERY = 5          # seconds between progress lines
+
+
+class Progress:
+    """Prints rows loaded and rows/sec for one table, every few seconds."""
+
+    def __init__(self, table, out=print):
+        self.table = table
+        self.out = out
+        self.rows = 0
+        self.started = self.reported = time.perf_counter()
+
+    @property
+    def rate(self):
+        return self.rows / max(time.perf_counter() - self.started, 1e-9)
+
+    def add(self, rows):
+        self.rows += rows
+        now = time.perf_counter()
+        if now - self.reported >= PROGRESS_EVERY:
+            self.reported = now
+            self.out(f"  {self.table}: {self.rows:,} rows "
+                     f"({self.rate:,.0f} rows/sec)")
+
+    def done(self, rows=None):
+        if rows is not None:
+            self.rows = rows
+        self.out(f"  {self.table}: {self.rows:,} rows loaded in "
+                 f"{time.perf_counter() - self.started:.1f}s "
+                 f"({self.rate:,.0f} rows/sec)")
+
+
+class CountingReader:
+    """File wrapper counting the lines COPY has read, for progress."""
+
+    def __init__(self, file, progress):
+        self.file = file
+        self.progress = progress
+
+    def read(self, size=CHUNK_SIZE):
+        chunk = self.file.read(size)
+        self.progress.add(chunk.count('\n'))
+        return chunk
+
+
+def header(path):
+    with open(path, newline='') as file:
+        return next(csv.reader(file))
+
+
+def copy_table(engine, table, path, out=print):
+    """Stream `path` into `table` with COPY. Returns the rows loaded."""
+
+    progress = Progress(table, out)
+    columns = ', '.join(header(path))
+    raw = engine.raw_connection()
+    try:
+        with open(path, newline='') as file, raw.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {table} ({columns}) FROM STDIN "
+                f"WITH (FORMAT csv, HEADER true)",
+                CountingReader(file, progress),
+                size=CHUNK_SIZE)
+            rows = cursor.rowcount
+        raw.commit()
+    finally:
+        raw.close()
+    progress.done(rows)
+    return rows
+
+
+def insert_table(engine, table, path, out=print):
+    """Stream `path` into `table` with batched INSERTs. Returns the rows loaded."""
+
+    progress = Progress(table, out)
+    placeholder = '?' if engine.dialect.paramstyle == 'qmark' else '%s'
+    rows = 0
+    with open(path, newline='') as file, engine.begin() as conn:
+        reader = csv.reader(file)
+        columns = next(reader)
+        statement = (f"INSERT INTO {table} ({', '.join(columns)}) "
+                     f"VALUES ({', '.join([placeholder] * len(columns))})")
+        while True:
+            # empty fields are NULLs, as with COPY
+            batch = [tuple(value or None for value in row)
+                     for row in islice(reader, BATCH_SIZE)]
+            if not batch:
+                progress.done()
+                return rows
+            conn.exec_driver_sql(statement, batch)
+            rows += len(batch)
+            progress.add(len(batch))
+
+
+def deferred_ddl(conn, tables):
+    """DDL to recreate the secondary indexes and constraints of `tables`.
+
+    Returns `(constraints, indexes)` as `(table, name, definition)` tuples.
+    """
+
+    constraints = conn.exec_driver_sql("""
+        SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = ANY(%(tables)s::regclass[]) AND contype IN ('u', 'f')
+        ORDER BY contype DESC, conname
+    """, {'tables': tables}).all()
+
+    # indexes that don't back a primary key or constraint
+    indexes = conn.exec_driver_sql("""
+        SELECT tablename, indexname, indexdef
+        FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = ANY(%(tables)s)
+          AND indexname NOT IN (SELECT conname FROM pg_constraint)
+        ORDER BY indexname
+    """, {'tables': tables}).all()
+
+    return constraints, indexes
+
+
+def drop_deferred(engine, tables):
+    """Drop the secondary indexes and constraints of `tables`; returns them."""
+
+    with engine.begin() as conn:
+        constraints, indexes = deferred_ddl(conn, tables)
+        for table, name, _ in indexes:
+            conn.exec_driver_sql(f'DROP INDEX "{name}"')
+        # foreign keys first: unique constraints may back them
+        for table, name, _ in reversed(constraints):
+            conn.exec_driver_sql(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"')
+    return constraints, indexes
+
+
+def restore_deferred(engine, constraints, indexes, workers):
+    """Recreate what `drop_deferred` dropped: indexes in parallel, then
+    unique constraints before the foreign keys that may depend on them."""
+
+    def create(definition):
+        with engine.begin() as conn:
+            conn.exec_driver_sql(definition)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(create, [definition for _, _, definition in indexes]))
+
+    with engine.begin() as conn:
+        for table, name, definition in constraints:
+            conn.exec_driver_sql(
+                f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}')
+
+
+def reset_sequences(engine, tables):
+    """Move each table's id sequence past the largest loaded id."""
+
+    with engine.begin() as conn:
+        for table in tables:
+            if 'id' not in db.metadata.tables[table].c:
+                continue
+            sequence = conn.exec_driver_sql(
+                "SELECT pg_get_serial_sequence(%(table)s, 'id')",
+                {'table': table}).scalar()
+            if sequence:
+                conn.exec_driver_sql(
+                    f"SELECT setval(%(sequence)s, "
+                    f"coalesce((SELECT max(id) FROM {table}), 0) + 1, false)",
+                    {'sequence': sequence})
+
+
+def load(directory='generator', engine=None, workers=None, out=print):
+    """Load the CSV files in `directory` into their (empty) tables.
+
+    Returns `{table: rows loaded}`.
+    """
+
+    engine = engine or db.engine
+    paths = {table: os.path.join(directory, filename)
+             for table, filename in FILES.items()
+             if os.path.exists(os.path.join(directory, filename))}
+    tables = list(paths)
+    postgres = engine.dialect.name == 'postgresql'
+    workers = workers or max(1, min(len(tables), os.cpu_count() or 1))
+
+    started = time.perf_counter()
+
+    if postgres:
+        constraints, indexes = drop_deferred(engine, tables)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {table: pool.submit(copy_table, engine, table,
+                                          paths[table], out)
+                       for table in tables}
+            loaded = {table: future.result()
+                      for table, future in futures.items()}
+
+        out("  building indexes and constraints")
+        restore_deferred(engine, constraints, indexes, workers)
+        reset_sequences(engine, tables)
+        with engine.connect().execution_options(
+                isolation_level='AUTOCOMMIT') as conn:
+            conn.exec_driver_sql(f"ANALYZE {', '.join(tables)}")
+    else:
+        # one writer at a time, in foreign key order
+        loaded = {}
+        for table in tables:
+            loaded[table] = insert_table(engine, table, paths[table], out)
+
+    # COPY isn't seen by the follow graph's change tracking
+    graph.forget()
+
+    total = sum(loaded.values())
+    elapsed = time.perf_counter() - started
+    out(f"Loaded {total:,} rows in {elapsed:.1f}s "
+        f"({total / max(elapsed, 1e-9):,.0f} rows/sec)")
+    return loaded
+
+
+if __name__ == '__main__':
+    from app import app
+    from seed import init_db
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dir', default='generator',
+                        help='directory holding the CSV files')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='tables loaded at once (PostgreSQL only)')
+    args = parser.parse_args()
+
+    with app.app_context():
+        init_db(args.dir, workers=args.workers)
@@ -0,0 +1,155 @@
+"""Per-request latency and SQL instrumentation for Warbler.
+
+Every request records, per endpoint, how long it took, how many SQL
+statements it ran and how much of its time was spent in the database.
+The histograms, along with the hit/miss counters of the in-process caches,
+the size of the follow graph and the write-behind buffer's counters, are
+served in Prometheus text format on /metrics.
+
+Setting `QUERY_BUDGET` in the app config (or using `query_budget` in a
+test) makes any request that runs more statements than the budget fail
+with QueryBudgetExceeded.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import cache
+import graph
+import writebehind
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A request ran more SQL statements than QUERY_BUDGET allows."""
+
+
+class Histogram:
+    """A Prometheus-style cumulative histogram, labelled by endpoint."""
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, endpoint, value):
+        with self.lock:
+            counts, total, count = self.series.get(
+                endpoint, ([0] * len(self.buckets), 0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.series[endpoint] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for endpoint, (counts, total, count) in sorted(self.series.items()):
+                label = f'endpoint="{endpoint}"'
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(
+                        f'{self.name}_bucket{{{label},le="{bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{{label}}} {total}')
+                lines.append(f'{self.name}_count{{{label}}} {count}')
+        return "\n".join(lines)
+
+
+request_latency = Histogram('warbler_request_duration_seconds',
+                            'Time spent handling the request.',
+                            LATENCY_BUCKETS)
+request_queries = Histogram('warbler_request_queries',
+                            'SQL statements executed by the request.',
+                            QUERY_BUCKETS)
+request_db_time = Histogram('warbler_request_db_seconds',
+                            'Time the request spent waiting on SQL statements.',
+                            LATENCY_BUCKETS)
+
+HISTOGRAMS = [request_latency, request_queries, request_db_time]
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_statements' in g:
+        conn.info['statement_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def finish_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_statements' in g:
+        g.sql_statements += 1
+        g.sql_time += time.perf_counter() - conn.info['statement_started']
+
+
+def start_request():
+    g.request_started = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_time = 0.0
+
+
+def finish_request(response):
+    endpoint = request.endpoint or 'unmatched'
+    request_latency.observe(endpoint, time.perf_counter() - g.request_started)
+    request_queries.observe(endpoint, g.sql_statements)
+    request_db_time.observe(endpoint, g.sql_time)
+
+    budget = current_app.config.get('QUERY_BUDGET')
+    if budget is not None and g.sql_statements > budget:
+        raise QueryBudgetExceeded(
+            f"{request.method} {request.path} ran {g.sql_statements} "
+            f"SQL statements (budget {budget})")
+
+    return response
+
+
+def render():
+    """All histograms and cache counters in Prometheus text exposition format."""
+
+    sections = [histogram.render() for histogram in HISTOGRAMS]
+    sections.append(cache.render())
+    sections.append(graph.render())
+    sections.append(writebehind.render())
+    return "\n".join(sections) + "\n"
+
+
+def reset():
+    """Forget everything recorded so far."""
+
+    for histogram in HISTOGRAMS:
+        with histogram.lock:
+            histogram.series.clear()
+
+
+@contextmanager
+def query_budget(app, budget):
+    """Fail any request made inside the block that runs over `budget` statements."""
+
+    previous = app.config.get('QUERY_BUDGET')
+    app.config['QUERY_BUDGET'] = budget
+    try:
+        yield
+    finally:
+        app.config['QUERY_BUDGET'] = previous
+
+
+def init_metrics(app):
+    """Record request metrics for `app` and serve them on /metrics."""
+
+    app.before_request(start_request)
+    app.after_request(finish_request)
+
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus scrape endpoint."""
+
+        return Response(render(), mimetype='text/plain; version=0.0.4')
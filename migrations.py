@@ -0,0 +1,211 @@
+"""Versioned schema migrations for existing Warbler databases.
+
+`db.create_all()` builds a fresh database with the current schema and,
+once this module is imported (seed.py does), stamps it at the latest
+version. Databases created before a migration was
+written are brought up to date with:
+
+    flask migrate
+
+Migrations run in version order. Applied versions are recorded in
+`schema_migrations`, so running it again is a no-op.
+
+Each statement runs in its own transaction, and the version is recorded
+only after the last one, so a migration that fails part way is rerun
+from its first statement. Every statement must therefore be idempotent
+(`IF NOT EXISTS`, `IF EXISTS`, `ON CONFLICT DO NOTHING`, or an UPDATE
+that recomputes its values). Indexes are built `CONCURRENTLY` so writes
+to the table carry on while they build. An interrupted concurrent build
+leaves an invalid index behind that `IF NOT EXISTS` won't replace; drop
+it before rerunning.
+
+Migrations are written for PostgreSQL only; `upgrade` refuses to run on
+any other database (create those from scratch with `db.create_all()`).
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import event
+
+from models import db
+from timeline import CELEBRITY_FOLLOWERS, TIMELINE_LENGTH
+
+Migration = namedtuple('Migration', ['version', 'description', 'statements'])
+
+# a statement run only if the `check` query returns true
+Guarded = namedtuple('Guarded', ['check', 'statement'])
+
+MIGRATIONS = [
+    Migration(1, 'likes are unique per (user, message), not per message', [
+        'ALTER TABLE likes DROP CONSTRAINT IF EXISTS likes_message_id_key',
+        'CREATE UNIQUE INDEX {concurrently} IF NOT EXISTS uq_likes_user_message '
+        'ON likes (user_id, message_id)',
+    ]),
+    Migration(2, 'stats counters on users', [
+        *[f'ALTER TABLE users ADD COLUMN IF NOT EXISTS {name} integer '
+          'NOT NULL DEFAULT 0'
+          for name in ('messages_count', 'following_count',
+                       'followers_count', 'likes_count')],
+        'UPDATE users SET '
+        'messages_count = (SELECT count(*) FROM messages '
+        'WHERE messages.user_id = users.id), '
+        'following_count = (SELECT count(*) FROM follows '
+        'WHERE follows.user_following_id = users.id), '
+        'followers_count = (SELECT count(*) FROM follows '
+        'WHERE follows.user_being_followed_id = users.id), '
+        'likes_count = (SELECT count(*) FROM likes '
+        'WHERE likes.user_id = users.id)',
+    ]),
+    Migration(3, 'likes.timestamp, for the likes page', [
+        # when existing likes were made isn't known; they get the
+        # migration's time, new ones get theirs from the app
+        "ALTER TABLE likes ADD COLUMN IF NOT EXISTS timestamp timestamp "
+        "NOT NULL DEFAULT timezone('utc', now())",
+        'ALTER TABLE likes ALTER COLUMN timestamp DROP DEFAULT',
+    ]),
+    Migration(4, 'timeline_entries, for fan-out-on-write home timelines', [
+        'CREATE TABLE IF NOT EXISTS timeline_entries ('
+        'user_id integer NOT NULL REFERENCES users (id) ON DELETE CASCADE, '
+        'message_id integer NOT NULL REFERENCES messages (id) ON DELETE CASCADE, '
+        'author_id integer NOT NULL REFERENCES users (id) ON DELETE CASCADE, '
+        'timestamp timestamp NOT NULL, '
+        'PRIMARY KEY (user_id, message_id))',
+        # every user's newest messages of their own and of those they
+        # follow, as `timeline.rebuild` would (celebrities included; the
+        # homepage merges those away)
+        'INSERT INTO timeline_entries (user_id, message_id, author_id, timestamp) '
+        'SELECT user_id, message_id, author_id, timestamp FROM ('
+        'SELECT readers.user_id, messages.id AS message_id, '
+        'messages.user_id AS author_id, messages.timestamp, '
+        'row_number() OVER (PARTITION BY readers.user_id '
+        'ORDER BY messages.timestamp DESC, messages.id DESC) AS position '
+        'FROM (SELECT id AS user_id, id AS author_id FROM users '
+        'UNION ALL SELECT user_following_id, user_being_followed_id FROM follows) '
+        'AS readers JOIN messages ON messages.user_id = readers.author_id'
+        f') AS ranked WHERE position <= {TIMELINE_LENGTH} '
+        'ON CONFLICT DO NOTHING',
+    ]),
+    Migration(5, 'index pack for the timeline, profile, follows and likes', [
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_messages_user_timestamp '
+        'ON messages (user_id, timestamp, id)',
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_follows_user_following_id '
+        'ON follows (user_following_id, user_being_followed_id)',
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_likes_message_id '
+        'ON likes (message_id)',
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_likes_user_timestamp '
+        'ON likes (user_id, timestamp, id)',
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_users_followers_count '
+        'ON users (followers_count)',
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_timeline_entries_user_timestamp '
+        'ON timeline_entries (user_id, timestamp, message_id)',
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_timeline_entries_message_id '
+        'ON timeline_entries (message_id)',
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_timeline_entries_user_author '
+        'ON timeline_entries (user_id, author_id)',
+    ]),
+    Migration(6, 'users.version, for page ETags', [
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS version integer '
+        'NOT NULL DEFAULT 0',
+    ]),
+    Migration(7, 'suggestions, for "who to follow"', [
+        'CREATE TABLE IF NOT EXISTS suggestions ('
+        'user_id integer NOT NULL REFERENCES users (id) ON DELETE CASCADE, '
+        'rank smallint NOT NULL, '
+        'suggested_id integer NOT NULL REFERENCES users (id) ON DELETE CASCADE, '
+        'score double precision NOT NULL, '
+        'mutual_count integer NOT NULL, '
+        'PRIMARY KEY (user_id, rank))',
+    ]),
+    Migration(8, 'deleted_at tombstones on users and messages', [
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS deleted_at timestamp',
+        'ALTER TABLE messages ADD COLUMN IF NOT EXISTS deleted_at timestamp',
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_users_deleted_at '
+        'ON users (deleted_at) WHERE deleted_at IS NOT NULL',
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_messages_deleted_at '
+        'ON messages (deleted_at) WHERE deleted_at IS NOT NULL',
+    ]),
+    Migration(9, 'users.celebrity, for authors no longer fanned out', [
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS celebrity boolean '
+        'NOT NULL DEFAULT false',
+        # whoever is a celebrity now has probably posted as one
+        f'UPDATE users SET celebrity = true WHERE followers_count > {CELEBRITY_FOLLOWERS}',
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_users_celebrity '
+        'ON users (id) WHERE celebrity',
+    ]),
+    Migration(10, 'users.profile_version, bumped by profile edits only', [
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS profile_version integer '
+        'NOT NULL DEFAULT 0',
+    ]),
+    Migration(11, 'username search indexes (see search.py)', [
+        # the trigram index only where pg_trgm can be installed
+        Guarded("SELECT EXISTS (SELECT 1 FROM pg_available_extensions "
+                "WHERE name = 'pg_trgm')",
+                'CREATE EXTENSION IF NOT EXISTS pg_trgm'),
+        Guarded("SELECT EXISTS (SELECT 1 FROM pg_extension "
+                "WHERE extname = 'pg_trgm')",
+                'CREATE INDEX {concurrently} IF NOT EXISTS ix_users_username_trgm '
+                'ON users USING gist (username gist_trgm_ops)'),
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_users_username_prefix '
+        'ON users (lower(username) text_pattern_ops)',
+    ]),
+]
+
+schema_migrations = db.Table(
+    'schema_migrations',
+    db.Column('version', db.Integer, primary_key=True),
+    db.Column('description', db.Text, nullable=False),
+    db.Column('applied_at', db.DateTime, nullable=False, default=datetime.utcnow),
+)
+
+
+@event.listens_for(db.metadata, 'after_create')
+def stamp(metadata, connection, tables=(), **kw):
+    """A freshly created schema already has every migration applied."""
+
+    created = {table.name for table in tables}
+    if {'users', 'schema_migrations'} <= created:
+        connection.execute(schema_migrations.insert(), [
+            {'version': m.version, 'description': m.description}
+            for m in MIGRATIONS])
+
+
+def applied():
+    """Versions already applied to the database."""
+
+    schema_migrations.create(db.engine, checkfirst=True)
+    with db.engine.connect() as conn:
+        return set(conn.execute(db.select(schema_migrations.c.version)).scalars())
+
+
+def pending():
+    """Migrations not yet applied, oldest first."""
+
+    done = applied()
+    return [m for m in MIGRATIONS if m.version not in done]
+
+
+def upgrade():
+    """Apply every pending migration. Returns the ones applied."""
+
+    migrations = pending()
+    if migrations and db.engine.dialect.name != 'postgresql':
+        raise RuntimeError(
+            f"Migrations need PostgreSQL, not {db.engine.dialect.name}; "
+            "create the database from scratch with db.create_all() instead.")
+
+    for migration in migrations:
+        # CREATE INDEX CONCURRENTLY can't run inside a transaction
+        with db.engine.connect().execution_options(
+                isolation_level='AUTOCOMMIT') as conn:
+            for statement in migration.statements:
+                if isinstance(statement, Guarded):
+                    if not conn.exec_driver_sql(statement.check).scalar():
+                        continue
+                    statement = statement.statement
+                conn.exec_driver_sql(statement.format(concurrently='CONCURRENTLY'))
+            conn.execute(schema_migrations.insert().values(
+                version=migration.version,
+                description=migration.description))
+
+    return migrations
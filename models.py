@@ -2,11 +2,14 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import Session, with_loader_criteria
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+import passwords
+from routing import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class Follows(db.Model):
@@ -26,6 +29,12 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    __table_args__ = (
+        # the primary key covers "who follows X"; this covers "who does X follow"
+        db.Index('ix_follows_user_following_id',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
@@ -45,7 +54,21 @@ class Likes(db.Model):
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    __table_args__ = (
+        # a user likes a message at most once; the like API upserts on this
+        db.UniqueConstraint('user_id', 'message_id', name='uq_likes_user_message'),
+        # counting a message's likes
+        db.Index('ix_likes_message_id', 'message_id'),
+        # keyset pagination of a user's likes page
+        db.Index('ix_likes_user_timestamp', 'user_id', 'timestamp', 'id'),
     )
 
 
@@ -94,6 +117,76 @@ class User(db.Model):
         nullable=False,
     )
 
+    # denormalized stats, maintained by `counters`
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # bumped whenever anything shown on the user's pages changes (profile,
+    # counters, follows, likes); part of the pages' ETags
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # bumped only when the user edits their profile, unlike `version`
+    profile_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # set when the account is deleted; the row is purged later (deletion.py)
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
+    # set once a message of theirs is left out of fan-out, never cleared:
+    # their messages are merged into homepages at read time (timeline.py)
+    celebrity = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+        server_default=db.false(),
+    )
+
+    __table_args__ = (
+        # finding celebrities for the home timeline
+        db.Index('ix_users_followers_count', 'followers_count'),
+        db.Index('ix_users_celebrity', 'id',
+                 postgresql_where=db.text('celebrity')),
+        # finding deleted accounts to purge
+        db.Index('ix_users_deleted_at', 'deleted_at',
+                 postgresql_where=db.text('deleted_at IS NOT NULL')),
+    )
+
     messages = db.relationship('Message')
 
     followers = db.relationship(
@@ -122,14 +215,35 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.is_following(self)
 
     def is_following(self, other_user):
-        """Is this user following `other_use`?"""
+        """Is this user following `other_use`?
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        Asks the database rather than the follow graph, which other
+        processes' follows only reach when it's reloaded. Answers are kept
+        on this instance (`g.user` lives for one request); pages of users
+        load theirs in one query with `load_following`.
+        """
+
+        checked = self.__dict__.setdefault('_following', {})
+        if other_user.id not in checked:
+            self.load_following([other_user])
+        return checked[other_user.id]
+
+    def load_following(self, users):
+        """Look up whether this user follows each of `users`, in one query."""
+
+        checked = self.__dict__.setdefault('_following', {})
+        user_ids = [user.id for user in users if user.id not in checked]
+        if not user_ids:
+            return
+        followed = set(db.session.execute(
+            db.select(Follows.user_being_followed_id)
+            .where(Follows.user_following_id == self.id)
+            .where(Follows.user_being_followed_id.in_(user_ids))).scalars())
+        for user_id in user_ids:
+            checked[user_id] = user_id in followed
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -138,7 +252,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = passwords.hash_password(password)
 
         user = User(
             username=username,
@@ -159,13 +273,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash was made with fewer rounds than BCRYPT_LOG_ROUNDS,
+        it is replaced with a stronger one; the caller commits the change.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth, new_hash = passwords.verify_password(password, user.password)
             if is_auth:
+                if new_hash:
+                    user.password = new_hash
                 return user
 
         return False
@@ -189,7 +308,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -198,8 +317,117 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # set when the message is deleted; the row is purged later (deletion.py)
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
     user = db.relationship('User', overlaps='messages')
 
+    __table_args__ = (
+        # keyset pagination of a user's profile timeline
+        db.Index('ix_messages_user_timestamp', 'user_id', 'timestamp', 'id'),
+        # finding deleted messages to purge
+        db.Index('ix_messages_deleted_at', 'deleted_at',
+                 postgresql_where=db.text('deleted_at IS NOT NULL')),
+    )
+
+
+class TimelineEntry(db.Model):
+    """A message pushed into a user's precomputed home timeline."""
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # author of the message, so an unfollow can drop their entries
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    # copied from the message so the timeline reads never touch `messages`
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        # keyset pagination of the homepage
+        db.Index('ix_timeline_entries_user_timestamp',
+                 'user_id', 'timestamp', 'message_id'),
+        # removing a deleted message from every timeline
+        db.Index('ix_timeline_entries_message_id', 'message_id'),
+        # dropping an unfollowed author's entries
+        db.Index('ix_timeline_entries_user_author', 'user_id', 'author_id'),
+    )
+
+
+class Suggestion(db.Model):
+    """A user suggested to another on their homepage ("who to follow").
+
+    Computed in batches by `recommend.py`; `rank` 0 is the best suggestion.
+    """
+
+    __tablename__ = 'suggestions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    rank = db.Column(
+        db.SmallInteger,
+        primary_key=True,
+    )
+
+    suggested_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    score = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    # how many of the people `user_id` follows follow the suggested user
+    mutual_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def hide_deleted(state):
+    """Leave deleted users and messages out of every ORM select.
+
+    The purge, which must see them, passes `include_deleted=True`.
+    """
+
+    if (state.is_select and not state.is_column_load
+            and not state.is_relationship_load
+            and not state.execution_options.get('include_deleted', False)):
+        state.statement = state.statement.options(
+            with_loader_criteria(User, lambda cls: cls.deleted_at.is_(None),
+                                 include_aliases=True),
+            with_loader_criteria(Message, lambda cls: cls.deleted_at.is_(None),
+                                 include_aliases=True))
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -0,0 +1,85 @@
+"""Keyset (cursor) pagination helpers for Warbler timelines.
+
+Timelines are ordered newest first on `(timestamp, id)`. A page ends with a
+cursor naming its last row; the next page asks for rows strictly before it,
+which the composite indexes can seek to directly no matter how deep the
+page is.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
+from collections import namedtuple
+from datetime import datetime
+
+from models import db
+
+PAGE_SIZE = 100
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+def encode_cursor(timestamp, id):
+    """Turn the `(timestamp, id)` of a page's last row into a URL-safe token."""
+
+    raw = f"{timestamp.isoformat()}|{id}".encode()
+    return urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Turn a cursor token back into `(timestamp, id)`.
+
+    Returns None for a missing or malformed cursor, which means "first page".
+    """
+
+    if not cursor:
+        return None
+
+    try:
+        raw = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, id = raw.split('|')
+        return datetime.fromisoformat(timestamp), int(id)
+    except (DecodeError, UnicodeDecodeError, ValueError):
+        return None
+
+
+def before(timestamp_col, id_col, cursor):
+    """SQL condition selecting rows that sort after `cursor` (newest first)."""
+
+    timestamp, id = cursor
+    return db.tuple_(timestamp_col, id_col) < db.tuple_(timestamp, id)
+
+
+def paginate(rows, limit, key):
+    """Build a Page from `rows` fetched with `limit + 1`.
+
+    `key` maps a row to its `(timestamp, id)`; the extra row only tells us
+    whether there is a next page.
+    """
+
+    if len(rows) <= limit:
+        return Page(rows, None)
+
+    rows = rows[:limit]
+    return Page(rows, encode_cursor(*key(rows[-1])))
+
+
+def keyset_query(query, timestamp_col, id_col, cursor=None, limit=PAGE_SIZE):
+    """`query` newest first, starting after the `cursor` token, with the
+    one extra row `paginate` needs."""
+
+    position = decode_cursor(cursor)
+    if position:
+        query = query.where(before(timestamp_col, id_col, position))
+
+    return (query
+            .order_by(timestamp_col.desc(), id_col.desc())
+            .limit(limit + 1))
+
+
+def keyset_page(query, timestamp_col, id_col, cursor=None, limit=PAGE_SIZE,
+                key=lambda row: (row.timestamp, row.id)):
+    """Run the select `query` newest first, starting after the `cursor` token."""
+
+    rows = db.session.execute(
+        keyset_query(query, timestamp_col, id_col, cursor, limit)).all()
+    return paginate(rows, limit, key)
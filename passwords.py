@@ -0,0 +1,127 @@
+"""Password hashing for Warbler, off the request thread.
+
+bcrypt is deliberately slow, so hashes are computed on a bounded process
+pool instead of in the web worker. At most BCRYPT_WORKERS hashes run at a
+time and at most BCRYPT_QUEUE_LIMIT more wait for a free process; beyond
+that the request is turned away at once with HashingBusy rather than
+queueing behind everyone else. A hash that isn't done within
+BCRYPT_TIMEOUT seconds raises HashingBusy too.
+
+The work factor comes from BCRYPT_LOG_ROUNDS. Hashes made with fewer
+rounds are transparently upgraded the next time their password is
+verified. Setting BCRYPT_WORKERS to 0 hashes inline (handy for scripts).
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import bcrypt
+from flask import current_app, has_app_context
+
+DEFAULT_LOG_ROUNDS = 12
+DEFAULT_TIMEOUT = 10
+
+_pool = None
+_slots = None
+_pool_lock = threading.Lock()
+
+
+class HashingBusy(Exception):
+    """Every hashing process is busy and the queue is full."""
+
+
+def _config(key, default):
+    if not has_app_context():
+        return default
+    return current_app.config.get(key, default)
+
+
+def hash_rounds(hashed):
+    """The work factor a bcrypt hash was made with (`$2b$12$...` -> 12)."""
+
+    return int(hashed.split('$')[2])
+
+
+def _hash(password, rounds):
+    salt = bcrypt.gensalt(rounds)
+    return bcrypt.hashpw(password.encode('UTF-8'), salt).decode('UTF-8')
+
+
+def _verify(password, hashed, rounds):
+    """Check `password`; if it matches a weaker hash, also return a new hash."""
+
+    if not bcrypt.checkpw(password.encode('UTF-8'), hashed.encode('UTF-8')):
+        return False, None
+    if hash_rounds(hashed) < rounds:
+        return True, _hash(password, rounds)
+    return True, None
+
+
+def _get_pool():
+    global _pool, _slots
+
+    with _pool_lock:
+        if _pool is None:
+            workers = _config('BCRYPT_WORKERS', os.cpu_count())
+            queue_limit = _config('BCRYPT_QUEUE_LIMIT', workers * 4)
+            # forkserver: workers don't inherit the web process's
+            # threads, locks or database connections
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('forkserver'))
+            _slots = threading.BoundedSemaphore(workers + queue_limit)
+        return _pool
+
+
+def _run(fn, *args):
+    """Run `fn` on the pool (or inline, with BCRYPT_WORKERS = 0)."""
+
+    if _config('BCRYPT_WORKERS', os.cpu_count()) == 0:
+        return fn(*args)
+
+    pool = _get_pool()
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy()
+
+    try:
+        future = pool.submit(fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=_config('BCRYPT_TIMEOUT', DEFAULT_TIMEOUT))
+    except TimeoutError:
+        # the hash still finishes (and frees its slot), but nobody waits for it
+        raise HashingBusy() from None
+
+
+def hash_password(password):
+    """bcrypt hash of `password` at the configured work factor."""
+
+    return _run(_hash, password,
+                _config('BCRYPT_LOG_ROUNDS', DEFAULT_LOG_ROUNDS))
+
+
+def verify_password(password, hashed):
+    """Check `password` against `hashed`.
+
+    Returns `(matches, new_hash)`; `new_hash` is set when the password
+    matched a hash made with fewer rounds than currently configured.
+    """
+
+    return _run(_verify, password, hashed,
+                _config('BCRYPT_LOG_ROUNDS', DEFAULT_LOG_ROUNDS))
+
+
+def shutdown():
+    """Stop the worker processes (they are restarted on next use)."""
+
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
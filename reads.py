@@ -0,0 +1,177 @@
+"""Async read path for Warbler's heavy GET pages.
+
+With ASYNC_READS on, the homepage, profiles, single messages and the user
+list load their data through an asyncio engine (asyncpg) rather than the
+request's session, and queries that don't depend on each other run at the
+same time: the homepage's timeline, followed celebrities' messages and
+suggestions together, a profile's user (with its counters) alongside its
+messages (with the viewer's likes). Only PostgreSQL has an async driver
+installed; on other databases the pages keep the synchronous path.
+
+Flask 2.2 serves each request on a WSGI thread, so the coroutines run on
+one event loop per process, in a background thread, while the view waits
+for them. Every concurrent query checks out its own connection from the
+async pool (ASYNC_POOL_SIZE plus ASYNC_MAX_OVERFLOW), so a page holds
+more connections for less time.
+
+The functions here return the same values as their synchronous
+counterparts in `feed`, `timeline`, `search` and `suggestions`, whose
+queries they reuse.
+"""
+
+import asyncio
+import os
+import threading
+
+from flask import current_app
+
+from models import db, Message, User
+from pagination import PAGE_SIZE, Page, decode_cursor, keyset_query, paginate
+import feed
+import routing
+import search
+import suggestions
+import timeline
+
+# backends with an async driver in requirements.txt; others read synchronously
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+}
+
+_loop = None
+_pid = None
+_sessions = {}
+_lock = threading.Lock()
+
+
+def enabled():
+    """Whether this request's pages should load through the async engine:
+    ASYNC_READS is on and the database it reads from has an async driver."""
+
+    return (current_app.config['ASYNC_READS']
+            and routing.read_engine().url.get_backend_name() in ASYNC_DRIVERS)
+
+
+def loop():
+    """This process's event loop, started on first use (and after a fork)."""
+
+    global _loop, _pid
+
+    with _lock:
+        if _loop is None or _pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='reads',
+                             daemon=True).start()
+            _pid = os.getpid()
+            _sessions.clear()
+        return _loop
+
+
+def sessions():
+    """An async_sessionmaker bound to the async twin of the engine this
+    request reads from."""
+
+    # only imported once ASYNC_READS is actually used
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    url = routing.read_engine().url
+    with _lock:
+        if url not in _sessions:
+            engine = create_async_engine(
+                url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()]),
+                pool_size=current_app.config['ASYNC_POOL_SIZE'],
+                max_overflow=current_app.config['ASYNC_MAX_OVERFLOW'])
+            _sessions[url] = async_sessionmaker(engine, expire_on_commit=False)
+        return _sessions[url]
+
+
+def run(coroutine):
+    """Run `coroutine` on the event loop and wait for its result.
+
+    It sees the calling request's context (`g`, `request`, the app).
+    """
+
+    return asyncio.run_coroutine_threadsafe(coroutine, loop()).result()
+
+
+async def _all(Session, query):
+    async with Session() as session:
+        return (await session.execute(query)).all()
+
+
+async def _scalars(Session, query):
+    async with Session() as session:
+        return (await session.execute(query)).scalars().all()
+
+
+def home_page(user_id, cursor=None, limit=PAGE_SIZE):
+    """`timeline.home_page` and `suggestions.for_user`, as a pair."""
+
+    page, suggested = run(_home_page(sessions(), user_id, decode_cursor(cursor),
+                                     timeline.celebrity_ids(), limit))
+    return page, suggestions.not_followed(user_id, suggested)
+
+
+async def _home_page(Session, user_id, position, celebrities, limit):
+    queries = timeline.home_queries(user_id, limit + 1, position, celebrities)
+    *results, suggested = await asyncio.gather(
+        *(_all(Session, query) for query in queries),
+        _all(Session, suggestions.query(user_id)))
+
+    rows = timeline.merge_home_rows(results, limit + 1)
+    page = paginate(rows, limit, key=lambda row: (row[1], row[0]))
+    ids = [message_id for message_id, _ in page.items]
+    items = []
+    if ids:
+        items = feed.in_order(
+            await _all(Session, feed.messages_by_ids_query(ids, user_id)), ids)
+    return Page(items, page.next_cursor), suggested
+
+
+def user_page(user_id, viewer_id=None, cursor=None):
+    """The User (or None) and `feed.user_messages`, as a pair."""
+
+    return run(_user_page(sessions(), user_id, viewer_id, cursor))
+
+
+async def _user_page(Session, user_id, viewer_id, cursor):
+    users, rows = await asyncio.gather(
+        _scalars(Session, db.select(User).where(User.id == user_id)),
+        _all(Session, keyset_query(feed.user_messages_query(user_id, viewer_id),
+                                   Message.timestamp, Message.id, cursor)))
+
+    page = paginate(rows, PAGE_SIZE, key=lambda row: (row.timestamp, row.id))
+    return (users[0] if users else None), feed.items_page(page)
+
+
+def message(message_id, viewer_id=None):
+    """`feed.message`."""
+
+    return run(_message(sessions(), message_id, viewer_id))
+
+
+async def _message(Session, message_id, viewer_id):
+    rows = await _all(Session, feed.message_query(message_id, viewer_id))
+    return feed.item(rows[0]) if rows else None
+
+
+def search_users(query, page=1):
+    """`search.search_users`."""
+
+    page, offset, limit = search.bounds(page)
+    ids = None
+    if query and not search.has_trigram_support():
+        ids = search.fallback_index().search(query, offset, limit)
+    return run(_search_users(sessions(), query, page, offset, limit, ids))
+
+
+async def _search_users(Session, query, page, offset, limit, ids):
+    if not query:
+        users = await _scalars(Session, search.all_users_query(offset, limit))
+        return search.search_page(users, page)
+
+    if ids is None:
+        ids = await _scalars(Session,
+                             search.database_search_query(query, offset, limit))
+    users = await _scalars(Session, search.users_query(ids))
+    return search.search_page(search.in_order(users, ids), page)
@@ -0,0 +1,182 @@
+"""Batch job computing "who to follow" suggestions for Warbler.
+
+The follows table is read once into a sparse matrix `A` (`A[u, v]` is 1
+when u follows v), and suggestions for a block of users are scored with
+sparse matrix products over the whole block at once:
+
+  - mutual follows, `A @ A`: how many of the people u follows follow v
+  - followers in common, `A.T @ A`: how many people follow both u and v
+  - follows you, `A.T`: v follows u but u doesn't follow back
+
+Users u already follows, and u themselves, are excluded, and the best
+TOP_K are stored per user. Accounts following more than MAX_VIA_FOLLOWING
+others say little about any one of them and are left out of the
+products, which also keeps them sparse.
+
+Blocks are independent: `--shard i/n` computes every n-th block, so n
+processes (or machines) can split the work, and `--users` recomputes just
+a few users (e.g. new accounts). Run from the project directory:
+
+    flask suggest --shard 0/4
+"""
+
+import time
+
+import numpy as np
+from scipy import sparse
+
+from models import db, User
+import graph
+import suggestions
+
+# suggestions stored per user
+TOP_K = 20
+
+# what each signal adds to a suggestion's score, per person in common
+MUTUAL_WEIGHT = 1.0
+COMMON_FOLLOWERS_WEIGHT = 0.5
+FOLLOWS_YOU_WEIGHT = 2.0
+
+# accounts following more people than this don't link anyone up
+MAX_VIA_FOLLOWING = 5000
+
+# users scored (and their suggestions replaced) at a time
+BLOCK_SIZE = 5000
+
+
+def follow_matrix(following, size=0):
+    """A square CSR matrix of the follows in `following` (a graph.Adjacency),
+    with at least `size` rows.
+
+    The Adjacency's arrays are used as they are, without copying.
+    """
+
+    indptr = np.frombuffer(following.offsets, dtype=np.int64)
+    indices = np.frombuffer(following.neighbors, dtype=np.int32)
+    size = max(size, len(indptr) - 1, int(indices.max()) + 1 if len(indices) else 0)
+    if len(indptr) < size + 1:
+        indptr = np.concatenate(
+            [indptr, np.full(size + 1 - len(indptr), indptr[-1])])
+    data = np.ones(len(indices), dtype=np.float32)
+    return sparse.csr_matrix((data, indices, indptr), shape=(size, size))
+
+
+def lookup(matrix, rows, columns):
+    """`matrix[rows[i], columns[i]]` for each i, as an array.
+
+    `matrix` is a CSR matrix with sorted indices; every entry is found
+    with one binary search over all of them.
+    """
+
+    if not matrix.nnz:
+        return np.zeros(len(rows), dtype=matrix.dtype)
+
+    width = matrix.shape[1]
+    keys = (np.repeat(np.arange(matrix.shape[0], dtype=np.int64),
+                      np.diff(matrix.indptr)) * width + matrix.indices)
+    wanted = rows.astype(np.int64) * width + columns
+    found = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+    return np.where(keys[found] == wanted, matrix.data[found], 0)
+
+
+class Scorer:
+    """Scores suggestions for blocks of users of one follow matrix."""
+
+    def __init__(self, follows):
+        self.follows = follows
+        self.followed_by = follows.T.tocsr()
+
+        # the middle step of the products skips very active followers
+        out_degree = np.diff(follows.indptr)
+        keep = sparse.diags((out_degree <= MAX_VIA_FOLLOWING).astype(np.float32))
+        self.via = (keep @ follows).tocsr()
+
+    def score(self, user_ids):
+        """Sparse (scores, mutual counts) with a row per user in `user_ids`."""
+
+        follows = self.follows[user_ids]
+        followed_by = self.followed_by[user_ids]
+
+        mutual = (follows @ self.via).tocsr()
+        scores = (MUTUAL_WEIGHT * mutual
+                  + COMMON_FOLLOWERS_WEIGHT * (followed_by @ self.via)
+                  + FOLLOWS_YOU_WEIGHT * followed_by)
+
+        yourself = sparse.csr_matrix(
+            (np.ones(len(user_ids), dtype=np.float32),
+             (np.arange(len(user_ids)), user_ids)), shape=scores.shape)
+        excluded = (follows + yourself).astype(bool).astype(np.float32)
+        scores = (scores - scores.multiply(excluded)).tocsr()
+        scores.eliminate_zeros()
+        mutual.sort_indices()
+        return scores, mutual
+
+    def top(self, user_ids, k=TOP_K):
+        """suggestions.COLUMNS rows for each user in `user_ids`, best first."""
+
+        user_ids = np.asarray(user_ids)
+        scores, mutual = self.score(user_ids)
+        rows, columns, values = [], [], []
+        for i in range(len(user_ids)):
+            start, end = scores.indptr[i], scores.indptr[i + 1]
+            candidates = scores.indices[start:end]
+            row_scores = scores.data[start:end]
+            if len(candidates) > k:
+                best = np.argpartition(-row_scores, k)[:k]
+                candidates, row_scores = candidates[best], row_scores[best]
+            # best score first, lowest id among equals
+            order = np.lexsort((candidates, -row_scores))
+            rows.append(np.full(len(order), i))
+            columns.append(candidates[order])
+            values.append(row_scores[order])
+
+        if not rows:
+            return []
+        rows, columns, values = (np.concatenate(rows), np.concatenate(columns),
+                                 np.concatenate(values))
+        counts = lookup(mutual, rows, columns)
+        # rank within each user's row
+        starts = np.searchsorted(rows, rows)
+        ranks = np.arange(len(rows)) - starts
+
+        return list(zip(user_ids[rows].tolist(), ranks.tolist(),
+                        columns.tolist(), values.tolist(), counts.astype(int).tolist()))
+
+
+def blocks(user_ids, shard=0, shards=1):
+    """This shard's share of `user_ids`, in blocks of BLOCK_SIZE."""
+
+    for number, start in enumerate(range(0, len(user_ids), BLOCK_SIZE)):
+        if number % shards == shard:
+            yield user_ids[start:start + BLOCK_SIZE]
+
+
+def compute(user_ids=None, shard=0, shards=1, out=print):
+    """Recompute and store suggestions, committing after each block.
+
+    Computes them for `user_ids`, or for every user (this shard's share of
+    them). Returns how many users were done.
+    """
+
+    started = time.perf_counter()
+    if user_ids is None:
+        user_ids = db.session.execute(
+            db.select(User.id).order_by(User.id)).scalars().all()
+    user_ids = np.asarray(sorted(user_ids), dtype=np.int64)
+
+    with db.engine.connect() as connection:
+        follows = follow_matrix(graph.read_following(connection),
+                                int(user_ids.max()) + 1 if len(user_ids) else 0)
+    scorer = Scorer(follows)
+    out(f"  read {follows.nnz:,} follows in {time.perf_counter() - started:.1f}s")
+
+    done = 0
+    for block in blocks(user_ids, shard, shards):
+        suggestions.replace(block.tolist(), scorer.top(block))
+        db.session.commit()
+        done += len(block)
+
+    elapsed = time.perf_counter() - started
+    out(f"Suggested for {done:,} users in {elapsed:.1f}s "
+        f"({done / max(elapsed, 1e-9):,.0f} users/sec)")
+    return done
@@ -0,0 +1,114 @@
+"""Read-replica routing for Warbler's database session.
+
+When a "replica" bind is configured (REPLICA_DATABASE_URL), GET and HEAD
+requests read through the replica and every other request uses the
+primary. A write always goes to the primary, whether it is a flush or an
+INSERT/UPDATE/DELETE. Once a request has written, its later reads go to
+the primary as well. So does any textual SQL, whose effect can't be told.
+
+Replicas lag a little behind the primary. After a user writes, their
+requests keep reading from the primary for REPLICA_STICKY_SECONDS, so
+they see their own posts, likes and follows straight away. The deadline
+is kept in their session cookie, so it holds whichever process serves
+the next request.
+
+If the replica can't be reached, reads fall back to the primary. The
+replica is then left alone for REPLICA_RETRY seconds.
+"""
+
+import time
+
+import sqlalchemy as sa
+from flask import current_app, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.expression import TextClause
+
+REPLICA = 'replica'
+
+READ_METHODS = ('GET', 'HEAD')
+
+# seconds the replica is skipped after failing to connect
+REPLICA_RETRY = 30
+
+# session cookie key: read from the primary until this time
+PRIMARY_UNTIL = 'primary_until'
+
+_down_until = 0
+
+
+def replica_down():
+    """Skip the replica for the next REPLICA_RETRY seconds."""
+
+    global _down_until
+    _down_until = time.monotonic() + REPLICA_RETRY
+
+
+class RoutingSession(Session):
+    """A session that reads from the replica when its request may.
+
+    `info['replica']` is set per request by `route_request`; `info['wrote']`
+    records that the session has sent anything to the primary that writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if self._flushing or isinstance(clause, UpdateBase):
+                self.info['wrote'] = True
+            elif (self.info.get('replica') and not self.info.get('wrote')
+                    and not isinstance(clause, TextClause)):
+                replica = self.replica()
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def replica(self):
+        """The replica engine, once connected in this transaction, or None."""
+
+        engine = self._db.engines.get(REPLICA)
+        if engine is None or time.monotonic() < _down_until:
+            return None
+        try:
+            # begins (or reuses) this transaction's replica connection
+            self.connection(bind_arguments={'bind': engine})
+        except sa.exc.OperationalError:
+            replica_down()
+            return None
+        return engine
+
+
+def read_engine():
+    """The engine this request's reads go to."""
+
+    db = current_app.extensions['sqlalchemy']
+    if db.session.info.get('replica') and not db.session.info.get('wrote'):
+        replica = db.engines.get(REPLICA)
+        if replica is not None and time.monotonic() >= _down_until:
+            return replica
+    return db.engine
+
+
+def route_request():
+    """Let GET and HEAD requests read from the replica, unless the user
+    wrote something a moment ago."""
+
+    db = current_app.extensions['sqlalchemy']
+    db.session.info['replica'] = (request.method in READ_METHODS
+                                  and session.get(PRIMARY_UNTIL, 0) < time.time())
+
+
+def remember_writes(response):
+    """Keep a user who just wrote on the primary for a while."""
+
+    db = current_app.extensions['sqlalchemy']
+    if db.session.registry.has() and db.session.info.get('wrote'):
+        session[PRIMARY_UNTIL] = (time.time()
+                                  + current_app.config['REPLICA_STICKY_SECONDS'])
+    return response
+
+
+def init_routing(app):
+    """Route `app`'s requests between the primary and the replica."""
+
+    app.before_request(route_request)
+    app.after_request(remember_writes)
@@ -0,0 +1,264 @@
+"""Username search for the /users page.
+
+On PostgreSQL with the pg_trgm extension, usernames are matched through a
+GiST trigram index and ranked by trigram distance; queries too short to
+form a trigram use a `lower(username)` prefix index instead.
+
+Anywhere else (SQLite, or a PostgreSQL without pg_trgm) searches go to an
+in-process trigram index of usernames, built on first use, kept current by
+the signup/profile/delete views and rebuilt every INDEX_TTL seconds to pick
+up changes made by other processes.
+
+Either way results come back a page at a time, PAGE_SIZE users per page and
+never more than MAX_PAGES pages deep.
+"""
+
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict, namedtuple
+from heapq import nsmallest
+
+from sqlalchemy import DDL, event
+
+from models import db, User
+
+PAGE_SIZE = 20
+MAX_PAGES = 50
+
+# seconds before the in-process index is rebuilt from the database
+INDEX_TTL = 300
+
+SearchPage = namedtuple('SearchPage', ['users', 'page', 'has_next'])
+
+# Create the search indexes along with the users table when pg_trgm can be
+# installed; without it only the prefix index is created. Migration 11
+# does the same for existing databases.
+event.listen(User.__table__, 'after_create', DDL("""
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_available_extensions
+                   WHERE name = 'pg_trgm') THEN
+            CREATE EXTENSION IF NOT EXISTS pg_trgm;
+            CREATE INDEX IF NOT EXISTS ix_users_username_trgm
+                ON users USING gist (username gist_trgm_ops);
+        END IF;
+        CREATE INDEX IF NOT EXISTS ix_users_username_prefix
+            ON users (lower(username) text_pattern_ops);
+    END
+    $$
+""").execute_if(dialect='postgresql'))
+
+
+def trigrams(text):
+    """Trigrams of `text`, padded at the word boundaries like pg_trgm."""
+
+    padded = f"  {text.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    """Share of trigrams two trigram sets have in common (0 to 1)."""
+
+    return len(a & b) / len(a | b)
+
+
+class UsernameIndex:
+    """In-memory trigram and prefix index over every username."""
+
+    def __init__(self):
+        self.names = {}
+        self.postings = defaultdict(set)
+        self.by_name = []
+        self.built_at = time.monotonic()
+        self.lock = threading.RLock()
+
+    @classmethod
+    def build(cls):
+        """Index every user in the database, streaming ids and usernames."""
+
+        index = cls()
+        rows = db.session.execute(
+            db.select(User.id, User.username)
+            .execution_options(yield_per=10000))
+        for user_id, username in rows:
+            index._add(user_id, username)
+        index.by_name.sort()
+        return index
+
+    def _add(self, user_id, username):
+        name = username.lower()
+        self.names[user_id] = name
+        for gram in trigrams(name):
+            self.postings[gram].add(user_id)
+        self.by_name.append((name, user_id))
+
+    def add(self, user_id, username):
+        """Index (or re-index, after a rename) a single user."""
+
+        with self.lock:
+            self.remove(user_id)
+            name = username.lower()
+            self.names[user_id] = name
+            for gram in trigrams(name):
+                self.postings[gram].add(user_id)
+            insort(self.by_name, (name, user_id))
+
+    def remove(self, user_id):
+        """Forget a user."""
+
+        with self.lock:
+            name = self.names.pop(user_id, None)
+            if name is None:
+                return
+            for gram in trigrams(name):
+                self.postings[gram].discard(user_id)
+            del self.by_name[bisect_left(self.by_name, (name, user_id))]
+
+    def search(self, query, offset, limit):
+        """Ids of matching users, best match first.
+
+        Queries of three or more characters match anywhere in the username
+        and are ranked by trigram similarity; shorter ones match prefixes
+        in alphabetical order.
+        """
+
+        query = query.lower()
+        with self.lock:
+            if len(query) < 3:
+                return self._prefix(query, offset, limit)
+
+            grams = sorted((self.postings.get(query[i:i + 3], set())
+                            for i in range(len(query) - 2)),
+                           key=len)
+            candidates = grams[0].intersection(*grams[1:])
+            query_grams = trigrams(query)
+            ranked = nsmallest(
+                offset + limit,
+                (user_id for user_id in candidates
+                 if query in self.names[user_id]),
+                key=lambda user_id: (
+                    -similarity(query_grams, trigrams(self.names[user_id])),
+                    user_id))
+            return ranked[offset:]
+
+    def _prefix(self, query, offset, limit):
+        ids = []
+        start = bisect_left(self.by_name, (query,))
+        for name, user_id in self.by_name[start:start + offset + limit]:
+            if not name.startswith(query):
+                break
+            ids.append(user_id)
+        return ids[offset:]
+
+
+_index = None
+_index_lock = threading.Lock()
+_trigram_support = {}
+
+
+def fallback_index():
+    """The in-process index, (re)built when missing or older than INDEX_TTL."""
+
+    global _index
+
+    with _index_lock:
+        if _index is None or time.monotonic() - _index.built_at > INDEX_TTL:
+            _index = UsernameIndex.build()
+        return _index
+
+
+def index_user(user):
+    """Keep the in-process index current after a signup or profile edit."""
+
+    if _index is not None:
+        _index.add(user.id, user.username)
+
+
+def unindex_user(user_id):
+    """Keep the in-process index current after an account is deleted."""
+
+    if _index is not None:
+        _index.remove(user_id)
+
+
+def has_trigram_support():
+    """Is the database PostgreSQL with pg_trgm installed? (cached per engine)"""
+
+    engine = db.engine
+    if engine.url not in _trigram_support:
+        supported = engine.dialect.name == 'postgresql' and db.session.execute(
+            db.text("SELECT EXISTS "
+                    "(SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+        ).scalar()
+        _trigram_support[engine.url] = supported
+    return _trigram_support[engine.url]
+
+
+def database_search_query(query, offset, limit):
+    """Select the ids of users matching `query` in the database (pg_trgm)."""
+
+    if len(query) < 3:
+        matches = (db.select(User.id)
+                   .where(db.func.lower(User.username)
+                          .startswith(query.lower(), autoescape=True))
+                   .order_by(db.func.lower(User.username), User.id))
+    else:
+        matches = (db.select(User.id)
+                   .where(User.username.icontains(query, autoescape=True))
+                   .order_by(User.username.op('<->')(query), User.id))
+
+    return matches.offset(offset).limit(limit)
+
+
+def all_users_query(offset, limit):
+    """Select a page of every user, in signup order."""
+
+    return db.select(User).order_by(User.id).offset(offset).limit(limit)
+
+
+def users_query(ids):
+    return db.select(User).where(User.id.in_(ids))
+
+
+def bounds(page):
+    """`(page, offset, limit)` for page number `page`, clamped to MAX_PAGES.
+
+    One extra row tells us whether there is a next page.
+    """
+
+    page = min(max(page, 1), MAX_PAGES)
+    return page, (page - 1) * PAGE_SIZE, PAGE_SIZE + 1
+
+
+def in_order(users, ids):
+    by_id = {user.id: user for user in users}
+    return [by_id[user_id] for user_id in ids if user_id in by_id]
+
+
+def search_page(users, page):
+    has_next = len(users) > PAGE_SIZE and page < MAX_PAGES
+    return SearchPage(users[:PAGE_SIZE], page, has_next)
+
+
+def search_users(query, page=1):
+    """One SearchPage of users whose username contains `query`.
+
+    An empty query pages through every user in signup order.
+    """
+
+    page, offset, limit = bounds(page)
+
+    if not query:
+        users = db.session.execute(
+            all_users_query(offset, limit)).scalars().all()
+    else:
+        if has_trigram_support():
+            ids = db.session.execute(
+                database_search_query(query, offset, limit)).scalars().all()
+        else:
+            ids = fallback_index().search(query, offset, limit)
+
+        users = in_order(db.session.execute(users_query(ids)).scalars(), ids)
+
+    return search_page(users, page)
@@ -1,21 +1,18 @@
 """Seed database with sample data from CSV Files."""
 
-from csv import DictReader
-from app import db
-from models import User, Message, Follows
+from models import db
+import counters
+import loader
+import migrations  # noqa: F401 (create_all stamps the schema version)
+import timeline
 
-def init_db():
+def init_db(directory='generator', workers=None):
     """ Seed db """
     db.drop_all()
     db.create_all()
 
-    with open('generator/users.csv') as users:
-        db.session.bulk_insert_mappings(User, DictReader(users))
+    loader.load(directory, workers=workers)
 
-    with open('generator/messages.csv') as messages:
-        db.session.bulk_insert_mappings(Message, DictReader(messages))
-
-    with open('generator/follows.csv') as follows:
-        db.session.bulk_insert_mappings(Follows, DictReader(follows))
-
-    db.session.commit()
\ No newline at end of file
+    counters.reconcile()
+    timeline.rebuild_all()
+    db.session.commit()
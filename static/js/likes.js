@@ -0,0 +1,36 @@
+// Like / unlike messages in place through the JSON like API,
+// instead of submitting the form and reloading the homepage.
+
+document.addEventListener('submit', async function (evt) {
+  const form = evt.target.closest('.like-form');
+  if (!form) return;
+  evt.preventDefault();
+
+  const button = form.querySelector('button');
+  const liked = form.dataset.liked === 'true';
+
+  button.disabled = true;
+  try {
+    const resp = await fetch(`/api/messages/${form.dataset.messageId}/like`, {
+      method: liked ? 'DELETE' : 'POST',
+      headers: { 'Accept': 'application/json' },
+      credentials: 'same-origin',
+    });
+    if (!resp.ok) {
+      // fall back to the plain form post
+      form.submit();
+      return;
+    }
+
+    const data = await resp.json();
+    form.dataset.liked = data.liked ? 'true' : 'false';
+    button.classList.toggle('btn-primary', data.liked);
+    button.classList.toggle('btn-secondary', !data.liked);
+    button.innerHTML = data.liked
+      ? '<i class="fa fa-star"></i>'
+      : '<i class="fa fa-thumbs-up"></i>';
+    button.title = `${data.likes} like${data.likes === 1 ? '' : 's'}`;
+  } finally {
+    button.disabled = false;
+  }
+});
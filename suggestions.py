@@ -0,0 +1,73 @@
+"""Precomputed "who to follow" suggestions for Warbler.
+
+Suggestions are computed in batches by `recommend.py` and stored, best
+first, in the `suggestions` table; the homepage only reads a user's top
+few rows. Anyone followed since the batch ran is skipped when reading.
+"""
+
+import csv
+import io
+
+from models import db, Suggestion, User
+import graph
+
+# suggestions shown in the homepage sidebar
+SUGGESTIONS_SHOWN = 3
+
+COLUMNS = ('user_id', 'rank', 'suggested_id', 'score', 'mutual_count')
+
+# extra rows read in case some of the top ones have been followed since
+FOLLOWED_SLACK = 5
+
+
+def query(user_id, limit=SUGGESTIONS_SHOWN):
+    """Select (User, mutual_count) rows for `for_user`."""
+
+    return (db.select(User, Suggestion.mutual_count)
+            .join(Suggestion, Suggestion.suggested_id == User.id)
+            .where(Suggestion.user_id == user_id)
+            .order_by(Suggestion.rank)
+            .limit(limit + FOLLOWED_SLACK))
+
+
+def not_followed(user_id, rows, limit=SUGGESTIONS_SHOWN):
+    """The first `limit` of `rows` that `user_id` doesn't follow yet."""
+
+    following = graph.get()
+    return [(user, mutual_count) for user, mutual_count in rows
+            if not following.is_following(user_id, user.id)][:limit]
+
+
+def for_user(user_id, limit=SUGGESTIONS_SHOWN):
+    """Up to `limit` (User, mutual_count) pairs suggested to `user_id`."""
+
+    rows = db.session.execute(query(user_id, limit)).all()
+    return not_followed(user_id, rows, limit)
+
+
+def replace(user_ids, rows):
+    """Replace the suggestions of every user in `user_ids` with `rows`.
+
+    `rows` are tuples of COLUMNS; on PostgreSQL they are written with COPY.
+    Bumps the users' versions, as their homepages change. The caller
+    commits.
+    """
+
+    db.session.execute(
+        db.delete(Suggestion).where(Suggestion.user_id.in_(user_ids)))
+
+    connection = db.session.connection()
+    if rows and connection.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        with connection.connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY suggestions ({', '.join(COLUMNS)}) "
+                               f"FROM STDIN WITH (FORMAT csv)", buffer)
+    elif rows:
+        db.session.execute(db.insert(Suggestion),
+                           [dict(zip(COLUMNS, row)) for row in rows])
+
+    db.session.execute(
+        db.update(User).where(User.id.in_(user_ids))
+        .values(version=User.version + 1))
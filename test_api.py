@@ -0,0 +1,141 @@
+"""Feed API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api.py
+
+
+import json
+import os
+from unittest import TestCase
+from models import db, Follows, Likes, Message, TimelineEntry, User
+
+from app import app, CURR_USER_KEY
+import api
+import identity
+import timeline
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+
+class FeedApiTestCase(TestCase):
+    """Test the JSON feed and user endpoints."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+        self.client = app.test_client()
+        app.config.update({
+            "TESTING": True,
+            "SQLALCHEMY_ECHO": False,
+            "SQLALCHEMY_DATABASE_URI": os.environ.get('DATABASE_URL', 'postgresql:///warbler-test'),
+            "DEBUG_TB_HOSTS": ["dont-show-debug-toolbar"],
+            "WTF_CSRF_ENABLED": False
+            })
+
+        with app.app_context():
+            Likes.query.delete()
+            TimelineEntry.query.delete()
+            Message.query.delete()
+            Follows.query.delete()
+            User.query.delete()
+
+            ann = User(email="ann@test.com", username="ann", password="HASHED_PASSWORD")
+            bob = User(email="bob@test.com", username="bob", password="HASHED_PASSWORD")
+            db.session.add_all([ann, bob])
+            db.session.flush()
+            ann.following.append(bob)
+            db.session.commit()
+            self.ann_id, self.bob_id = ann.id, bob.id
+
+            for n in range(3):
+                msg = Message(text=f"warble {n}", user_id=bob.id)
+                db.session.add(msg)
+                db.session.flush()
+                timeline.push_message(msg)
+            db.session.add(Likes(user_id=ann.id, message_id=msg.id))
+            db.session.commit()
+
+        identity.users.clear()
+        timeline.forget_celebrities()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        with app.app_context():
+            db.session.rollback()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_timeline(self):
+        """ The timeline pages through the homepage's messages """
+        with self.client as c:
+            self.assertEqual(c.get("/api/timeline").status_code, 401)
+
+            self.login(c, self.ann_id)
+            resp = c.get("/api/timeline?limit=2")
+            self.assertEqual(resp.mimetype, "application/json")
+            first = resp.json
+            self.assertEqual([item["text"] for item in first["items"]],
+                             ["warble 2", "warble 1"])
+            self.assertEqual(first["items"][0]["username"], "bob")
+            self.assertEqual(first["items"][0]["user_id"], self.bob_id)
+            self.assertTrue(first["items"][0]["liked"])
+            self.assertFalse(first["items"][1]["liked"])
+
+            second = c.get(f"/api/timeline?limit=2&before={first['next_cursor']}").json
+            self.assertEqual([item["text"] for item in second["items"]], ["warble 0"])
+            self.assertIsNone(second["next_cursor"])
+
+    def test_fields(self):
+        """ fields= selects the fields sent for each item """
+        with self.client as c:
+            self.login(c, self.ann_id)
+            items = c.get("/api/timeline?fields=id,text").json["items"]
+            self.assertEqual([set(item) for item in items], [{"id", "text"}] * 3)
+
+            resp = c.get("/api/timeline?fields=id,password")
+            self.assertEqual(resp.status_code, 400)
+            self.assertIn("password", resp.json["error"])
+            self.assertEqual(c.get("/api/timeline?limit=0").status_code, 400)
+            self.assertEqual(c.get("/api/timeline?limit=abc").status_code, 400)
+
+    def test_user_messages(self):
+        """ A user's messages, for anyone, tagged like the profile """
+        resp = self.client.get(f"/api/users/{self.bob_id}/messages?fields=text,liked")
+        self.assertEqual(resp.json["items"][0], {"text": "warble 2", "liked": False})
+
+        again = self.client.get(f"/api/users/{self.bob_id}/messages?fields=text,liked",
+                                headers={"If-None-Match": resp.headers["ETag"]})
+        self.assertEqual(again.status_code, 304)
+
+        self.assertEqual(self.client.get("/api/users/0/messages").status_code, 404)
+
+    def test_encoders_agree(self):
+        """ The standard library fallback writes the same JSON as orjson """
+        with app.app_context():
+            page = timeline.home_page(self.ann_id)
+            body = api.feed_response(page, list(api.FEED_FIELDS)).get_data()
+
+            encoder, api.orjson = api.orjson, None
+            try:
+                fallback = api.feed_response(page, list(api.FEED_FIELDS)).get_data()
+            finally:
+                api.orjson = encoder
+
+        self.assertEqual(json.loads(body), json.loads(fallback))
+        self.assertNotIn(b" ", fallback.replace(b"warble ", b""))
+
+    def test_users_limits(self):
+        """ /api/users rejects malformed and oversized id lists """
+        self.assertEqual(self.client.get("/api/users?ids=1,x").status_code, 400)
+        ids = ",".join(str(n) for n in range(1, api.MAX_USERS + 2))
+        self.assertEqual(self.client.get(f"/api/users?ids={ids}").status_code, 400)
+        self.assertEqual(self.client.get("/api/users?ids=").json, {"users": []})
+        resp = self.client.get(f"/api/users?ids={self.ann_id}&fields=password")
+        self.assertEqual(resp.status_code, 400)
@@ -0,0 +1,163 @@
+"""Conditional GET tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_conditional.py
+
+
+import os
+from unittest import TestCase
+from models import db, Follows, Likes, Message, TimelineEntry, User
+
+from app import app, CURR_USER_KEY
+import identity
+import passwords
+import timeline
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+class ConditionalTestCase(TestCase):
+    """Test ETags and 304 responses for profile, message and home pages."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+        self.client = app.test_client()
+        app.config.update({
+            "TESTING": True,
+            "SQLALCHEMY_ECHO": False,
+            "SQLALCHEMY_DATABASE_URI": os.environ.get('DATABASE_URL', 'postgresql:///warbler-test'),
+            "DEBUG_TB_HOSTS": ["dont-show-debug-toolbar"],
+            "WTF_CSRF_ENABLED": False
+            })
+
+        with app.app_context():
+            Likes.query.delete()
+            TimelineEntry.query.delete()
+            Message.query.delete()
+            Follows.query.delete()
+            User.query.delete()
+
+            viewer = User(email="viewer@test.com", username="viewer", password="HASHED_PASSWORD")
+            author = User(email="author@test.com", username="author", password="HASHED_PASSWORD")
+            db.session.add_all([viewer, author])
+            db.session.flush()
+            viewer.following.append(author)
+            msg = Message(text="hello", user_id=author.id)
+            db.session.add(msg)
+            db.session.flush()
+            timeline.push_message(msg)
+            db.session.commit()
+
+            self.viewer_id = viewer.id
+            self.author_id = author.id
+            self.msg_id = msg.id
+        identity.users.clear()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        with app.app_context():
+            db.session.rollback()
+
+    def login(self, c, user_id=None):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id or self.viewer_id
+
+    def revalidate(self, c, url, etag):
+        return c.get(url, headers={"If-None-Match": etag})
+
+    def test_profile_not_modified(self):
+        """ A profile is answered with 304 until it changes """
+        url = f"/users/{self.author_id}"
+        with self.client as c:
+            self.login(c)
+            resp = c.get(url)
+            self.assertEqual(resp.status_code, 200)
+            etag = resp.headers["ETag"]
+            self.assertIn("private", resp.headers["Cache-Control"])
+            self.assertIn("no-cache", resp.headers["Cache-Control"])
+            self.assertNotIn("no-store", resp.headers["Cache-Control"])
+
+            resp = self.revalidate(c, url, etag)
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.data, b"")
+            self.assertEqual(resp.headers["ETag"], etag)
+
+            # liking one of the author's messages changes the viewer's page
+            c.post(f"/api/messages/{self.msg_id}/like")
+            resp = self.revalidate(c, url, etag)
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.headers["ETag"], etag)
+
+            # and the same page looks different to someone else
+            self.login(c, self.author_id)
+            self.assertNotEqual(c.get(url).headers["ETag"], resp.headers["ETag"])
+
+    def test_message_not_modified(self):
+        """ A message page changes when its author edits their profile """
+        url = f"/messages/{self.msg_id}"
+        with self.client as c:
+            resp = c.get(url)
+            etag = resp.headers["ETag"]
+            self.assertIn("public", resp.headers["Cache-Control"])
+            self.assertEqual(self.revalidate(c, url, etag).status_code, 304)
+
+            with app.app_context():
+                db.session.execute(db.update(User)
+                                   .where(User.id == self.author_id)
+                                   .values(version=User.version + 1))
+                db.session.commit()
+            self.assertEqual(self.revalidate(c, url, etag).status_code, 200)
+
+    def test_home_not_modified(self):
+        """ The homepage changes when a followed user posts """
+        with self.client as c:
+            self.login(c)
+            etag = c.get("/").headers["ETag"]
+            self.assertEqual(self.revalidate(c, "/", etag).status_code, 304)
+            # older pages are tagged separately
+            self.assertEqual(self.revalidate(c, "/?before=x", etag).status_code, 200)
+
+            self.login(c, self.author_id)
+            c.post("/messages/new", data={"text": "news"})
+            self.login(c)
+            resp = self.revalidate(c, "/", etag)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(b"news", resp.data)
+
+    def test_home_follows_profile_edits(self):
+        """ The homepage changes when a followed user edits their profile """
+        with app.app_context():
+            author = db.session.get(User, self.author_id)
+            author.password = passwords.hash_password("password")
+            db.session.commit()
+
+        with self.client as c:
+            self.login(c)
+            etag = c.get("/").headers["ETag"]
+
+            # in a session of their own, so its flash doesn't reach the viewer
+            with app.test_client() as author:
+                self.login(author, self.author_id)
+                author.post("/users/profile", data={"username": "renamed",
+                                                    "email": "author@test.com",
+                                                    "password": "password"})
+            resp = self.revalidate(c, "/", etag)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(b"renamed", resp.data)
+
+    def test_flashes_are_never_cached(self):
+        """ A page with a flash message waiting is rendered in full """
+        with self.client as c:
+            self.login(c)
+            etag = c.get("/").headers["ETag"]
+            with c.session_transaction() as sess:
+                sess["_flashes"] = [("success", "Hello!")]
+            resp = self.revalidate(c, "/", etag)
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn("ETag", resp.headers)
+            self.assertIn("no-store", resp.headers["Cache-Control"])
@@ -0,0 +1,63 @@
+"""App factory and profile tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_config.py
+
+
+import gc
+import os
+import subprocess
+import sys
+from unittest import TestCase
+from models import db
+
+from app import app, create_app, preload
+import graph
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+
+class ConfigTestCase(TestCase):
+    """Test the named profiles and preloading."""
+
+    def test_production_import_graph(self):
+        """ The production app loads no debug, seeding, async or CLI-only code """
+        code = ("import sys, wsgi; "
+                "print(sorted({'flask_debugtoolbar', 'seed', 'loader',"
+                "'sqlalchemy.ext.asyncio', 'migrations', 'deletion'} & set(sys.modules)))")
+        out = subprocess.run([sys.executable, "-c", code], check=True,
+                             capture_output=True, text=True,
+                             env=dict(os.environ, PRELOAD="0"),
+                             cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        self.assertEqual(out.strip(), "[]")
+
+    def test_profiles(self):
+        """ Profiles differ in their tools, and share the routes """
+        production = create_app("production")
+        self.assertFalse(production.config["DEV_TOOLS"])
+        self.assertNotIn("flask_debugtoolbar",
+                         {func.__module__ for func in production.before_request_funcs[None]})
+        self.assertTrue(create_app("testing").testing)
+
+        with production.test_client() as c:
+            self.assertEqual(c.get("/").status_code, 200)
+
+    def test_preload(self):
+        """ Preloading warms the graph and leaves no connections open """
+        testing = create_app("testing")
+        graph.forget()
+        try:
+            preload(testing)
+        finally:
+            gc.unfreeze()
+
+        self.assertFalse(graph._stale)
+        with testing.app_context():
+            self.assertEqual(db.engine.pool.checkedout(), 0)
+            self.assertEqual(db.engine.pool.checkedin(), 0)
@@ -0,0 +1,125 @@
+"""User counter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_counters.py
+
+
+import os
+from unittest import TestCase
+from models import db, User, Message, Follows, Likes
+
+from app import app, CURR_USER_KEY
+import counters
+import deletion
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+class CountersTestCase(TestCase):
+    """Test denormalized follower/following/message/like counters."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+        self.client = app.test_client()
+        app.config.update({
+            "TESTING": True,
+            "SQLALCHEMY_ECHO": False,
+            "SQLALCHEMY_DATABASE_URI": os.environ.get('DATABASE_URL', 'postgresql:///warbler-test'),
+            "DEBUG_TB_HOSTS": ["dont-show-debug-toolbar"],
+            "WTF_CSRF_ENABLED": False
+            })
+
+        with app.app_context():
+            Likes.query.delete()
+            Message.query.delete()
+            Follows.query.delete()
+            User.query.delete()
+
+            u = User(email="test@test.com", username="testuser", password="HASHED_PASSWORD")
+            u2 = User(email="test2@test2.com", username="testuser2", password="HASHED_PASSWORD")
+            db.session.add_all([u, u2])
+            db.session.commit()
+
+            self.u_id = u.id
+            self.u2_id = u2.id
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        with app.app_context():
+            db.session.rollback()
+
+    def counts(self, user_id):
+        with app.app_context():
+            u = db.session.get(User, user_id)
+            return (u.messages_count, u.following_count, u.followers_count, u.likes_count)
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_follow_counters(self):
+        """ Following and unfollowing update both users """
+        with self.client as c:
+            self.login(c, self.u_id)
+            c.post(f"/users/follow/{self.u2_id}")
+            self.assertEqual(self.counts(self.u_id), (0, 1, 0, 0))
+            self.assertEqual(self.counts(self.u2_id), (0, 0, 1, 0))
+
+            c.post(f"/users/stop-following/{self.u2_id}")
+            self.assertEqual(self.counts(self.u_id), (0, 0, 0, 0))
+            self.assertEqual(self.counts(self.u2_id), (0, 0, 0, 0))
+
+    def test_message_and_like_counters(self):
+        """ Posting, liking and deleting keep counts in step """
+        with self.client as c:
+            self.login(c, self.u2_id)
+            c.post("/messages/new", data={"text": "count me"})
+            self.assertEqual(self.counts(self.u2_id), (1, 0, 0, 0))
+
+            with app.app_context():
+                msg_id = Message.query.one().id
+
+            self.login(c, self.u_id)
+            c.post(f"/users/add_like/{msg_id}")
+            self.assertEqual(self.counts(self.u_id), (0, 0, 0, 1))
+
+            self.login(c, self.u2_id)
+            c.post(f"/messages/{msg_id}/delete")
+            # deleted messages stay counted until they are purged
+            self.assertEqual(self.counts(self.u2_id), (1, 0, 0, 0))
+            with app.app_context():
+                deletion.purge(out=lambda *args: None)
+            self.assertEqual(self.counts(self.u2_id), (0, 0, 0, 0))
+            self.assertEqual(self.counts(self.u_id), (0, 0, 0, 0))
+
+    def test_profile_shows_counters(self):
+        """ Profile stats come from the counter columns """
+        with app.app_context():
+            db.session.get(User, self.u_id).followers_count = 42
+            db.session.commit()
+
+        resp = self.client.get(f"/users/{self.u_id}")
+        html = resp.get_data(as_text=True)
+        self.assertIn(f'<a href="/users/{self.u_id}/followers">42</a>', html)
+
+    def test_reconcile_repairs_drift(self):
+        """ Reconcile recomputes counters from the source tables """
+        with app.app_context():
+            u = db.session.get(User, self.u_id)
+            u2 = db.session.get(User, self.u2_id)
+            u.following.append(u2)
+            db.session.add(Message(text="uncounted", user_id=self.u_id))
+            u2.likes_count = 7
+            db.session.commit()
+
+            self.assertEqual(counters.reconcile(), 2)
+            # nothing left to repair
+            self.assertEqual(counters.reconcile(), 0)
+
+        self.assertEqual(self.counts(self.u_id), (1, 1, 0, 0))
+        self.assertEqual(self.counts(self.u2_id), (0, 0, 1, 0))
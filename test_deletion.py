@@ -0,0 +1,176 @@
+"""Soft-delete and purge tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_deletion.py
+
+
+import os
+from unittest import TestCase
+from models import db, Follows, Likes, Message, TimelineEntry, User
+
+from app import app, CURR_USER_KEY
+import deletion
+import graph
+import identity
+import search
+import timeline
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+
+class DeletionTestCase(TestCase):
+    """Test deleting accounts and messages, and purging them later."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+        self.client = app.test_client()
+        app.config.update({
+            "TESTING": True,
+            "SQLALCHEMY_ECHO": False,
+            "SQLALCHEMY_DATABASE_URI": os.environ.get('DATABASE_URL', 'postgresql:///warbler-test'),
+            "DEBUG_TB_HOSTS": ["dont-show-debug-toolbar"],
+            "WTF_CSRF_ENABLED": False
+            })
+
+        with app.app_context():
+            Likes.query.delete()
+            TimelineEntry.query.delete()
+            Message.query.delete()
+            Follows.query.delete()
+            User.query.delete()
+
+            ann = User.signup("ann", "ann@test.com", "password", None)
+            bob = User.signup("bob", "bob@test.com", "password", None)
+            db.session.commit()
+            self.ann_id, self.bob_id = ann.id, bob.id
+
+        identity.users.clear()
+        timeline.forget_celebrities()
+        search._index = None
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        with app.app_context():
+            db.session.rollback()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def post_messages(self, c, count):
+        """Have bob post `count` messages, liked and followed by ann."""
+        self.login(c, self.ann_id)
+        c.post(f"/users/follow/{self.bob_id}")
+        self.login(c, self.bob_id)
+        for n in range(count):
+            c.post("/messages/new", data={"text": f"warble {n}"})
+        with app.app_context():
+            ids = [msg.id for msg in Message.query.order_by(Message.id)]
+        self.login(c, self.ann_id)
+        for message_id in ids:
+            c.post(f"/users/add_like/{message_id}")
+        return ids
+
+    def test_deleted_message_hidden(self):
+        """ A deleted message disappears at once and is purged later """
+        with self.client as c:
+            first, second = self.post_messages(c, 2)
+
+            self.login(c, self.bob_id)
+            c.post(f"/messages/{first}/delete")
+
+            self.assertEqual(c.get(f"/messages/{first}").status_code, 404)
+            html = c.get(f"/users/{self.bob_id}").get_data(as_text=True)
+            self.assertNotIn("warble 0", html)
+            self.assertIn("warble 1", html)
+
+            self.login(c, self.ann_id)
+            html = c.get("/").get_data(as_text=True)
+            self.assertNotIn("warble 0", html)
+            html = c.get(f"/users/likes/{self.ann_id}").get_data(as_text=True)
+            self.assertNotIn("warble 0", html)
+
+        with app.app_context():
+            # still there, and still counted, until the purge
+            self.assertEqual(db.session.execute(
+                db.select(db.func.count(Message.id))
+                .execution_options(include_deleted=True)).scalar(), 2)
+            self.assertEqual(db.session.get(User, self.ann_id).likes_count, 2)
+
+            self.assertEqual(deletion.purge(out=lambda *args: None), (1, 0))
+            self.assertEqual(Likes.query.count(), 1)
+            self.assertEqual(db.session.get(User, self.ann_id).likes_count, 1)
+            self.assertEqual(db.session.get(User, self.bob_id).messages_count, 1)
+
+    def test_deleted_user_leaves_cached_homepages(self):
+        """ Followers' cached homepages change when an account is deleted """
+        with self.client as c:
+            self.post_messages(c, 1)
+            etag = c.get("/").headers["ETag"]
+
+            self.login(c, self.bob_id)
+            c.post("/users/delete")
+
+            self.login(c, self.ann_id)
+            resp = c.get("/", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn("warble 0", resp.get_data(as_text=True))
+
+    def test_deleted_user_hidden(self):
+        """ A deleted account's pages, messages and login go at once """
+        with self.client as c:
+            first, _ = self.post_messages(c, 2)
+
+            self.login(c, self.bob_id)
+            resp = c.post("/users/delete")
+            self.assertEqual(resp.status_code, 302)
+
+            self.assertEqual(c.get(f"/users/{self.bob_id}").status_code, 404)
+            self.assertEqual(c.get(f"/messages/{first}").status_code, 404)
+            html = c.get("/users?q=bob").get_data(as_text=True)
+            self.assertNotIn("@bob", html)
+
+            self.login(c, self.ann_id)
+            html = c.get("/").get_data(as_text=True)
+            self.assertNotIn("warble 0", html)
+
+        with app.app_context():
+            self.assertFalse(User.authenticate("bob", "password"))
+            self.assertEqual(Follows.query.count(), 1)
+
+    def test_purge_user_in_batches(self):
+        """ The purge removes an account's rows a batch at a time """
+        with self.client as c:
+            self.post_messages(c, 5)
+            self.login(c, self.bob_id)
+            c.post(f"/users/follow/{self.ann_id}")
+            c.post("/users/delete")
+
+        with app.app_context():
+            progress = []
+            self.assertEqual(deletion.purge(batch_size=2, out=progress.append),
+                             (0, 1))
+            self.assertEqual(len(progress), 1)
+            self.assertIn("5 messages, 2 follows", progress[0])
+
+            self.assertEqual(db.session.execute(
+                db.select(db.func.count(User.id))
+                .execution_options(include_deleted=True)).scalar(), 1)
+            self.assertEqual(Follows.query.count(), 0)
+            self.assertEqual(Likes.query.count(), 0)
+            self.assertEqual(TimelineEntry.query.count(), 0)
+
+            ann = db.session.get(User, self.ann_id)
+            self.assertEqual((ann.following_count, ann.followers_count,
+                              ann.likes_count), (0, 0, 0))
+            self.assertFalse(graph.is_following(self.ann_id, self.bob_id))
+            self.assertFalse(graph.is_following(self.bob_id, self.ann_id))
+
+            # nothing left to do
+            self.assertEqual(deletion.purge(out=lambda *args: None), (0, 0))
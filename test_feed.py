@@ -0,0 +1,125 @@
+"""Feed read model tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_feed.py
+
+
+import os
+from unittest import TestCase
+from sqlalchemy import event
+from models import db, User, Message, Follows, Likes, TimelineEntry
+
+from app import app, CURR_USER_KEY
+import feed
+import identity
+import timeline
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+class FeedTestCase(TestCase):
+    """Test that message lists are read in a fixed number of queries."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+        self.client = app.test_client()
+        app.config.update({
+            "TESTING": True,
+            "SQLALCHEMY_ECHO": False,
+            "SQLALCHEMY_DATABASE_URI": os.environ.get('DATABASE_URL', 'postgresql:///warbler-test'),
+            "DEBUG_TB_HOSTS": ["dont-show-debug-toolbar"]
+            })
+
+        with app.app_context():
+            Likes.query.delete()
+            TimelineEntry.query.delete()
+            Message.query.delete()
+            Follows.query.delete()
+            User.query.delete()
+
+            viewer = User(email="viewer@test.com", username="viewer", password="HASHED_PASSWORD")
+            db.session.add(viewer)
+            db.session.commit()
+            self.viewer_id = viewer.id
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        with app.app_context():
+            db.session.rollback()
+
+    def add_authors(self, count):
+        """Have the viewer follow `count` new users with a message each."""
+        with app.app_context():
+            viewer = db.session.get(User, self.viewer_id)
+            start = User.query.count()
+            for i in range(start, start + count):
+                author = User(email=f"author{i}@test.com", username=f"author{i}", password="HASHED_PASSWORD")
+                db.session.add(author)
+                viewer.following.append(author)
+                db.session.flush()
+                msg = Message(text=f"from author {i}", user_id=author.id)
+                db.session.add(msg)
+                db.session.flush()
+                timeline.push_message(msg)
+                db.session.add(Likes(user_id=self.viewer_id, message_id=msg.id))
+            db.session.commit()
+
+    def count_home_queries(self):
+        identity.users.clear()
+        statements = []
+        def count(*args):
+            statements.append(args)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer_id
+            with app.app_context():
+                event.listen(db.engine, 'before_cursor_execute', count)
+                try:
+                    resp = c.get("/")
+                finally:
+                    event.remove(db.engine, 'before_cursor_execute', count)
+            self.assertEqual(resp.status_code, 200)
+        return len(statements)
+
+    def test_home_query_count_is_constant(self):
+        """ Ten times the messages costs no extra queries """
+        self.add_authors(2)
+        # the first request also loads the follow graph
+        self.count_home_queries()
+        few = self.count_home_queries()
+        self.add_authors(20)
+        many = self.count_home_queries()
+        self.assertEqual(few, many)
+
+    def test_items_carry_author_and_like_state(self):
+        """ FeedItems include the author fields and the viewer's like """
+        self.add_authors(1)
+        with app.app_context():
+            author = User.query.filter_by(username="author1").one()
+            page = feed.user_messages(author.id, viewer_id=self.viewer_id)
+            [item] = page.items
+            self.assertEqual(item.user, feed.Author(author.id, "author1", author.image_url, author.profile_version))
+            self.assertTrue(item.liked)
+
+            [item] = feed.user_messages(author.id).items
+            self.assertFalse(item.liked)
+
+    def test_liked_messages_with_viewer(self):
+        """ The likes page reports the viewer's own like state """
+        self.add_authors(2)
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer_id
+            resp = c.get(f"/users/likes/{self.viewer_id}")
+            self.assertEqual(resp.status_code, 200)
+
+        with app.app_context():
+            page = feed.liked_messages(self.viewer_id, viewer_id=self.viewer_id)
+            self.assertEqual(len(page.items), 2)
+            self.assertTrue(all(item.liked for item in page.items))
@@ -0,0 +1,144 @@
+"""Fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+import os
+from unittest import TestCase
+from flask import render_template_string
+from models import db, Follows, Likes, Message, TimelineEntry, User
+
+from app import app, CURR_USER_KEY
+from cache import LRUCache
+from fragments import fragments
+import identity
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+CARD = """{% call(slot) fragment('test', id, version, slot=button) -%}
+<b>{{ name }}</b>{{ slot }}
+{%- endcall %}"""
+
+
+class FragmentTestCase(TestCase):
+    """Test caching rendered user cards and message rows."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+        self.client = app.test_client()
+        app.config.update({
+            "TESTING": True,
+            "SQLALCHEMY_ECHO": False,
+            "SQLALCHEMY_DATABASE_URI": os.environ.get('DATABASE_URL', 'postgresql:///warbler-test'),
+            "DEBUG_TB_HOSTS": ["dont-show-debug-toolbar"],
+            "WTF_CSRF_ENABLED": False
+            })
+
+        with app.app_context():
+            Likes.query.delete()
+            TimelineEntry.query.delete()
+            Message.query.delete()
+            Follows.query.delete()
+            User.query.delete()
+
+            users = [User(email=f"{name}@test.com", username=name, password="HASHED_PASSWORD",
+                          bio=f"bio of {name}")
+                     for name in ("owner", "fan", "stranger")]
+            db.session.add_all(users)
+            db.session.flush()
+            owner, fan, stranger = users
+            owner.followers.append(fan)
+            db.session.commit()
+            self.owner_id, self.fan_id, self.stranger_id = owner.id, fan.id, stranger.id
+
+        fragments.clear()
+        identity.users.clear()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        with app.app_context():
+            db.session.rollback()
+
+    def render(self, **context):
+        with app.test_request_context():
+            return render_template_string(CARD, **context)
+
+    def test_fragment_is_cached_by_version(self):
+        """ The body renders once per version; the slot every time """
+        self.assertEqual(self.render(id=1, version=0, name="a", button="<i>x</i>"),
+                         "<b>a</b>&lt;i&gt;x&lt;/i&gt;")
+        self.assertEqual(self.render(id=1, version=0, name="changed", button="y"),
+                         "<b>a</b>y")
+        self.assertEqual(self.render(id=1, version=1, name="changed", button="y"),
+                         "<b>changed</b>y")
+
+    def test_cache_is_bounded_by_bytes(self):
+        """ Entries are evicted once their total size is over maxbytes """
+        cache = LRUCache('test-bytes', maxsize=100, maxbytes=10)
+        cache.set(1, "12345")
+        cache.set(2, "12345")
+        cache.set(3, "1")
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.get(2), "12345")
+        self.assertEqual(cache.bytes, 6)
+
+    def test_follow_buttons_stay_per_viewer(self):
+        """ A cached card shows each viewer their own follow button """
+        url = f"/users/{self.fan_id}/following"
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.fan_id
+            html = c.get(url).get_data(as_text=True)
+            self.assertIn("Unfollow", html)
+            self.assertIn("bio of owner", html)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.stranger_id
+            hits = fragments.hits
+            html = c.get(url).get_data(as_text=True)
+            self.assertGreater(fragments.hits, hits)
+            self.assertNotIn("Unfollow", html)
+            self.assertIn(f'action="/users/follow/{self.owner_id}"', html)
+
+    def test_followers_cards_show_their_own_bio(self):
+        """ Cards on the followers page describe the follower """
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.owner_id
+            html = c.get(f"/users/{self.owner_id}/followers").get_data(as_text=True)
+            self.assertIn("bio of fan", html)
+
+    def test_profile_edit_refreshes_card(self):
+        """ Bumping the user's profile_version re-renders their card """
+        url = f"/users/{self.fan_id}/following"
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.fan_id
+            c.get(url)
+            with app.app_context():
+                owner = db.session.get(User, self.owner_id)
+                owner.bio = "new bio"
+                owner.profile_version = User.profile_version + 1
+                db.session.commit()
+            self.assertIn("new bio", c.get(url).get_data(as_text=True))
+
+    def test_activity_keeps_card(self):
+        """ Bumping only the user's version reuses the cached card """
+        url = f"/users/{self.fan_id}/following"
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.fan_id
+            c.get(url)
+            with app.app_context():
+                owner = db.session.get(User, self.owner_id)
+                owner.bio = "new bio"
+                owner.version = User.version + 1
+                db.session.commit()
+            self.assertNotIn("new bio", c.get(url).get_data(as_text=True))
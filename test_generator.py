@@ -0,0 +1,84 @@
+"""Dataset generator tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_generator.py
+
+
+import csv
+import filecmp
+import os
+import sys
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'generator'))
+
+import create_csvs
+
+OPTIONS = create_csvs.Options(
+    users=300, messages=1000, follows=5000, likes=2000, seed='test',
+    start=datetime(2021, 1, 1), end=datetime(2023, 1, 1),
+    popularity_alpha=1.1, activity_alpha=1.1, like_alpha=1.2, degree_alpha=2.0)
+
+
+class GeneratorTestCase(TestCase):
+    """Test the generated CSVs are deterministic and loadable."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.output = []
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def generate(self, name, options=OPTIONS, workers=1):
+        out = os.path.join(self.dir.name, name)
+        create_csvs.generate(options, out, workers=workers, report=self.output.append)
+        return out
+
+    def rows(self, out, table):
+        with open(os.path.join(out, f"{table}.csv"), newline='') as file:
+            return list(csv.DictReader(file))
+
+    def test_deterministic(self):
+        """ The same seed gives the same files, whatever the worker count """
+        one = self.generate('one', OPTIONS._replace(users=25000), workers=1)
+        two = self.generate('two', OPTIONS._replace(users=25000), workers=2)
+        for table in create_csvs.TABLES:
+            self.assertTrue(filecmp.cmp(os.path.join(one, f"{table}.csv"),
+                                        os.path.join(two, f"{table}.csv"),
+                                        shallow=False), table)
+
+        other = self.generate('other', OPTIONS._replace(seed='other'))
+        self.assertFalse(filecmp.cmp(os.path.join(one, "follows.csv"),
+                                     os.path.join(other, "follows.csv"),
+                                     shallow=False))
+
+    def test_rows_are_valid(self):
+        """ Ids are in range, pairs unique and usernames distinct """
+        out = self.generate('out')
+        users = self.rows(out, 'users')
+        self.assertEqual(len(users), 300)
+        self.assertEqual(len({user['username'] for user in users}), 300)
+
+        messages = self.rows(out, 'messages')
+        self.assertEqual(len(messages), 1000)
+        self.assertTrue(all(1 <= int(msg['user_id']) <= 300 for msg in messages))
+        self.assertTrue(all(len(msg['text']) <= 140 for msg in messages))
+
+        follows = [(row['user_being_followed_id'], row['user_following_id'])
+                   for row in self.rows(out, 'follows')]
+        self.assertEqual(len(follows), len(set(follows)))
+        self.assertFalse([pair for pair in follows if pair[0] == pair[1]])
+        self.assertTrue(all(1 <= int(user_id) <= 300 for pair in follows for user_id in pair))
+        # roughly the number asked for, skewed towards a few popular users
+        self.assertGreater(len(follows), 4000)
+        followers = sorted((sum(1 for pair in follows if pair[0] == str(i))
+                            for i in range(1, 301)), reverse=True)
+        self.assertGreater(followers[0], 10 * followers[150])
+
+        likes = [(row['user_id'], row['message_id']) for row in self.rows(out, 'likes')]
+        self.assertEqual(len(likes), len(set(likes)))
+        self.assertTrue(all(1 <= int(message_id) <= 1000 for _, message_id in likes))
@@ -0,0 +1,199 @@
+"""Follow graph tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_graph.py
+
+
+import os
+from unittest import TestCase
+from models import db, Follows, Likes, Message, TimelineEntry, User
+
+from app import app, CURR_USER_KEY
+from graph import Adjacency, FollowGraph
+import graph
+import identity
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+
+class AdjacencyTestCase(TestCase):
+    """Test the CSR arrays on their own."""
+
+    def test_from_pairs(self):
+        """ Neighbors are sliced out of one sorted array per direction """
+        g = FollowGraph.from_pairs([(1, 2), (1, 5), (3, 1), (3, 2)])
+
+        self.assertEqual(list(g.following.of(1)), [2, 5])
+        self.assertEqual(list(g.following.of(2)), [])
+        self.assertEqual(list(g.following.of(99)), [])
+        self.assertEqual(list(g.followers.of(2)), [1, 3])
+        self.assertEqual(list(g.followers.of(1)), [3])
+        self.assertTrue(g.is_following(3, 1))
+        self.assertFalse(g.is_following(1, 3))
+        self.assertEqual(g.following.neighbors.itemsize, 4)
+
+    def test_changes(self):
+        """ Follows and unfollows apply on top of the snapshot """
+        g = FollowGraph.from_pairs([(1, 2), (1, 5)])
+        g.follow(1, 3)
+        g.follow(7, 1)
+        g.unfollow(1, 5)
+        g.unfollow(1, 4)
+
+        self.assertEqual(list(g.following.of(1)), [2, 3])
+        self.assertEqual(list(g.following.of(7)), [1])
+        self.assertEqual(list(g.followers.of(5)), [])
+        self.assertEqual(list(g.followers.of(1)), [7])
+
+        g.follow(1, 5)
+        self.assertEqual(list(g.following.of(1)), [2, 3, 5])
+        g.remove_user(1)
+        self.assertEqual(list(g.following.of(1)), [])
+        self.assertEqual(list(g.following.of(7)), [])
+        self.assertEqual(list(g.followers.of(2)), [])
+
+    def test_compact(self):
+        """ Compacting folds the changes into the arrays """
+        adjacency = Adjacency.from_pairs([(1, 2), (1, 5), (4, 1)])
+        adjacency.add(1, 3)
+        adjacency.add(6, 2)
+        adjacency.discard(4, 1)
+        adjacency.compact()
+
+        self.assertEqual(adjacency.added, {})
+        self.assertEqual(adjacency.removed, {})
+        self.assertEqual(list(adjacency.neighbors), [2, 3, 5, 2])
+        self.assertEqual([list(adjacency.of(node)) for node in range(8)],
+                         [[], [2, 3, 5], [], [], [], [], [2], []])
+
+
+class GraphTestCase(TestCase):
+    """Test keeping the graph in step with the follows table."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+        self.client = app.test_client()
+        app.config.update({
+            "TESTING": True,
+            "SQLALCHEMY_ECHO": False,
+            "SQLALCHEMY_DATABASE_URI": os.environ.get('DATABASE_URL', 'postgresql:///warbler-test'),
+            "DEBUG_TB_HOSTS": ["dont-show-debug-toolbar"],
+            "WTF_CSRF_ENABLED": False
+            })
+
+        with app.app_context():
+            Likes.query.delete()
+            TimelineEntry.query.delete()
+            Message.query.delete()
+            Follows.query.delete()
+            User.query.delete()
+
+            users = [User(email=f"{name}@test.com", username=name, password="HASHED_PASSWORD")
+                     for name in ("ann", "bob", "cat")]
+            db.session.add_all(users)
+            db.session.flush()
+            ann, bob, cat = users
+            ann.following.append(bob)
+            db.session.commit()
+            self.ann_id, self.bob_id, self.cat_id = ann.id, bob.id, cat.id
+
+        identity.users.clear()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        with app.app_context():
+            db.session.rollback()
+
+    def test_loads_from_table(self):
+        """ The graph is (re)loaded after other writes to follows """
+        with app.app_context():
+            self.assertTrue(graph.is_following(self.ann_id, self.bob_id))
+            self.assertFalse(graph.is_following(self.bob_id, self.ann_id))
+
+    def test_tracks_committed_follows(self):
+        """ Follows written in a transaction apply when it commits """
+        with app.app_context():
+            loaded = graph.get()
+
+            graph.follow(self.ann_id, self.cat_id)
+            self.assertFalse(graph.is_following(self.ann_id, self.cat_id))
+            db.session.commit()
+            self.assertTrue(graph.is_following(self.ann_id, self.cat_id))
+
+            graph.unfollow(self.ann_id, self.bob_id)
+            db.session.rollback()
+            self.assertTrue(graph.is_following(self.ann_id, self.bob_id))
+
+            # both were applied without reloading
+            self.assertIs(graph.get(), loaded)
+
+    def test_follow_routes(self):
+        """ Following and unfollowing update the graph and the pages """
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ann_id
+
+            c.post(f"/users/follow/{self.cat_id}")
+            with app.app_context():
+                self.assertTrue(graph.is_following(self.ann_id, self.cat_id))
+            resp = c.get(f"/users/{self.ann_id}/following")
+            self.assertIn("@bob", str(resp.data))
+            self.assertIn("@cat", str(resp.data))
+
+            c.post(f"/users/stop-following/{self.bob_id}")
+            resp = c.get(f"/users/{self.bob_id}/followers")
+            self.assertNotIn("@ann", str(resp.data))
+            with app.app_context():
+                self.assertFalse(graph.is_following(self.ann_id, self.bob_id))
+
+    def test_double_follow_and_unfollow(self):
+        """ Following twice or unfollowing twice changes things once """
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ann_id
+
+            for _ in range(2):
+                resp = c.post(f"/users/follow/{self.cat_id}")
+                self.assertEqual(resp.status_code, 302)
+            with app.app_context():
+                self.assertEqual(db.session.get(User, self.ann_id).following_count, 1)
+                self.assertEqual(db.session.get(User, self.cat_id).followers_count, 1)
+
+            for _ in range(2):
+                resp = c.post(f"/users/stop-following/{self.cat_id}")
+                self.assertEqual(resp.status_code, 302)
+            with app.app_context():
+                self.assertEqual(db.session.get(User, self.ann_id).following_count, 0)
+                self.assertEqual(db.session.get(User, self.cat_id).followers_count, 0)
+                self.assertFalse(graph.is_following(self.ann_id, self.cat_id))
+
+    def test_deleted_user(self):
+        """ Deleting a user drops their follows from the graph """
+        with app.app_context():
+            graph.get()
+            db.session.delete(db.session.get(User, self.bob_id))
+            db.session.commit()
+            self.assertFalse(graph.is_following(self.ann_id, self.bob_id))
+
+    def test_viewer_checks_read_table(self):
+        """ The viewer's follow buttons see follows the graph hasn't yet """
+        with app.app_context():
+            graph.get()
+            # as written by another process: not picked up by this one's graph
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(
+                    "INSERT INTO follows (user_being_followed_id, user_following_id) "
+                    f"VALUES ({self.cat_id}, {self.ann_id})")
+            self.assertFalse(graph.is_following(self.ann_id, self.cat_id))
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ann_id
+            resp = c.get(f"/users/{self.cat_id}")
+            self.assertIn(f"/users/stop-following/{self.cat_id}", str(resp.data))
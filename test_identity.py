@@ -0,0 +1,152 @@
+"""Identity cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_identity.py
+
+
+import os
+from unittest import TestCase
+from sqlalchemy import event
+from models import db, User, Message, Follows
+
+from app import app, CURR_USER_KEY
+from cache import LRUCache
+import identity
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+class LRUCacheTestCase(TestCase):
+    """Test the LRU cache itself."""
+
+    def test_lru_eviction_and_stats(self):
+        """ The least recently used entry goes first; stats add up """
+        cache = LRUCache('test-lru', maxsize=2, ttl=60)
+        cache.set(1, 'one')
+        cache.set(2, 'two')
+        self.assertEqual(cache.get(1), 'one')
+        cache.set(3, 'three')
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(3), 'three')
+        self.assertEqual(cache.stats(), dict(hits=2, misses=1, evictions=1, size=2))
+
+    def test_get_many(self):
+        """ get_many returns the fresh entries and counts the rest as misses """
+        cache = LRUCache('test-many', maxsize=2, ttl=60)
+        cache.set(1, 'one')
+        self.assertEqual(cache.get_many([1, 2]), {1: 'one'})
+        self.assertEqual(cache.stats(), dict(hits=1, misses=1, evictions=0, size=1))
+
+    def test_ttl(self):
+        """ Expired entries are misses """
+        cache = LRUCache('test-ttl', maxsize=2, ttl=-1)
+        cache.set(1, 'one')
+        self.assertIsNone(cache.get(1))
+
+
+class IdentityCacheTestCase(TestCase):
+    """Test that g.user is served from the identity cache."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+        self.client = app.test_client()
+        app.config.update({
+            "TESTING": True,
+            "SQLALCHEMY_ECHO": False,
+            "SQLALCHEMY_DATABASE_URI": os.environ.get('DATABASE_URL', 'postgresql:///warbler-test'),
+            "DEBUG_TB_HOSTS": ["dont-show-debug-toolbar"]
+            })
+
+        with app.app_context():
+            Message.query.delete()
+            Follows.query.delete()
+            User.query.delete()
+
+            u = User(email="test@test.com", username="testuser", password="HASHED_PASSWORD")
+            u2 = User(email="test2@test2.com", username="testuser2", password="HASHED_PASSWORD")
+            db.session.add_all([u, u2])
+            db.session.commit()
+            self.u_id = u.id
+            self.u2_id = u2.id
+            self.engine = db.engine
+
+        identity.users.clear()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        with app.app_context():
+            db.session.rollback()
+
+    def user_selects(self, c, url):
+        """How many times a GET of `url` loads a user by primary key."""
+        statements = []
+        def record(conn, cursor, statement, *args):
+            if statement.startswith("SELECT users.id") and "WHERE users.id = " in statement:
+                statements.append(statement)
+
+        event.listen(self.engine, 'before_cursor_execute', record)
+        try:
+            self.assertEqual(c.get(url).status_code, 200)
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', record)
+        return len(statements)
+
+    def test_cached_after_first_request(self):
+        """ The second request doesn't load the current user """
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u_id
+
+            self.assertEqual(self.user_selects(c, "/"), 1)
+            self.assertEqual(self.user_selects(c, "/"), 0)
+
+            resp = c.get("/")
+            self.assertIn("@testuser", resp.get_data(as_text=True))
+
+    def test_bulk_lookup_reads_only_misses(self):
+        """ /api/users reads the uncached users in one IN query """
+        statements = []
+        def record(conn, cursor, statement, *args):
+            if statement.startswith("SELECT users.id"):
+                statements.append(statement)
+
+        with app.app_context():
+            identity.users.set(self.u_id, identity.snapshot(db.session.get(User, self.u_id)))
+
+        event.listen(self.engine, 'before_cursor_execute', record)
+        try:
+            resp = self.client.get(f"/api/users?ids={self.u2_id},0,{self.u_id}&fields=id,username")
+            again = self.client.get(f"/api/users?ids={self.u_id},{self.u2_id}")
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', record)
+
+        self.assertEqual(resp.json["users"], [dict(id=self.u2_id, username="testuser2"),
+                                              dict(id=self.u_id, username="testuser")])
+        self.assertEqual(again.json["users"][1]["followers_count"], 0)
+        self.assertNotIn("password", again.json["users"][1])
+        self.assertEqual(len(statements), 1)
+        self.assertIn("IN (", statements[0])
+
+    def test_follow_invalidates(self):
+        """ Following drops both users so fresh counters are shown """
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u_id
+
+            c.get("/")
+            c.post(f"/users/follow/{self.u2_id}")
+            self.assertIsNone(identity.users.get(self.u_id))
+
+            resp = c.get("/")
+            html = resp.get_data(as_text=True)
+            self.assertIn(f'<a href="/users/{self.u_id}/following">1</a>', html)
+
+    def test_stats_exported(self):
+        """ Hit and miss counters are on /metrics """
+        resp = self.client.get("/metrics")
+        self.assertIn('warbler_cache_hits_total{cache="identity"}', resp.get_data(as_text=True))
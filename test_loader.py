@@ -0,0 +1,109 @@
+"""Bulk loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_loader.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.exc import IntegrityError
+from models import db, User, Message, Follows
+
+from app import app
+import loader
+
+USERS = """email,username,image_url,password,bio,header_image_url,location
+one@test.com,one,,HASHED_PASSWORD,,,
+two@test.com,two,,HASHED_PASSWORD,"likes, commas",,Here
+three@test.com,three,,HASHED_PASSWORD,,,
+"""
+
+MESSAGES = """text,timestamp,user_id
+first,2017-01-21 11:04:53.522807,1
+second,2017-01-22 11:04:53.522807,2
+"""
+
+FOLLOWS = """user_being_followed_id,user_following_id
+1,2
+1,3
+2,1
+"""
+
+
+class LoaderTestCase(TestCase):
+    """Test streaming the CSV files into the database."""
+
+    def setUp(self):
+        app.config.update({
+            "TESTING": True,
+            "SQLALCHEMY_ECHO": False,
+            "SQLALCHEMY_DATABASE_URI": os.environ.get('DATABASE_URL', 'postgresql:///warbler-test'),
+            })
+        self.dir = tempfile.TemporaryDirectory()
+        self.write('users.csv', USERS)
+        self.write('messages.csv', MESSAGES)
+        self.write('follows.csv', FOLLOWS)
+        self.output = []
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+    def tearDown(self):
+        self.dir.cleanup()
+        # a failed load leaves the deferred indexes and constraints dropped
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+            db.create_all()
+
+    def write(self, filename, content):
+        with open(os.path.join(self.dir.name, filename), 'w') as file:
+            file.write(content)
+
+    def schema(self, engine):
+        inspector = inspect(engine)
+        return {table: ({index['name'] for index in inspector.get_indexes(table)},
+                        len(inspector.get_foreign_keys(table)),
+                        len(inspector.get_unique_constraints(table)))
+                for table in loader.FILES}
+
+    def test_copy_load(self):
+        """ Rows are loaded and the schema comes back intact """
+        with app.app_context():
+            before = self.schema(db.engine)
+            loaded = loader.load(self.dir.name, out=self.output.append)
+
+            self.assertEqual(loaded, {'users': 3, 'messages': 2, 'follows': 3})
+            self.assertEqual(self.schema(db.engine), before)
+            self.assertEqual(db.session.get(User, 2).bio, "likes, commas")
+            self.assertIsNone(db.session.get(User, 1).bio)
+            self.assertEqual(Follows.query.filter_by(user_being_followed_id=1).count(), 2)
+            self.assertIn("rows/sec", self.output[-1])
+
+            # ids carry on after the loaded ones
+            user = User(email="four@test.com", username="four", password="HASHED_PASSWORD")
+            db.session.add(user)
+            db.session.commit()
+            self.assertEqual(user.id, 4)
+
+    def test_copy_load_validates(self):
+        """ Rows breaking a constraint fail the load """
+        self.write('follows.csv', FOLLOWS + "1,99\n")
+        with app.app_context():
+            with self.assertRaises(IntegrityError):
+                loader.load(self.dir.name, out=self.output.append)
+
+    def test_sqlite_load(self):
+        """ Without COPY, rows are inserted in batches """
+        engine = create_engine('sqlite://')
+        db.metadata.create_all(engine)
+        loaded = loader.load(self.dir.name, engine=engine, out=self.output.append)
+
+        self.assertEqual(loaded, {'users': 3, 'messages': 2, 'follows': 3})
+        with engine.connect() as conn:
+            self.assertEqual(conn.execute(db.select(db.func.count(Message.id))).scalar(), 2)
+            self.assertIsNone(conn.execute(db.select(User.bio).where(User.id == 1)).scalar())
@@ -107,4 +107,47 @@ class MessageViewTestCase(TestCase):
                 html = resp.get_data(as_text=True)
                 self.assertEqual(resp.status_code, 200)
                 # removed message should be one less
-                self.assertEqual(len(user.messages), 1)
\ No newline at end of file
+                self.assertEqual(len(user.messages), 1)
+    def test_like_api(self):
+        """ Liking through the JSON API is idempotent and returns counts """
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            with app.app_context():
+                other = User.signup(username="other", email="other@test.com",
+                                    password="password", image_url=None)
+                db.session.add(other)
+                db.session.flush()
+                msg = Message(text="likeable", user_id=other.id)
+                db.session.add(msg)
+                db.session.commit()
+                msg_id = msg.id
+                other_id = other.id
+
+            url = f"/api/messages/{msg_id}/like"
+            resp = c.post(url)
+            self.assertEqual(resp.json, {"message_id": msg_id, "liked": True, "likes": 1})
+            # a second like changes nothing
+            resp = c.post(url)
+            self.assertEqual(resp.json["likes"], 1)
+
+            # another user can like the same message
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = other_id
+            resp = c.post(url)
+            self.assertEqual(resp.json["likes"], 2)
+
+            resp = c.delete(url)
+            self.assertEqual(resp.json, {"message_id": msg_id, "liked": False, "likes": 1})
+
+            with app.app_context():
+                self.assertEqual(db.session.get(User, self.testuser_id).likes_count, 1)
+                self.assertEqual(db.session.get(User, other_id).likes_count, 0)
+
+            self.assertEqual(c.post("/api/messages/0/like").status_code, 404)
+
+    def test_like_api_requires_login(self):
+        """ Anonymous likes are refused """
+        resp = self.client.post("/api/messages/1/like")
+        self.assertEqual(resp.status_code, 401)
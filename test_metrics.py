@@ -0,0 +1,76 @@
+"""Request metrics tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_metrics.py
+
+
+import os
+from unittest import TestCase
+from models import db, User, Message, Follows
+
+from app import app, CURR_USER_KEY
+import metrics
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+class MetricsTestCase(TestCase):
+    """Test request instrumentation and query budgets."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+        self.client = app.test_client()
+        app.config.update({
+            "TESTING": True,
+            "SQLALCHEMY_ECHO": False,
+            "SQLALCHEMY_DATABASE_URI": os.environ.get('DATABASE_URL', 'postgresql:///warbler-test'),
+            "DEBUG_TB_HOSTS": ["dont-show-debug-toolbar"]
+            })
+
+        with app.app_context():
+            Message.query.delete()
+            Follows.query.delete()
+            User.query.delete()
+
+            u = User(email="test@test.com", username="testuser", password="HASHED_PASSWORD")
+            db.session.add(u)
+            db.session.commit()
+            self.u_id = u.id
+
+        metrics.reset()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        with app.app_context():
+            db.session.rollback()
+
+    def test_metrics_endpoint(self):
+        """ Requests show up per endpoint in Prometheus text format """
+        with self.client as c:
+            c.get(f"/users/{self.u_id}")
+            resp = c.get("/metrics")
+            text = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("# TYPE warbler_request_duration_seconds histogram", text)
+        self.assertIn('warbler_request_duration_seconds_count{endpoint="warbler.users_show"} 1', text)
+        self.assertIn('warbler_request_queries_bucket{endpoint="warbler.users_show",le="+Inf"} 1', text)
+        self.assertIn('warbler_request_db_seconds_sum{endpoint="warbler.users_show"}', text)
+
+    def test_query_budget(self):
+        """ Routes over budget fail; routes within it pass """
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u_id
+
+            with metrics.query_budget(app, 5):
+                self.assertEqual(c.get("/").status_code, 200)
+
+            with metrics.query_budget(app, 0):
+                with self.assertRaises(metrics.QueryBudgetExceeded):
+                    c.get("/")
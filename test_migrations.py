@@ -0,0 +1,118 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_migrations.py
+
+
+import os
+from unittest import TestCase
+from sqlalchemy import inspect
+from models import db, Likes, User
+
+from app import app
+import migrations
+import timeline
+
+# the tables as they were before the first migration
+BASELINE_SCHEMA = [
+    'CREATE TABLE users (id serial PRIMARY KEY, email text NOT NULL UNIQUE, '
+    'username text NOT NULL UNIQUE, image_url text, header_image_url text, '
+    'bio text, location text, password text NOT NULL)',
+    'CREATE TABLE messages (id serial PRIMARY KEY, text varchar(140) NOT NULL, '
+    'timestamp timestamp NOT NULL, '
+    'user_id integer NOT NULL REFERENCES users (id) ON DELETE CASCADE)',
+    'CREATE TABLE follows ('
+    'user_being_followed_id integer REFERENCES users (id) ON DELETE CASCADE, '
+    'user_following_id integer REFERENCES users (id) ON DELETE CASCADE, '
+    'PRIMARY KEY (user_being_followed_id, user_following_id))',
+    'CREATE TABLE likes (id serial PRIMARY KEY, '
+    'user_id integer REFERENCES users (id) ON DELETE CASCADE, '
+    'message_id integer UNIQUE REFERENCES messages (id) ON DELETE CASCADE)',
+]
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+class MigrationsTestCase(TestCase):
+    """Test stamping fresh databases and upgrading old ones."""
+
+    def setUp(self):
+        app.config.update({
+            "TESTING": True,
+            "SQLALCHEMY_ECHO": False,
+            "SQLALCHEMY_DATABASE_URI": os.environ.get('DATABASE_URL', 'postgresql:///warbler-test'),
+            })
+
+    def index_names(self, table):
+        return {index['name'] for index in inspect(db.engine).get_indexes(table)}
+
+    def test_fresh_schema_is_current(self):
+        """ create_all stamps every migration as applied """
+        with app.app_context():
+            self.assertEqual(migrations.pending(), [])
+            self.assertEqual(migrations.upgrade(), [])
+
+    def test_versions_in_run_order(self):
+        """ Versions are numbered 1, 2, 3... in the order they run """
+        versions = [m.version for m in migrations.MIGRATIONS]
+        self.assertEqual(versions, list(range(1, len(versions) + 1)))
+
+    def test_upgrade_old_schema(self):
+        """ A database missing the index pack gets it, once """
+        with app.app_context():
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql("DROP INDEX ix_follows_user_following_id")
+                conn.exec_driver_sql("DROP INDEX ix_timeline_entries_message_id")
+                conn.execute(migrations.schema_migrations.delete()
+                             .where(migrations.schema_migrations.c.version == 5))
+
+            self.assertNotIn('ix_follows_user_following_id', self.index_names('follows'))
+            self.assertEqual([m.version for m in migrations.pending()], [5])
+
+            self.assertEqual([m.version for m in migrations.upgrade()], [5])
+            self.assertIn('ix_follows_user_following_id', self.index_names('follows'))
+            self.assertIn('ix_timeline_entries_message_id', self.index_names('timeline_entries'))
+            self.assertEqual(migrations.upgrade(), [])
+
+    def test_upgrade_baseline_schema(self):
+        """ A database from before any migration is brought fully up to date """
+        with app.app_context():
+            db.drop_all()
+            try:
+                with db.engine.begin() as conn:
+                    for statement in BASELINE_SCHEMA:
+                        conn.exec_driver_sql(statement)
+                    conn.exec_driver_sql(
+                        "INSERT INTO users (id, email, username, password) VALUES "
+                        "(1, 'ann@test.com', 'ann', 'x'), (2, 'bob@test.com', 'bob', 'x')")
+                    conn.exec_driver_sql(
+                        "INSERT INTO messages (id, text, timestamp, user_id) VALUES "
+                        "(1, 'first', '2023-01-01', 2), (2, 'second', '2023-01-02', 2)")
+                    conn.exec_driver_sql(
+                        "INSERT INTO follows (user_being_followed_id, user_following_id) "
+                        "VALUES (2, 1)")
+                    conn.exec_driver_sql(
+                        "INSERT INTO likes (user_id, message_id) VALUES (1, 2)")
+
+                applied = migrations.upgrade()
+                self.assertEqual([m.version for m in applied],
+                                 [m.version for m in migrations.MIGRATIONS])
+                self.assertIn('ix_likes_user_timestamp', self.index_names('likes'))
+                self.assertIn('ix_users_username_prefix', self.index_names('users'))
+
+                ann, bob = db.session.execute(
+                    db.select(User).order_by(User.id)).scalars().all()
+                self.assertEqual((ann.following_count, ann.likes_count), (1, 1))
+                self.assertEqual((bob.followers_count, bob.messages_count), (1, 2))
+                self.assertEqual(timeline.home_message_ids(ann.id), [2, 1])
+                self.assertIsNotNone(db.session.get(Likes, 1).timestamp)
+                self.assertEqual(migrations.upgrade(), [])
+            finally:
+                db.session.rollback()
+                db.drop_all()
+                db.create_all()
@@ -0,0 +1,98 @@
+"""Password hashing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+import os
+from unittest import TestCase
+from models import db, User
+
+from app import app, CURR_USER_KEY
+import passwords
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+class PasswordsTestCase(TestCase):
+    """Test pooled hashing, rehash-on-login and busy rejection."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+        self.client = app.test_client()
+        app.config.update({
+            "TESTING": True,
+            "SQLALCHEMY_ECHO": False,
+            "SQLALCHEMY_DATABASE_URI": os.environ.get('DATABASE_URL', 'postgresql:///warbler-test'),
+            "DEBUG_TB_HOSTS": ["dont-show-debug-toolbar"],
+            "WTF_CSRF_ENABLED": False,
+            "BCRYPT_LOG_ROUNDS": 4
+            })
+
+        with app.app_context():
+            User.query.delete()
+            user = User.signup(username="testuser",
+                               email="test@test.com",
+                               password="password",
+                               image_url=None)
+            db.session.commit()
+            self.user_id = user.id
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        with app.app_context():
+            db.session.rollback()
+        app.config['BCRYPT_LOG_ROUNDS'] = 12
+        app.config['BCRYPT_TIMEOUT'] = 10
+
+    def test_hash_uses_configured_rounds(self):
+        """ Signup hashes at BCRYPT_LOG_ROUNDS """
+        with app.app_context():
+            user = db.session.get(User, self.user_id)
+            self.assertEqual(passwords.hash_rounds(user.password), 4)
+            self.assertEqual(passwords.verify_password("password", user.password), (True, None))
+            self.assertEqual(passwords.verify_password("wrong", user.password), (False, None))
+
+    def test_rehash_on_login(self):
+        """ Logging in upgrades a hash made with fewer rounds """
+        app.config['BCRYPT_LOG_ROUNDS'] = 5
+        with self.client as c:
+            resp = c.post("/login", data={"username": "testuser", "password": "password"})
+            self.assertEqual(resp.status_code, 302)
+
+        with app.app_context():
+            user = db.session.get(User, self.user_id)
+            self.assertEqual(passwords.hash_rounds(user.password), 5)
+            self.assertTrue(User.authenticate("testuser", "password"))
+
+    def test_busy_pool_rejects_login(self):
+        """ With every slot taken, logins are turned away with a 503 """
+        with app.app_context():
+            passwords._get_pool()
+        taken = 0
+        while passwords._slots.acquire(blocking=False):
+            taken += 1
+        try:
+            with self.client as c:
+                resp = c.post("/login", data={"username": "testuser", "password": "password"})
+                self.assertEqual(resp.status_code, 503)
+                with c.session_transaction() as sess:
+                    self.assertNotIn(CURR_USER_KEY, sess)
+        finally:
+            for _ in range(taken):
+                passwords._slots.release()
+
+    def test_slow_hash_rejects_login(self):
+        """ A hash that outlasts BCRYPT_TIMEOUT is a 503, not a 500 """
+        # logging in rehashes at 12 rounds, which takes far longer
+        app.config.update(BCRYPT_LOG_ROUNDS=12, BCRYPT_TIMEOUT=0.001)
+        with self.client as c:
+            resp = c.post("/login", data={"username": "testuser", "password": "password"})
+            self.assertEqual(resp.status_code, 503)
+            with c.session_transaction() as sess:
+                self.assertNotIn(CURR_USER_KEY, sess)
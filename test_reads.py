@@ -0,0 +1,165 @@
+"""Async read path tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_reads.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, Follows, Likes, Message, Suggestion, TimelineEntry, User
+
+from app import app, CURR_USER_KEY
+import feed
+import identity
+import reads
+import recommend
+import search
+import suggestions
+import timeline
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+
+class ReadsTestCase(TestCase):
+    """Test that async reads match the sync ones."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+        self.client = app.test_client()
+        app.config.update({
+            "TESTING": True,
+            "SQLALCHEMY_ECHO": False,
+            "SQLALCHEMY_DATABASE_URI": os.environ.get('DATABASE_URL', 'postgresql:///warbler-test'),
+            "DEBUG_TB_HOSTS": ["dont-show-debug-toolbar"],
+            "WTF_CSRF_ENABLED": False
+            })
+
+        with app.app_context():
+            Suggestion.query.delete()
+            Likes.query.delete()
+            TimelineEntry.query.delete()
+            Message.query.delete()
+            Follows.query.delete()
+            User.query.delete()
+
+            users = [User(email=f"{name}@test.com", username=name, password="HASHED_PASSWORD")
+                     for name in ("ann", "bob", "cat")]
+            db.session.add_all(users)
+            db.session.flush()
+            ann, bob, cat = users
+            ann.following.append(bob)
+            bob.following.append(cat)
+            db.session.commit()
+            for i in range(3):
+                msg = Message(text=f"bob says {i}", user_id=bob.id)
+                db.session.add(msg)
+                db.session.flush()
+                timeline.push_message(msg)
+            db.session.add(Likes(user_id=ann.id, message_id=msg.id))
+            db.session.commit()
+            recommend.compute(out=lambda *args: None)
+            self.ann_id, self.bob_id, self.cat_id = ann.id, bob.id, cat.id
+            self.msg_id = msg.id
+
+        identity.users.clear()
+        timeline.forget_celebrities()
+        search._index = None
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        with app.app_context():
+            db.session.rollback()
+        app.config['ASYNC_READS'] = False
+        timeline.CELEBRITY_FOLLOWERS = 10000
+        timeline.forget_celebrities()
+
+    def test_home_page(self):
+        """ The homepage's messages and suggestions match the sync path """
+        with app.app_context():
+            page, suggested = reads.home_page(self.ann_id, limit=2)
+            self.assertEqual(page, timeline.home_page(self.ann_id, limit=2))
+            self.assertTrue(page.items[0].liked)
+
+            rest, _ = reads.home_page(self.ann_id, page.next_cursor, limit=2)
+            self.assertEqual(rest, timeline.home_page(self.ann_id, page.next_cursor, limit=2))
+
+            self.assertEqual([(user.id, mutual) for user, mutual in suggested],
+                             [(user.id, mutual) for user, mutual in
+                              suggestions.for_user(self.ann_id)])
+
+    def test_home_queries_concurrent(self):
+        """ The timeline, celebrity and suggestion queries overlap """
+        timeline.CELEBRITY_FOLLOWERS = 0
+        with app.app_context():
+            engine = reads.sessions().kw['bind'].sync_engine
+            checked_out = [0, 0]
+
+            def checkout(*args):
+                checked_out[0] += 1
+                checked_out[1] = max(checked_out)
+
+            def checkin(*args):
+                checked_out[0] -= 1
+
+            event.listen(engine, 'checkout', checkout)
+            event.listen(engine, 'checkin', checkin)
+            try:
+                page, _ = reads.home_page(self.ann_id)
+            finally:
+                event.remove(engine, 'checkout', checkout)
+                event.remove(engine, 'checkin', checkin)
+
+            self.assertEqual(len(page.items), 3)
+            self.assertGreater(checked_out[1], 1)
+
+    def test_user_page(self):
+        """ A profile's user and messages match the sync path """
+        with app.app_context():
+            user, page = reads.user_page(self.bob_id, viewer_id=self.ann_id)
+            self.assertEqual(user.username, "bob")
+            self.assertEqual(page, feed.user_messages(self.bob_id, viewer_id=self.ann_id))
+
+            self.assertEqual(reads.user_page(0), (None, feed.user_messages(0)))
+
+    def test_message_and_users(self):
+        """ Single messages and user listings match the sync path """
+        with app.app_context():
+            self.assertEqual(reads.message(self.msg_id, viewer_id=self.ann_id),
+                             feed.message(self.msg_id, viewer_id=self.ann_id))
+            self.assertIsNone(reads.message(0))
+
+            for query in ("", "b", "ca", "nobody"):
+                page = reads.search_users(query)
+                expected = search.search_users(query)
+                self.assertEqual([user.id for user in page.users],
+                                 [user.id for user in expected.users])
+                self.assertEqual(page[1:], expected[1:])
+
+    def test_routes(self):
+        """ With ASYNC_READS on the views render from the async path """
+        app.config['ASYNC_READS'] = True
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ann_id
+
+            html = c.get("/").get_data(as_text=True)
+            self.assertIn("bob says 2", html)
+            self.assertIn("@cat", html)
+
+            html = c.get(f"/users/{self.bob_id}").get_data(as_text=True)
+            self.assertIn("bob says 0", html)
+
+            html = c.get(f"/messages/{self.msg_id}").get_data(as_text=True)
+            self.assertIn("bob says 2", html)
+
+            html = c.get("/users?q=ca").get_data(as_text=True)
+            self.assertIn("@cat", html)
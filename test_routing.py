@@ -0,0 +1,134 @@
+"""Read-replica routing tests."""
+
+# run these tests like:
+#
+#    REPLICA_DATABASE_URL=postgresql:///warbler-replica python -m unittest test_routing.py
+#
+# The replica is stood in for by a second, unreplicated database, so the
+# tests can tell which one a page was read from.
+
+
+import os
+import time
+from unittest import TestCase
+
+import sqlalchemy as sa
+
+from models import db, Follows, Likes, Message, TimelineEntry, User
+
+from app import app, CURR_USER_KEY
+import identity
+import routing
+
+REPLICA_URL = os.environ.get('REPLICA_DATABASE_URL', 'postgresql:///warbler-replica')
+
+replica = sa.create_engine(REPLICA_URL)
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+    db.metadata.drop_all(replica)
+    db.metadata.create_all(replica)
+
+
+class RoutingTestCase(TestCase):
+    """Test which database requests read from."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+        self.client = app.test_client()
+        app.config.update({
+            "TESTING": True,
+            "SQLALCHEMY_ECHO": False,
+            "SQLALCHEMY_DATABASE_URI": os.environ.get('DATABASE_URL', 'postgresql:///warbler-test'),
+            "DEBUG_TB_HOSTS": ["dont-show-debug-toolbar"],
+            "WTF_CSRF_ENABLED": False
+            })
+
+        with app.app_context():
+            Likes.query.delete()
+            TimelineEntry.query.delete()
+            Message.query.delete()
+            Follows.query.delete()
+            User.query.delete()
+
+            ann = User(email="ann@test.com", username="ann", password="HASHED_PASSWORD")
+            bob = User(email="bob@test.com", username="bob", password="HASHED_PASSWORD")
+            db.session.add_all([ann, bob])
+            db.session.commit()
+            self.ann_id, self.bob_id = ann.id, bob.id
+
+            db.engines[routing.REPLICA] = replica
+
+        # the same users, renamed so pages show where they were read from
+        with replica.begin() as conn:
+            conn.execute(sa.delete(User.__table__))
+            conn.execute(sa.insert(User.__table__), [
+                dict(id=self.ann_id, email="ann@test.com", username="ann_replica",
+                     password="HASHED_PASSWORD"),
+                dict(id=self.bob_id, email="bob@test.com", username="bob_replica",
+                     password="HASHED_PASSWORD")])
+
+        identity.users.clear()
+        routing._down_until = 0
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        with app.app_context():
+            db.session.rollback()
+            db.engines.pop(routing.REPLICA, None)
+        routing._down_until = 0
+
+    def test_get_reads_replica(self):
+        """ GET pages are read from the replica """
+        with self.client as c:
+            html = c.get(f"/users/{self.bob_id}").get_data(as_text=True)
+            self.assertIn("@bob_replica", html)
+
+    def test_writes_go_to_primary(self):
+        """ Writes in a read-only request still go to the primary """
+        with app.test_request_context("/"):
+            app.preprocess_request()
+            self.assertEqual(db.session.get(User, self.bob_id).username, "bob_replica")
+
+            db.session.execute(db.update(User).where(User.id == self.bob_id)
+                               .values(bio="written"))
+            db.session.commit()
+            self.assertEqual(db.session.get(User, self.bob_id, populate_existing=True).bio,
+                             "written")
+
+        with replica.connect() as conn:
+            self.assertIsNone(conn.execute(sa.select(User.__table__.c.bio)
+                                           .where(User.__table__.c.id == self.bob_id))
+                              .scalar())
+
+    def test_read_your_writes(self):
+        """ After a write, the user reads from the primary for a while """
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ann_id
+
+            c.post(f"/users/follow/{self.bob_id}")
+            html = c.get(f"/users/{self.bob_id}").get_data(as_text=True)
+            self.assertIn("@bob<", html)
+
+            with c.session_transaction() as sess:
+                self.assertGreater(sess[routing.PRIMARY_UNTIL], time.time())
+                sess[routing.PRIMARY_UNTIL] = time.time() - 1
+
+            html = c.get(f"/users/{self.bob_id}").get_data(as_text=True)
+            self.assertIn("@bob_replica", html)
+
+    def test_replica_unavailable(self):
+        """ Reads fall back to the primary when the replica is down """
+        with app.app_context():
+            db.engines[routing.REPLICA] = sa.create_engine(
+                'postgresql:///warbler-no-such-database')
+
+        with self.client as c:
+            html = c.get(f"/users/{self.bob_id}").get_data(as_text=True)
+            self.assertIn("@bob<", html)
+            self.assertGreater(routing._down_until, time.monotonic())
@@ -0,0 +1,111 @@
+"""User search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+import os
+from unittest import TestCase
+from models import db, User
+
+from app import app
+import search
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+class UsernameIndexTestCase(TestCase):
+    """Test the in-process username index."""
+
+    def setUp(self):
+        self.index = search.UsernameIndex()
+        for user_id, username in enumerate(['alice', 'Malice', 'alicia', 'bob', 'albert'], 1):
+            self.index.add(user_id, username)
+
+    def test_substring_ranked_by_similarity(self):
+        """ Substring matches come back best match first """
+        self.assertEqual(self.index.search('alice', 0, 10), [1, 2])
+        self.assertEqual(self.index.search('ALI', 0, 10), [1, 3, 2])
+
+    def test_prefix_for_short_queries(self):
+        """ One and two letter queries match username prefixes """
+        self.assertEqual(self.index.search('al', 0, 10), [5, 1, 3])
+        self.assertEqual(self.index.search('al', 1, 1), [1])
+
+    def test_rename_and_remove(self):
+        """ Re-adding a user replaces their old name; removed users vanish """
+        self.index.add(4, 'bobalice')
+        self.assertEqual(self.index.search('bob', 0, 10), [4])
+        self.index.remove(1)
+        self.assertNotIn(1, self.index.search('alice', 0, 10))
+        self.assertNotIn(1, self.index.search('a', 0, 10))
+
+
+class SearchViewTestCase(TestCase):
+    """Test the /users search page."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+        self.client = app.test_client()
+        app.config.update({
+            "TESTING": True,
+            "SQLALCHEMY_ECHO": False,
+            "SQLALCHEMY_DATABASE_URI": os.environ.get('DATABASE_URL', 'postgresql:///warbler-test'),
+            "DEBUG_TB_HOSTS": ["dont-show-debug-toolbar"],
+            "WTF_CSRF_ENABLED": False
+            })
+
+        with app.app_context():
+            User.query.delete()
+            db.session.add_all([User(email=f"user{i}@test.com",
+                                     username=f"searchuser{i}",
+                                     password="HASHED_PASSWORD")
+                                for i in range(search.PAGE_SIZE + 5)])
+            db.session.add(User(email="other@test.com", username="other", password="HASHED_PASSWORD"))
+            db.session.commit()
+
+        # users were added behind the index's back
+        search._index = None
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        with app.app_context():
+            db.session.rollback()
+
+    def test_search_is_paged(self):
+        """ Results are capped at PAGE_SIZE with a link to the next page """
+        with self.client:
+            resp = self.client.get('/users?q=searchuser')
+            html = resp.get_data(as_text=True)
+            self.assertEqual(html.count('class="card user-card"'), search.PAGE_SIZE)
+            self.assertIn('id="next-users"', html)
+            self.assertNotIn('<p>@other</p>', html)
+
+            resp = self.client.get('/users?q=searchuser&page=2')
+            html = resp.get_data(as_text=True)
+            self.assertEqual(html.count('class="card user-card"'), 5)
+            self.assertNotIn('id="next-users"', html)
+
+    def test_listing_is_paged(self):
+        """ With no query every user is listed, a page at a time """
+        with self.client:
+            resp = self.client.get('/users')
+            html = resp.get_data(as_text=True)
+            self.assertEqual(html.count('class="card user-card"'), search.PAGE_SIZE)
+            self.assertIn('id="next-users"', html)
+
+    def test_signup_is_searchable(self):
+        """ New signups are added to the in-process index """
+        with app.app_context():
+            search.fallback_index()
+        with self.client:
+            self.client.post('/signup', data={"username": "freshface",
+                                              "email": "fresh@test.com",
+                                              "password": "password"})
+            resp = self.client.get('/users?q=freshface')
+            self.assertIn('<p>@freshface</p>', resp.get_data(as_text=True))
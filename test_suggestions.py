@@ -0,0 +1,150 @@
+"""Who to follow tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_suggestions.py
+
+
+import os
+from unittest import TestCase
+from models import db, Follows, Likes, Message, Suggestion, TimelineEntry, User
+
+from app import app, CURR_USER_KEY
+from graph import Adjacency
+import identity
+import recommend
+import suggestions
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+
+def scorer(pairs):
+    return recommend.Scorer(recommend.follow_matrix(Adjacency.from_pairs(sorted(pairs))))
+
+
+class ScorerTestCase(TestCase):
+    """Test scoring suggestions from the follow matrix."""
+
+    def test_friends_of_friends(self):
+        """ People followed by those you follow rank by how many follow them """
+        # 1 follows 2 and 3; both follow 4, only 3 follows 5
+        rows = scorer([(1, 2), (1, 3), (2, 4), (3, 4), (3, 5)]).top([1])
+
+        self.assertEqual([(row[2], row[4]) for row in rows], [(4, 2), (5, 1)])
+        self.assertEqual([row[1] for row in rows], [0, 1])
+
+    def test_excludes_followed_and_self(self):
+        """ Nobody is suggested to themselves or to their followers """
+        # 1 follows 2, who follows 1 back and 3
+        rows = scorer([(1, 2), (2, 1), (2, 3)]).top([1, 2])
+
+        self.assertEqual([(row[0], row[2]) for row in rows], [(1, 3)])
+
+    def test_follows_you_and_common_followers(self):
+        """ Followers you don't follow back and shared followers count too """
+        # 2 follows 1; 3 follows both 1 and 4
+        rows = scorer([(2, 1), (3, 1), (3, 4)]).top([1])
+
+        self.assertEqual([row[2] for row in rows], [2, 3, 4])
+        self.assertEqual([row[3] for row in rows],
+                         [recommend.FOLLOWS_YOU_WEIGHT] * 2
+                         + [recommend.COMMON_FOLLOWERS_WEIGHT])
+
+    def test_top_k(self):
+        """ Only the best TOP_K are kept """
+        pairs = [(1, 2)] + [(2, n) for n in range(3, 10)]
+        rows = scorer(pairs).top([1], k=3)
+
+        self.assertEqual([row[2] for row in rows], [3, 4, 5])
+
+
+class SuggestionsTestCase(TestCase):
+    """Test storing and showing suggestions."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+        self.client = app.test_client()
+        app.config.update({
+            "TESTING": True,
+            "SQLALCHEMY_ECHO": False,
+            "SQLALCHEMY_DATABASE_URI": os.environ.get('DATABASE_URL', 'postgresql:///warbler-test'),
+            "DEBUG_TB_HOSTS": ["dont-show-debug-toolbar"],
+            "WTF_CSRF_ENABLED": False
+            })
+
+        with app.app_context():
+            Suggestion.query.delete()
+            Likes.query.delete()
+            TimelineEntry.query.delete()
+            Message.query.delete()
+            Follows.query.delete()
+            User.query.delete()
+
+            users = [User(email=f"{name}@test.com", username=name, password="HASHED_PASSWORD")
+                     for name in ("ann", "bob", "cat", "dan")]
+            db.session.add_all(users)
+            db.session.flush()
+            ann, bob, cat, dan = users
+            ann.following.append(bob)
+            bob.following.extend([cat, dan])
+            cat.following.append(dan)
+            db.session.commit()
+            self.ann_id, self.bob_id, self.cat_id, self.dan_id = (
+                ann.id, bob.id, cat.id, dan.id)
+
+        identity.users.clear()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        with app.app_context():
+            db.session.rollback()
+
+    def test_compute(self):
+        """ The job stores every user's suggestions and bumps their version """
+        with app.app_context():
+            version = db.session.get(User, self.ann_id).version
+            self.assertEqual(recommend.compute(out=lambda *args: None), 4)
+
+            self.assertEqual(
+                [(user.username, mutual) for user, mutual in
+                 suggestions.for_user(self.ann_id)],
+                [("cat", 1), ("dan", 1)])
+            self.assertGreater(db.session.get(User, self.ann_id).version, version)
+
+    def test_shards(self):
+        """ Shards split the users between them """
+        with app.app_context():
+            recommend.BLOCK_SIZE, block_size = 2, recommend.BLOCK_SIZE
+            try:
+                done = [recommend.compute(shard=shard, shards=2, out=lambda *args: None)
+                        for shard in range(2)]
+            finally:
+                recommend.BLOCK_SIZE = block_size
+            self.assertEqual(done, [2, 2])
+            self.assertEqual(
+                db.session.query(Suggestion.user_id).distinct().count(), 4)
+
+    def test_homepage(self):
+        """ The sidebar shows suggestions not followed since """
+        with app.app_context():
+            recommend.compute(out=lambda *args: None)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ann_id
+
+            resp = c.get("/")
+            html = resp.get_data(as_text=True)
+            self.assertIn("Who to follow", html)
+            self.assertIn("@cat", html)
+            self.assertIn("Followed by 1 you follow", html)
+
+            c.post(f"/users/follow/{self.cat_id}")
+            html = c.get("/").get_data(as_text=True)
+            self.assertNotIn('href="/users/{}">@cat'.format(self.cat_id), html)
+            self.assertIn("@dan", html)
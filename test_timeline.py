@@ -0,0 +1,198 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timeline.py
+
+
+import os
+from unittest import TestCase
+from models import db, User, Message, Follows, TimelineEntry
+
+from app import app, CURR_USER_KEY
+import graph
+import timeline
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+class TimelineTestCase(TestCase):
+    """Test fan-out-on-write home timelines."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+        self.client = app.test_client()
+        app.config.update({
+            "TESTING": True,
+            "SQLALCHEMY_ECHO": False,
+            "SQLALCHEMY_DATABASE_URI": os.environ.get('DATABASE_URL', 'postgresql:///warbler-test'),
+            "DEBUG_TB_HOSTS": ["dont-show-debug-toolbar"],
+            "WTF_CSRF_ENABLED": False
+            })
+
+        with app.app_context():
+            TimelineEntry.query.delete()
+            Message.query.delete()
+            Follows.query.delete()
+            User.query.delete()
+
+            u = User(email="test@test.com", username="testuser", password="HASHED_PASSWORD")
+            u2 = User(email="test2@test2.com", username="testuser2", password="HASHED_PASSWORD")
+            db.session.add_all([u, u2])
+            db.session.commit()
+
+            self.u_id = u.id
+            self.u2_id = u2.id
+
+        timeline.forget_celebrities()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        with app.app_context():
+            db.session.rollback()
+        timeline.CELEBRITY_FOLLOWERS = 10000
+        timeline.TIMELINE_LENGTH = 800
+        timeline.TRIM_EVERY = 100
+        timeline.forget_celebrities()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_post_fans_out_to_followers(self):
+        """ New messages land in the author's and followers' timelines """
+        with self.client as c:
+            self.login(c, self.u_id)
+            c.post(f"/users/follow/{self.u2_id}")
+
+            self.login(c, self.u2_id)
+            c.post("/messages/new", data={"text": "fanned out"})
+
+            with app.app_context():
+                msg = Message.query.one()
+                self.assertEqual(timeline.home_message_ids(self.u_id), [msg.id])
+                self.assertEqual(timeline.home_message_ids(self.u2_id), [msg.id])
+
+            self.login(c, self.u_id)
+            resp = c.get("/")
+            self.assertIn("fanned out", resp.get_data(as_text=True))
+
+    def test_fan_out_reads_follows(self):
+        """ Fan-out reaches followers this process's graph hasn't seen yet """
+        with app.app_context():
+            db.session.add(Follows(user_following_id=self.u_id,
+                                   user_being_followed_id=self.u2_id))
+            db.session.commit()
+            # as if the follow was made by another process
+            graph._graph, graph._stale = graph.FollowGraph(), False
+        try:
+            with self.client as c:
+                self.login(c, self.u2_id)
+                c.post("/messages/new", data={"text": "fanned out"})
+            with app.app_context():
+                self.assertEqual(len(timeline.home_message_ids(self.u_id)), 1)
+        finally:
+            graph.forget()
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        """ Following pulls in recent messages; unfollowing drops them """
+        with self.client as c:
+            self.login(c, self.u2_id)
+            c.post("/messages/new", data={"text": "before the follow"})
+
+            self.login(c, self.u_id)
+            c.post(f"/users/follow/{self.u2_id}")
+            with app.app_context():
+                self.assertEqual(len(timeline.home_message_ids(self.u_id)), 1)
+
+            c.post(f"/users/stop-following/{self.u2_id}")
+            with app.app_context():
+                self.assertEqual(timeline.home_message_ids(self.u_id), [])
+
+    def test_delete_removes_from_timelines(self):
+        """ Deleting a message removes it from every timeline """
+        with self.client as c:
+            self.login(c, self.u_id)
+            c.post(f"/users/follow/{self.u2_id}")
+
+            self.login(c, self.u2_id)
+            c.post("/messages/new", data={"text": "short lived"})
+            with app.app_context():
+                msg_id = Message.query.one().id
+            c.post(f"/messages/{msg_id}/delete")
+
+            with app.app_context():
+                self.assertEqual(TimelineEntry.query.count(), 0)
+
+    def test_celebrity_merged_on_read(self):
+        """ Celebrity messages are not fanned out but still show up """
+        timeline.CELEBRITY_FOLLOWERS = 0
+        with self.client as c:
+            self.login(c, self.u_id)
+            c.post(f"/users/follow/{self.u2_id}")
+            timeline.forget_celebrities()
+
+            self.login(c, self.u2_id)
+            c.post("/messages/new", data={"text": "famous words"})
+
+            with app.app_context():
+                msg = Message.query.one()
+                entries = TimelineEntry.query.filter_by(user_id=self.u_id).count()
+                self.assertEqual(entries, 0)
+                self.assertEqual(timeline.home_message_ids(self.u_id), [msg.id])
+
+    def test_former_celebrity_still_merged(self):
+        """ Messages left out of fan-out still show once the author's following shrinks """
+        timeline.CELEBRITY_FOLLOWERS = 0
+        with self.client as c:
+            self.login(c, self.u_id)
+            c.post(f"/users/follow/{self.u2_id}")
+            timeline.forget_celebrities()
+
+            self.login(c, self.u2_id)
+            c.post("/messages/new", data={"text": "famous words"})
+
+        timeline.CELEBRITY_FOLLOWERS = 10000
+        timeline.forget_celebrities()
+        with app.app_context():
+            msg = Message.query.one()
+            self.assertIn(self.u2_id, timeline.celebrity_ids())
+            self.assertEqual(timeline.home_message_ids(self.u_id), [msg.id])
+
+    def test_push_trims_timelines(self):
+        """ Pushing a message trims the timelines it lands in """
+        timeline.TIMELINE_LENGTH = 2
+        timeline.TRIM_EVERY = 1
+        with self.client as c:
+            self.login(c, self.u_id)
+            c.post(f"/users/follow/{self.u2_id}")
+
+            self.login(c, self.u2_id)
+            for n in range(3):
+                c.post("/messages/new", data={"text": f"message {n}"})
+
+        with app.app_context():
+            newest = [msg.id for msg in Message.query.order_by(Message.id.desc()).limit(2)]
+            self.assertEqual(timeline.home_message_ids(self.u_id), newest)
+            self.assertEqual(TimelineEntry.query.filter_by(user_id=self.u_id).count(), 2)
+
+    def test_home_pagination(self):
+        """ Older homepage messages are reached through the cursor """
+        with app.app_context():
+            for i in range(3):
+                msg = Message(text=f"paged {i}", user_id=self.u_id)
+                db.session.add(msg)
+                db.session.flush()
+                timeline.push_message(msg)
+            db.session.commit()
+            ids = [msg.id for msg in Message.query.order_by(Message.id.desc())]
+
+            first = timeline.home_page(self.u_id, limit=2)
+            self.assertEqual([msg.id for msg in first.items], ids[:2])
+            second = timeline.home_page(self.u_id, first.next_cursor, limit=2)
+            self.assertEqual([msg.id for msg in second.items], ids[2:])
+            self.assertIsNone(second.next_cursor)
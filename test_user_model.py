@@ -8,7 +8,7 @@
 import os
 from unittest import TestCase
 from models import db, User, Message, Follows
-from sqlalchemy import exc
+from sqlalchemy import event, exc
 
 from app import app
 
@@ -157,4 +157,27 @@ class UserModelTestCase(TestCase):
             self.assertFalse(User.authenticate('wronguser', 'SIGNUPUSERTEST'))
             # Correct credentials
             self.assertTrue(User.authenticate(user.username, 'SIGNUPUSERTEST'))
-                
\ No newline at end of file
+                
+    def test_follow_checks_batched(self):
+        """ A page of follow checks is answered with one query """
+        with app.app_context():
+            u, u2, u3 = User.query.all()
+            u.following.append(u2)
+            u3.following.append(u)
+            db.session.commit()
+            # refresh the expired instances before counting
+            u_id, u2_id, u3_id = u.id, u2.id, u3.id
+
+            statements = []
+            def count(*args):
+                statements.append(args)
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                u.load_following([u2, u3])
+                self.assertTrue(u.is_following(u2))
+                self.assertFalse(u.is_following(u3))
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+            self.assertEqual(len(statements), 1)
+            self.assertTrue(u.is_followed_by(u3))
+            self.assertFalse(u.is_followed_by(u2))
@@ -9,6 +9,7 @@ import os
 from unittest import TestCase
 from models import db, User, Message, Follows
 from sqlalchemy import exc
+from pagination import PAGE_SIZE
 
 # Now we can import app
 
@@ -142,4 +143,45 @@ class UserViewsTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn(f'<p>@{self.u2_username}</p>', html)
 
-            
\ No newline at end of file
+    def test_user_followers_pagination(self):
+        """ Followers are paged by id with an `after` link """
+        with app.app_context():
+            first = db.session.execute(db.insert(User).returning(User.id), [
+                dict(email=f"fan{i}@test.com", username=f"fan{i}",
+                     password="HASHED_PASSWORD") for i in range(PAGE_SIZE)]).scalars().all()
+            db.session.execute(db.insert(Follows), [
+                dict(user_following_id=fan_id, user_being_followed_id=self.u_id)
+                for fan_id in first])
+            db.session.commit()
+
+        url = f'/users/{self.u_id}/followers'
+        with self.client as c:
+            with c.session_transaction() as session:
+                session["curr_user"] = self.u_id
+            html = c.get(url).get_data(as_text=True)
+            self.assertEqual(html.count('<p>@fan'), PAGE_SIZE - 1)
+            self.assertIn(f'href="?after={first[-2]}"', html)
+
+            html = c.get(f'{url}?after={first[-2]}').get_data(as_text=True)
+            self.assertEqual(html.count('<p>@fan'), 1)
+            self.assertNotIn('id="more-users"', html)
+
+    def test_user_details_pagination(self):
+        """ Profile messages are paged with a `before` cursor """
+        with app.app_context():
+            # one message exists already; fill the first page and spill one over
+            db.session.add_all([Message(text=f"page message {i}", user_id=self.u_id)
+                                for i in range(PAGE_SIZE)])
+            db.session.commit()
+
+        with self.client as c:
+            resp = c.get(f'/users/{self.u_id}')
+            html = resp.get_data(as_text=True)
+            self.assertEqual(html.count('class="list-group-item"'), PAGE_SIZE)
+            self.assertIn('id="older-messages"', html)
+            cursor = html.split('href="?before=')[1].split('"')[0]
+
+            resp = c.get(f'/users/{self.u_id}?before={cursor}')
+            html = resp.get_data(as_text=True)
+            self.assertEqual(html.count('class="list-group-item"'), 1)
+            self.assertNotIn('id="older-messages"', html)
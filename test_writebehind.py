@@ -0,0 +1,193 @@
+"""Write-behind likes and follows tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_writebehind.py
+
+
+import os
+from unittest import TestCase
+from models import db, Follows, Likes, Message, TimelineEntry, User
+
+from app import app, CURR_USER_KEY
+import graph
+import identity
+import timeline
+import writebehind
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+
+class WriteBehindTestCase(TestCase):
+    """Test buffering likes and follows and writing them in batches."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+        self.client = app.test_client()
+        app.config.update({
+            "TESTING": True,
+            "SQLALCHEMY_ECHO": False,
+            "SQLALCHEMY_DATABASE_URI": os.environ.get('DATABASE_URL', 'postgresql:///warbler-test'),
+            "DEBUG_TB_HOSTS": ["dont-show-debug-toolbar"],
+            "WTF_CSRF_ENABLED": False,
+            "WRITE_BEHIND": True,
+            # flushed by the tests themselves
+            "WRITE_BEHIND_INTERVAL": 3600,
+            })
+
+        with app.app_context():
+            Likes.query.delete()
+            TimelineEntry.query.delete()
+            Message.query.delete()
+            Follows.query.delete()
+            User.query.delete()
+
+            users = [User(email=f"{name}@test.com", username=name, password="HASHED_PASSWORD")
+                     for name in ("ann", "bob", "cat")]
+            db.session.add_all(users)
+            db.session.flush()
+            msg = Message(text="going viral", user_id=users[1].id)
+            db.session.add(msg)
+            db.session.commit()
+            self.ann_id, self.bob_id, self.cat_id = (user.id for user in users)
+            self.msg_id = msg.id
+
+        identity.users.clear()
+        timeline.forget_celebrities()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        with app.app_context():
+            writebehind.flush()
+            db.session.rollback()
+        app.config['WRITE_BEHIND'] = False
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_likes_batched(self):
+        """ Likes are acknowledged at once and written together """
+        with self.client as c:
+            for user_id in (self.ann_id, self.bob_id, self.cat_id):
+                self.login(c, user_id)
+                resp = c.post(f"/api/messages/{self.msg_id}/like")
+                self.assertTrue(resp.json["liked"])
+            self.assertEqual(resp.json["likes"], 3)
+
+            resp = c.post("/api/messages/0/like")
+            self.assertEqual(resp.status_code, 404)
+
+        with app.app_context():
+            self.assertEqual(Likes.query.count(), 0)
+            self.assertEqual(writebehind.flush(), 3)
+
+            self.assertEqual(Likes.query.count(), 3)
+            self.assertEqual(db.session.get(User, self.ann_id).likes_count, 1)
+            self.assertEqual(writebehind.likes_delta(self.msg_id), 0)
+
+    def test_like_unlike_cancels(self):
+        """ A like then an unlike of the same pair writes nothing """
+        with self.client as c:
+            self.login(c, self.ann_id)
+            c.post(f"/users/add_like/{self.msg_id}")
+            c.post(f"/users/add_like/{self.msg_id}")
+
+        with app.app_context():
+            self.assertEqual(writebehind.flush(), 0)
+            self.assertEqual(Likes.query.count(), 0)
+
+            # and an unlike of an existing like is written
+            db.session.add(Likes(user_id=self.ann_id, message_id=self.msg_id))
+            db.session.commit()
+        with self.client as c:
+            self.login(c, self.ann_id)
+            resp = c.delete(f"/api/messages/{self.msg_id}/like")
+            self.assertEqual(resp.json["likes"], 0)
+        with app.app_context():
+            self.assertEqual(writebehind.flush(), 1)
+            self.assertEqual(Likes.query.count(), 0)
+
+    def test_follows(self):
+        """ Follows show in the graph at once and reach the tables on flush """
+        with self.client as c:
+            self.login(c, self.ann_id)
+            c.post(f"/users/follow/{self.bob_id}")
+            c.post(f"/users/follow/{self.cat_id}")
+            c.post(f"/users/stop-following/{self.cat_id}")
+
+            with app.app_context():
+                self.assertTrue(graph.is_following(self.ann_id, self.bob_id))
+                self.assertFalse(graph.is_following(self.ann_id, self.cat_id))
+                self.assertEqual(Follows.query.count(), 0)
+
+                self.assertEqual(writebehind.flush(), 1)
+                self.assertEqual(Follows.query.count(), 1)
+                self.assertEqual(db.session.get(User, self.bob_id).followers_count, 1)
+                self.assertEqual(db.session.get(User, self.ann_id).following_count, 1)
+                self.assertEqual(timeline.home_message_ids(self.ann_id), [self.msg_id])
+                self.assertTrue(graph.is_following(self.ann_id, self.bob_id))
+
+    def test_max_pending(self):
+        """ The request that fills the buffer writes it """
+        app.config['WRITE_BEHIND_MAX_PENDING'] = 2
+        try:
+            with self.client as c:
+                self.login(c, self.ann_id)
+                c.post(f"/users/follow/{self.bob_id}")
+                with app.app_context():
+                    self.assertEqual(Follows.query.count(), 0)
+                c.post(f"/users/follow/{self.cat_id}")
+                with app.app_context():
+                    self.assertEqual(Follows.query.count(), 2)
+        finally:
+            app.config['WRITE_BEHIND_MAX_PENDING'] = 10000
+
+    def test_follow_then_post(self):
+        """ A post made before the buffered follow is written doesn't wedge the flush """
+        with self.client as c:
+            self.login(c, self.ann_id)
+            c.post(f"/users/follow/{self.bob_id}")
+            self.login(c, self.bob_id)
+            c.post("/messages/new", data={"text": "posted meanwhile"})
+
+        with app.app_context():
+            self.assertEqual(writebehind.flush(), 1)
+            self.assertEqual(len(timeline.home_message_ids(self.ann_id)), 2)
+
+    def test_failing_change_dropped(self):
+        """ A change that keeps failing is dropped after WRITE_BEHIND_MAX_ATTEMPTS """
+        app.config['WRITE_BEHIND_MAX_ATTEMPTS'] = 2
+        with app.app_context():
+            db.session.execute(db.text(
+                "CREATE FUNCTION refuse_like() RETURNS trigger AS $$ "
+                "BEGIN RAISE EXCEPTION 'refused'; END $$ LANGUAGE plpgsql; "
+                "CREATE TRIGGER refuse_like BEFORE INSERT ON likes "
+                "FOR EACH ROW EXECUTE FUNCTION refuse_like()"))
+            db.session.commit()
+        try:
+            with self.client as c:
+                self.login(c, self.ann_id)
+                c.post(f"/api/messages/{self.msg_id}/like")
+
+            with app.app_context():
+                dropped = writebehind.dropped
+                with self.assertRaises(Exception):
+                    writebehind.flush()
+                self.assertEqual(writebehind.likes_delta(self.msg_id), 1)
+                with self.assertRaises(Exception):
+                    writebehind.flush()
+                self.assertEqual(writebehind.dropped, dropped + 1)
+                self.assertEqual(writebehind.likes_delta(self.msg_id), 0)
+                self.assertEqual(writebehind.flush(), 0)
+        finally:
+            app.config['WRITE_BEHIND_MAX_ATTEMPTS'] = 5
+            with app.app_context():
+                db.session.execute(db.text(
+                    "DROP TRIGGER refuse_like ON likes; DROP FUNCTION refuse_like()"))
+                db.session.commit()
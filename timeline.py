@@ -0,0 +1,324 @@
+"""Precomputed home timelines for Warbler.
+
+New messages are pushed into the timelines of the author's followers when
+they are posted (fan-out-on-write), so the homepage only has to read a
+bounded list of message ids for the current user and load those messages.
+
+Authors with a very large following ("celebrities") are not fanned out;
+their messages are merged into the timeline when it is read instead. An
+author stays a celebrity once a message of theirs has been left out of
+fan-out, even if their following shrinks again: those messages are in no
+timeline, so they can only be merged in.
+
+Timelines are trimmed back to TIMELINE_LENGTH entries now and then: each
+message trims a sample of the timelines it lands in.
+"""
+
+import random
+import time
+
+from models import db, Follows, Message, TimelineEntry, User
+from pagination import PAGE_SIZE, Page, before, decode_cursor, paginate
+import feed
+
+# followers above which an author's messages are merged in at read time
+CELEBRITY_FOLLOWERS = 10000
+
+# how long the set of celebrity ids is reused before being recomputed
+CELEBRITY_TTL = 60
+
+# how many of a newly followed user's messages get pushed into a timeline
+FOLLOW_BACKFILL = 100
+
+# entries kept per timeline by `rebuild` and `trim`
+TIMELINE_LENGTH = 800
+
+# each timeline a message is pushed into is trimmed with a 1 in TRIM_EVERY
+# chance, so timelines hover a little above TIMELINE_LENGTH
+TRIM_EVERY = 100
+
+# rows per INSERT when fanning a message out
+FANOUT_BATCH = 1000
+
+_celebrities = (0, frozenset())
+
+
+def celebrity_ids():
+    """Return the ids of users followed by more than CELEBRITY_FOLLOWERS,
+    and of those who were when they posted.
+
+    The set is cached for CELEBRITY_TTL seconds.
+    """
+
+    global _celebrities
+
+    expires, ids = _celebrities
+    if expires > time.monotonic():
+        return ids
+
+    ids = frozenset(db.session.execute(
+        db.select(User.id)
+        .where(db.or_(User.followers_count > CELEBRITY_FOLLOWERS,
+                      User.celebrity))
+    ).scalars())
+    _celebrities = (time.monotonic() + CELEBRITY_TTL, ids)
+    return ids
+
+
+def forget_celebrities():
+    """Drop the cached celebrity set so the next read recomputes it."""
+
+    global _celebrities
+    _celebrities = (0, frozenset())
+
+
+def follower_ids(user_id):
+    """Ids of the users following `user_id`.
+
+    Not from the follow graph: it can be GRAPH_TTL behind other processes'
+    follows, and a message missed by fan-out is never delivered.
+    """
+
+    return db.session.execute(
+        db.select(Follows.user_following_id)
+        .where(Follows.user_being_followed_id == user_id)
+    ).scalars().all()
+
+
+def push_message(msg):
+    """Fan a newly created message out to its author's followers.
+
+    The author always gets the message in their own timeline; celebrity
+    messages stop there and are picked up by followers at read time.
+    """
+
+    recipients = [msg.user_id]
+    if msg.user_id not in celebrity_ids():
+        recipients += follower_ids(msg.user_id)
+    else:
+        # the message reaches followers only by being merged in, from now on
+        db.session.execute(
+            db.update(User)
+            .where(User.id == msg.user_id)
+            .where(User.celebrity.is_(False))
+            .values(celebrity=True))
+
+    rows = [dict(user_id=user_id,
+                 message_id=msg.id,
+                 author_id=msg.user_id,
+                 timestamp=msg.timestamp)
+            for user_id in recipients]
+
+    for start in range(0, len(rows), FANOUT_BATCH):
+        db.session.execute(db.insert(TimelineEntry),
+                           rows[start:start + FANOUT_BATCH])
+
+    sample = [user_id for user_id in recipients
+              if random.random() * TRIM_EVERY < 1]
+    if sample:
+        trim(sample)
+
+
+def remove_message(message_id):
+    """Remove a deleted message from every timeline it was pushed into."""
+
+    db.session.execute(
+        db.delete(TimelineEntry)
+        .where(TimelineEntry.message_id == message_id))
+
+
+def add_follow(user_id, followed_id):
+    """Backfill `user_id`'s timeline with recent messages of `followed_id`."""
+
+    if followed_id in celebrity_ids():
+        return
+
+    # messages fanned out since the follow (e.g. one buffered by
+    # writebehind) are in the timeline already
+    pushed = (db.select(TimelineEntry.message_id)
+              .where(TimelineEntry.user_id == user_id)
+              .where(TimelineEntry.message_id == Message.id))
+    recent = (db.select(db.literal(user_id),
+                        Message.id,
+                        Message.user_id,
+                        Message.timestamp)
+              .where(Message.user_id == followed_id)
+              .where(~pushed.exists())
+              .order_by(Message.timestamp.desc())
+              .limit(FOLLOW_BACKFILL))
+
+    db.session.execute(
+        db.insert(TimelineEntry)
+        .from_select(['user_id', 'message_id', 'author_id', 'timestamp'],
+                     recent))
+
+
+def remove_follow(user_id, followed_id):
+    """Drop `followed_id`'s messages from `user_id`'s timeline."""
+
+    db.session.execute(
+        db.delete(TimelineEntry)
+        .where(TimelineEntry.user_id == user_id)
+        .where(TimelineEntry.author_id == followed_id))
+
+
+def rebuild(user_id):
+    """Recompute `user_id`'s timeline from the follows and messages tables."""
+
+    db.session.execute(
+        db.delete(TimelineEntry).where(TimelineEntry.user_id == user_id))
+
+    followed = (db.select(Follows.user_being_followed_id)
+                .where(Follows.user_following_id == user_id))
+    celebrities = celebrity_ids()
+    if celebrities:
+        followed = followed.where(
+            Follows.user_being_followed_id.not_in(celebrities))
+
+    recent = (db.select(db.literal(user_id),
+                        Message.id,
+                        Message.user_id,
+                        Message.timestamp)
+              .where(db.or_(Message.user_id == user_id,
+                            Message.user_id.in_(followed)))
+              .order_by(Message.timestamp.desc())
+              .limit(TIMELINE_LENGTH))
+
+    db.session.execute(
+        db.insert(TimelineEntry)
+        .from_select(['user_id', 'message_id', 'author_id', 'timestamp'],
+                     recent))
+
+
+def rebuild_all():
+    """Recompute every user's timeline (used after seeding the database)."""
+
+    forget_celebrities()
+    for user_id in db.session.execute(db.select(User.id)).scalars().all():
+        rebuild(user_id)
+
+
+def trim(user_ids):
+    """Delete the entries of each of `user_ids` beyond their newest
+    TIMELINE_LENGTH, in one statement."""
+
+    ranked = (db.select(TimelineEntry.user_id,
+                        TimelineEntry.message_id,
+                        db.func.row_number().over(
+                            partition_by=TimelineEntry.user_id,
+                            order_by=(TimelineEntry.timestamp.desc(),
+                                      TimelineEntry.message_id.desc()))
+                        .label('position'))
+              .where(TimelineEntry.user_id.in_(user_ids))
+              .subquery())
+    old = (db.select(ranked.c.user_id, ranked.c.message_id)
+           .where(ranked.c.position > TIMELINE_LENGTH))
+
+    db.session.execute(
+        db.delete(TimelineEntry)
+        .where(db.tuple_(TimelineEntry.user_id, TimelineEntry.message_id).in_(old))
+        .execution_options(synchronize_session=False))
+
+
+def home_message_ids(user_id, limit=PAGE_SIZE, position=None):
+    """Ids of the `limit` newest messages for `user_id`'s homepage.
+
+    Reads the precomputed timeline and merges in the newest messages of
+    any celebrities the user follows. `position` is a decoded
+    `(timestamp, id)` cursor; only messages older than it are returned.
+    """
+
+    return [message_id
+            for message_id, _ in _home_rows(user_id, limit, position)]
+
+
+def home_queries(user_id, limit, position, celebrities):
+    """The selects `_home_rows` merges: the precomputed timeline and, if
+    `user_id` may follow any `celebrities`, their newest messages."""
+
+    query = (db.select(TimelineEntry.message_id, TimelineEntry.timestamp)
+             .where(TimelineEntry.user_id == user_id))
+    if position:
+        query = query.where(before(TimelineEntry.timestamp,
+                                   TimelineEntry.message_id,
+                                   position))
+    queries = [query
+               .order_by(TimelineEntry.timestamp.desc(),
+                         TimelineEntry.message_id.desc())
+               .limit(limit)]
+
+    if celebrities:
+        followed = (db.select(Follows.user_being_followed_id)
+                    .where(Follows.user_following_id == user_id)
+                    .where(Follows.user_being_followed_id.in_(celebrities)))
+        query = (db.select(Message.id, Message.timestamp)
+                 .where(Message.user_id.in_(followed)))
+        if position:
+            query = query.where(before(Message.timestamp, Message.id,
+                                       position))
+        queries.append(query
+                       .order_by(Message.timestamp.desc(), Message.id.desc())
+                       .limit(limit))
+    return queries
+
+
+def merge_home_rows(results, limit):
+    """The newest `limit` of the `(message_id, timestamp)` rows in `results`."""
+
+    # an author can cross the celebrity threshold after being fanned out,
+    # so the same message may come from both sources
+    newest = {message_id: timestamp
+              for rows in results for message_id, timestamp in rows}
+    ordered = sorted(newest.items(),
+                     key=lambda item: (item[1], item[0]),
+                     reverse=True)
+    return ordered[:limit]
+
+
+def _home_rows(user_id, limit, position):
+    """`(message_id, timestamp)` pairs for the homepage, newest first."""
+
+    queries = home_queries(user_id, limit, position, celebrity_ids())
+    return merge_home_rows([db.session.execute(query).all()
+                            for query in queries], limit)
+
+
+def home_version(user_id):
+    """A stamp that changes whenever `user_id`'s homepage would.
+
+    Made of the user's version (their own posts, follows and likes, and
+    profile edits or deletions of users they follow), the size and
+    newest entry of their timeline, and the newest message of any
+    celebrity they follow, read in a single query.
+    """
+
+    entries = (db.select(db.func.count(), db.func.max(TimelineEntry.message_id))
+               .where(TimelineEntry.user_id == user_id)
+               .subquery())
+    columns = [db.select(User.version).where(User.id == user_id).scalar_subquery(),
+               entries.c[0],
+               entries.c[1]]
+
+    celebrities = celebrity_ids()
+    if celebrities:
+        followed = (db.select(Follows.user_being_followed_id)
+                    .where(Follows.user_following_id == user_id)
+                    .where(Follows.user_being_followed_id.in_(celebrities)))
+        columns.append(db.select(db.func.max(Message.id))
+                       .where(Message.user_id.in_(followed))
+                       .scalar_subquery())
+
+    return tuple(db.session.execute(db.select(*columns)).one())
+
+
+def home_page(user_id, cursor=None, limit=PAGE_SIZE):
+    """A Page of `user_id`'s homepage messages (as FeedItems), newest first.
+
+    `cursor` is the `next_cursor` of the previous page, if any.
+    """
+
+    rows = _home_rows(user_id, limit + 1, decode_cursor(cursor))
+    page = paginate(rows, limit, key=lambda row: (row[1], row[0]))
+
+    ids = [message_id for message_id, _ in page.items]
+    return Page(feed.messages_by_ids(ids, viewer_id=user_id), page.next_cursor)
@@ -0,0 +1,372 @@
+"""Write-behind buffering of likes and follows.
+
+With WRITE_BEHIND on, liking, unliking, following and unfollowing don't
+write to the database during the request. The change is checked and
+acknowledged, then kept in memory. A background thread writes everything
+buffered in one transaction of multi-row statements. It does so every
+WRITE_BEHIND_INTERVAL seconds, or sooner once WRITE_BEHIND_BATCH changes
+are waiting. A viral post's likes become a few statements a second rather
+than a commit each.
+
+Changes to the same pair collapse: only the latest state of a (user,
+message) like or a (follower, followed) follow is kept. A change that
+ends where it started, such as a like then an unlike, is dropped without
+writing anything.
+
+Buffered changes are lost if the process dies without shutting down. At
+most WRITE_BEHIND_INTERVAL seconds' worth can be lost, and never more
+than WRITE_BEHIND_MAX_PENDING changes: when that many are waiting, the
+request adding the next one flushes them itself. The flusher thread
+belongs to the app (`app.extensions['writebehind']`) and is started by
+its first buffered change; stopping it, at exit, writes whatever is left.
+
+A flush that fails keeps its changes buffered for the next one. A change
+that has been part of WRITE_BEHIND_MAX_ATTEMPTS failed flushes is
+dropped and logged instead, so one bad change can't wedge the buffer.
+
+The flush checks which pairs actually exist before writing, so writes
+made meanwhile by other processes are respected. It updates counters,
+timelines and the follow graph the way the synchronous views do. This
+process's follow graph changes straight away.
+"""
+
+import atexit
+import os
+import threading
+from collections import Counter
+
+from flask import current_app
+
+from models import db, Follows, Likes, Message, User
+import counters
+import graph
+import identity
+import likes
+import timeline
+
+_pending = {}
+# changes being written by the flush in progress
+_inflight = {}
+# message_id -> change its like count will see once everything is written
+_likes_delta = Counter()
+# key -> failed flushes it was part of
+_attempts = Counter()
+_lock = threading.Lock()
+_flushing = threading.Lock()
+
+flushed = 0
+failures = 0
+dropped = 0
+
+
+def _current(key, load):
+    """The state of `key` after everything buffered, else `load()`."""
+
+    with _lock:
+        for changes in (_pending, _inflight):
+            if key in changes:
+                return changes[key][1]
+    return load()
+
+
+def _set(key, now, was):
+    """Buffer `key`'s new state; `was` is its state before the change."""
+
+    with _lock:
+        if key in _pending:
+            was = _pending[key][0]
+            before = _pending[key][1]
+        else:
+            if key in _inflight:
+                was = _inflight[key][1]
+            before = was
+
+        if now == was:
+            _pending.pop(key, None)
+            _attempts.pop(key, None)
+        else:
+            _pending[key] = (was, now)
+        if key[0] == 'like' and now != before:
+            _likes_delta[key[2]] += 1 if now else -1
+        waiting = len(_pending)
+
+    # the request's reads should come from the primary for a while
+    db.session.info['wrote'] = True
+
+    flusher = current_app.extensions['writebehind']
+    flusher.start()
+    if waiting >= current_app.config['WRITE_BEHIND_MAX_PENDING']:
+        # the change is buffered either way; a failed flush is retried
+        with current_app.app_context():
+            try:
+                flush()
+            except Exception:
+                current_app.logger.exception(
+                    "Writing buffered likes and follows failed")
+    elif waiting >= current_app.config['WRITE_BEHIND_BATCH']:
+        flusher.wake.set()
+
+
+def set_like(user_id, message_id, liked):
+    """Like (or unlike) a message.
+
+    Returns whether that changed anything, or None if there's no such
+    message.
+    """
+
+    key = ('like', user_id, message_id)
+    was = _current(key, lambda: likes.state(user_id, message_id))
+    if was is None:
+        return None
+    _set(key, liked, was)
+    return was != liked
+
+
+def toggle_like(user_id, message_id):
+    """Like the message if it isn't liked, unlike it otherwise.
+
+    Returns whether it is liked afterwards, or None if there's no such
+    message.
+    """
+
+    key = ('like', user_id, message_id)
+    was = _current(key, lambda: likes.state(user_id, message_id))
+    if was is None:
+        return None
+    _set(key, not was, was)
+    return not was
+
+
+def likes_delta(message_id):
+    """How the message's like count will change once buffered likes are in."""
+
+    with _lock:
+        return _likes_delta[message_id]
+
+
+def set_follow(follower_id, followed_id, following):
+    """Follow (or unfollow) a user."""
+
+    key = ('follow', follower_id, followed_id)
+    was = _current(key, lambda: graph.is_following(follower_id, followed_id))
+    if following:
+        graph.get().follow(follower_id, followed_id)
+    else:
+        graph.get().unfollow(follower_id, followed_id)
+    _set(key, following, was)
+
+
+def flush():
+    """Write every buffered change in one transaction.
+
+    Returns how many were written. On failure they stay buffered, to be
+    retried by the next flush, except those that have now failed
+    WRITE_BEHIND_MAX_ATTEMPTS times, which are dropped.
+    """
+
+    global _pending, _inflight, flushed, failures, dropped
+
+    with _flushing:
+        with _lock:
+            batch, _pending = _pending, {}
+            _inflight = batch
+        if not batch:
+            return 0
+
+        try:
+            changed_users = _write(batch)
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            max_attempts = current_app.config['WRITE_BEHIND_MAX_ATTEMPTS']
+            given_up = {}
+            with _lock:
+                for key, (was, now) in batch.items():
+                    if key in _pending:
+                        now = _pending.pop(key)[1]
+                    _attempts[key] += 1
+                    if now == was:
+                        del _attempts[key]
+                    elif _attempts[key] >= max_attempts:
+                        given_up[key] = (was, now)
+                    else:
+                        _pending[key] = (was, now)
+                _inflight = {}
+                _settle(given_up)
+                failures += 1
+                dropped += len(given_up)
+            if given_up:
+                current_app.logger.error(
+                    "Dropped %d buffered changes after %d failed writes: %s",
+                    len(given_up), max_attempts, sorted(given_up))
+                if any(key[0] == 'follow' for key in given_up):
+                    # set_follow changed this process's graph already
+                    graph.forget()
+            raise
+
+        with _lock:
+            _inflight = {}
+            _settle(batch)
+            flushed += len(batch)
+
+    identity.forget(*changed_users)
+    return len(batch)
+
+
+def _settle(batch):
+    """Forget the buffered state of `batch`, written or dropped."""
+
+    for key, (was, now) in batch.items():
+        _attempts.pop(key, None)
+        kind, _, message_id = key
+        if kind == 'like':
+            _likes_delta[message_id] -= now - was
+            if not _likes_delta[message_id]:
+                del _likes_delta[message_id]
+
+
+def _write(batch):
+    """Apply `batch` to the database. Returns the users whose counters changed."""
+
+    like_states = {(user_id, message_id): now
+                   for (kind, user_id, message_id), (_, now) in batch.items()
+                   if kind == 'like'}
+    follow_states = {(follower_id, followed_id): now
+                     for (kind, follower_id, followed_id), (_, now) in batch.items()
+                     if kind == 'follow'}
+    changed_users = set()
+
+    if like_states:
+        liked = _existing(Likes.user_id, Likes.message_id, like_states)
+        messages = set(db.session.execute(
+            db.select(Message.id)
+            .where(Message.id.in_({pair[1] for pair in like_states}))).scalars())
+        added = [pair for pair, now in like_states.items()
+                 if now and pair not in liked and pair[1] in messages]
+        removed = [pair for pair, now in like_states.items()
+                   if not now and pair in liked]
+
+        if added:
+            db.session.execute(db.insert(Likes).values(
+                [dict(user_id=user_id, message_id=message_id)
+                 for user_id, message_id in added]))
+        if removed:
+            db.session.execute(
+                db.delete(Likes)
+                .where(db.tuple_(Likes.user_id, Likes.message_id).in_(removed))
+                .execution_options(synchronize_session=False))
+
+        deltas = Counter(user_id for user_id, _ in added)
+        deltas.subtract(user_id for user_id, _ in removed)
+        counters.bump_each('likes_count', deltas)
+        changed_users.update(deltas)
+
+    if follow_states:
+        following = _existing(Follows.user_following_id,
+                              Follows.user_being_followed_id, follow_states)
+        users = set(db.session.execute(
+            db.select(User.id)
+            .where(User.id.in_({user_id for pair in follow_states
+                                for user_id in pair}))).scalars())
+        added = [pair for pair, now in follow_states.items()
+                 if now and pair not in following
+                 and pair[0] in users and pair[1] in users]
+        removed = [pair for pair, now in follow_states.items()
+                   if not now and pair in following]
+
+        if added:
+            graph.follow_many(added)
+        if removed:
+            graph.unfollow_many(removed)
+        for follower_id, followed_id in added:
+            timeline.add_follow(follower_id, followed_id)
+        for follower_id, followed_id in removed:
+            timeline.remove_follow(follower_id, followed_id)
+
+        following_deltas = Counter(follower_id for follower_id, _ in added)
+        following_deltas.subtract(follower_id for follower_id, _ in removed)
+        followers_deltas = Counter(followed_id for _, followed_id in added)
+        followers_deltas.subtract(followed_id for _, followed_id in removed)
+        counters.bump_each('following_count', following_deltas)
+        counters.bump_each('followers_count', followers_deltas)
+        changed_users.update(following_deltas, followers_deltas)
+
+    return changed_users
+
+
+def _existing(first, second, pairs):
+    """Which of `pairs` are rows of (`first`, `second`)."""
+
+    return {tuple(row) for row in db.session.execute(
+        db.select(first, second)
+        .where(db.tuple_(first, second).in_(list(pairs))))}
+
+
+class Flusher:
+    """An app's background thread, writing the buffer every
+    WRITE_BEHIND_INTERVAL seconds (or when woken)."""
+
+    def __init__(self, app):
+        self.app = app
+        self.thread = None
+        self.pid = None
+        self.wake = threading.Event()
+        self.stopping = False
+
+    def start(self):
+        """Start this process's thread, if it isn't running."""
+
+        with _lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.stopping = False
+                self.thread = threading.Thread(target=self.run, name='writebehind',
+                                               daemon=True)
+                self.thread.start()
+                self.pid = os.getpid()
+
+    def run(self):
+        while not self.stopping:
+            self.wake.wait(self.app.config['WRITE_BEHIND_INTERVAL'])
+            self.wake.clear()
+            with self.app.app_context():
+                try:
+                    flush()
+                except Exception:
+                    self.app.logger.exception(
+                        "Writing buffered likes and follows failed")
+
+    def stop(self):
+        """Stop the thread and write whatever is still buffered."""
+
+        thread = self.thread
+        if thread is None or self.pid != os.getpid():
+            return
+        self.stopping = True
+        self.wake.set()
+        thread.join()
+        self.thread = None
+        if _pending:
+            with self.app.app_context():
+                flush()
+
+
+def render():
+    """The buffer's counters, in Prometheus text format."""
+
+    return "\n".join([
+        "# TYPE warbler_write_behind_pending gauge",
+        f"warbler_write_behind_pending {len(_pending)}",
+        "# TYPE warbler_write_behind_flushed_total counter",
+        f"warbler_write_behind_flushed_total {flushed}",
+        "# TYPE warbler_write_behind_failures_total counter",
+        f"warbler_write_behind_failures_total {failures}",
+        "# TYPE warbler_write_behind_dropped_total counter",
+        f"warbler_write_behind_dropped_total {dropped}",
+    ])
+
+
+def init_writebehind(app):
+    """Flush `app`'s buffered writes in the background and at exit."""
+
+    app.extensions['writebehind'] = flusher = Flusher(app)
+    atexit.register(flusher.stop)
@@ -0,0 +1,16 @@
+"""The production app, for WSGI servers:
+
+    gunicorn --preload --workers 4 wsgi:app
+
+With --preload the master imports this module, so `preload` runs once
+there and the forked workers share what it loaded. The profile can be
+changed with WARBLER_PROFILE; set PRELOAD=0 to skip the warm-up.
+"""
+
+import os
+
+from app import create_app, preload
+
+app = create_app(os.environ.get('WARBLER_PROFILE', 'production'))
+if app.config['PRELOAD']:
+    preload(app)